@@ -0,0 +1,91 @@
+"""
+Executor for the CPU-bound part of a sync.
+
+Language detection, keyword scoring, MinHash signatures and embeddings are
+pure functions of the message text, so they can run in a thread or process
+pool while the event loop keeps Telegram and OpenAI requests moving.
+Telethon messages hold client references and don't pickle, so they are
+reduced to MessageRow tuples on the loop as soon as they are fetched.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+from dedup import minhash
+from search_index import embed
+
+ANALYSIS_EXECUTOR = os.getenv('TG_ANALYSIS_EXECUTOR', 'thread')  # 'thread' or 'process'
+ANALYSIS_WORKERS = int(os.getenv('TG_ANALYSIS_WORKERS', '0')) or os.cpu_count() or 1
+
+# Attribute names match Telethon's Message, so the scoring helpers, store.save_messages
+# and the dedup detector accept either. A row is a plain tuple (no per-instance
+# dict), and it holds no raw TL payload, entities or client reference.
+MessageRow = namedtuple('MessageRow', 'id date sender_id text type reply_to_msg_id mentioned',
+                        defaults=(None, False))
+
+
+def message_row(msg, msg_type: str) -> MessageRow:
+    # msg.text re-renders the entities on every access, so it is read once here
+    return MessageRow(msg.id, msg.date, msg.sender_id, msg.text, msg_type,
+                      msg.reply_to_msg_id, bool(getattr(msg, 'mentioned', False)))
+
+def message_features(rows: Sequence[MessageRow]) -> Dict:
+    """Per-message dedup signatures and search vectors for a batch."""
+    return {
+        'signatures': {r.id: minhash(r.text) for r in rows},
+        'vectors': embed(r.text or '' for r in rows),
+    }
+
+def _timed(fn: Callable, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class AnalysisPool:
+    """Runs analysis callables off the event loop and tracks how busy it is."""
+
+    def __init__(self, kind: str = ANALYSIS_EXECUTOR, workers: int = ANALYSIS_WORKERS):
+        self.kind = kind
+        self.workers = workers
+        if kind == 'process':
+            # spawn, not fork: the parent has a running event loop and threads
+            self._executor: Executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self._started = time.monotonic()
+        self._submitted = 0
+        self._completed = 0
+        self._busy = 0.0
+
+    async def submit(self, fn: Callable, *args):
+        """Run fn(*args) in the pool and await its result. fn must be picklable in process mode."""
+        self._submitted += 1
+        try:
+            result, elapsed = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _timed, fn, *args)
+        finally:
+            self._completed += 1
+        self._busy += elapsed
+        return result
+
+    def stats(self) -> Dict:
+        in_flight = self._submitted - self._completed
+        wall = max(time.monotonic() - self._started, 1e-9)
+        return {
+            'kind': self.kind,
+            'workers': self.workers,
+            'queue_depth': max(0, in_flight - self.workers),
+            'running': min(in_flight, self.workers),
+            'completed': self._completed,
+            'utilization': min(1.0, self._busy / (wall * self.workers)),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
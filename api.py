@@ -0,0 +1,433 @@
+"""
+Read-only JSON API over telegram.db, for tools that are not the dashboards.
+
+Serves chats, messages, summaries, opportunities, metrics and the changelog
+from the local store over HTTP (Tornado, which Streamlit already depends
+on). Every response carries an ETag made from the database's data version
+plus the request URI. The data version is bumped whenever another
+connection commits (PRAGMA data_version). A poller that sends
+If-None-Match gets a 304 with no query run at all. Responses that include
+live urgency (chats, metrics) also roll over every minute, like the
+dashboards' views. Bodies are cached per ETag, so pollers sharing a URL
+share one query.
+
+    GET /                               endpoints and the current data version
+    GET /chats                          ?min_urgency= &max_urgency= &is_group= &since= &until= &account=
+                                        &sort=urgency|last_message_date &fields= &limit= &offset=
+    GET /chats/<chat_id>                ?account=
+    GET /chats/<chat_id>/messages       ?before=<message_id> &since= &until= &account= &fields= &limit=
+    GET /summaries                      ?chat_id= &fields= &limit= &offset=
+    GET /opportunities                  ?service= &chat_id= &since= &until= &fields= &limit= &offset=
+    GET /metrics
+    GET /changes                        ?since=<seq> &kinds=a,b &limit=
+
+Lists return {"items": [...], "next": <query for the next page or null>}.
+Dates are ISO 8601; `fields` is a comma-separated subset of the item keys.
+With several accounts (multi_sync.py) a chat has one row per account;
+`account` picks one, else /chats/<chat_id> returns the first.
+
+Usage:
+    python api.py [--port 8765] [--host 127.0.0.1] [--db telegram.db]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+import changelog
+from cli import metrics
+from urgency import current_urgency
+
+DB_FILE = 'telegram.db'
+PORT = 8765
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+CACHE_ENTRIES = 256
+
+CHAT_FIELDS = ('chat_id', 'name', 'is_group', 'account', 'unread_count', 'last_message_date',
+               'urgency_score', 'urgency_base', 'needs_followup', 'last_reply_date', 'reply_status')
+MESSAGE_FIELDS = ('chat_id', 'message_id', 'date', 'sender_id', 'text', 'reply_to_msg_id', 'is_mention', 'account')
+SUMMARY_FIELDS = ('chat_id', 'summary', 'source', 'created_at')
+OPPORTUNITY_FIELDS = ('chat_id', 'message_id', 'service', 'timestamp', 'account')
+
+
+def _parse_date(value) -> Optional[datetime]:
+    if not value:
+        return None
+    dt = datetime.fromisoformat(str(value))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class Store:
+    """A read-only connection to telegram.db plus its data version and a response cache."""
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.boot = format(int(time.time()), 'x')  # ETags never survive a restart
+        self.generation = 0
+        self._data_version = None
+        self.cache: OrderedDict = OrderedDict()
+
+    def connect(self) -> Optional[sqlite3.Connection]:
+        if self.conn is None and os.path.exists(self.path):
+            self.conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            self.conn.row_factory = sqlite3.Row
+        return self.conn
+
+    def version(self) -> str:
+        conn = self.connect()
+        if conn is not None:
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self.generation += 1
+                self.cache.clear()
+        return f'{self.boot}.{self.generation}'
+
+    def tables(self) -> set:
+        conn = self.connect()
+        return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")} if conn else set()
+
+    def columns(self, table: str) -> set:
+        return {r[1] for r in self.conn.execute(f'PRAGMA table_info({table})')}
+
+    def cached(self, key: str, build: Callable[[], bytes]) -> bytes:
+        if key not in self.cache:
+            self.cache[key] = build()
+            if len(self.cache) > CACHE_ENTRIES:
+                self.cache.popitem(last=False)
+        return self.cache[key]
+
+
+# === Queries ===
+def _project(rows: List[Dict], fields: Optional[Sequence[str]]) -> List[Dict]:
+    return [{f: r.get(f) for f in fields} for r in rows] if fields else rows
+
+def _page(items: List, params: Dict, offset: int, limit: int, more: bool) -> Dict:
+    return {'items': items, 'next': urlencode({**params, 'offset': offset + limit}) if more else None}
+
+def query_chats(store: Store, is_group: Optional[bool] = None, since: Optional[datetime] = None,
+                until: Optional[datetime] = None, account: Optional[str] = None) -> List[Dict]:
+    """Chats matching the SQL-side filters, with urgency decayed to now."""
+    if 'chats' not in store.tables():
+        return []
+    cols = store.columns('chats')
+    sql, args = 'SELECT * FROM chats WHERE 1 = 1', []
+    if is_group is not None:
+        sql += ' AND is_group = ?'
+        args.append(int(is_group))
+    if since:
+        sql += ' AND datetime(last_message_date) >= datetime(?)'
+        args.append(since.isoformat())
+    if until:
+        sql += ' AND datetime(last_message_date) < datetime(?)'
+        args.append(until.isoformat())
+    if account and 'account' in cols:
+        sql += ' AND account = ?'
+        args.append(account)
+    now = datetime.now(timezone.utc)
+    out = []
+    for row in store.conn.execute(sql, args):
+        r = {f: row[f] if f in cols else None for f in CHAT_FIELDS}
+        r['is_group'] = bool(r['is_group'])
+        r['needs_followup'] = bool(r['needs_followup'])
+        last = _parse_date(r['last_message_date'])
+        if r['urgency_base'] is not None:
+            r['urgency_score'] = current_urgency(r['urgency_base'], last, now)
+        r['last_message_date'] = last.isoformat() if last else None
+        out.append(r)
+    return out
+
+def query_messages(store: Store, chat_id: int, before: Optional[int], since: Optional[datetime],
+                   until: Optional[datetime], limit: int, account: Optional[str] = None) -> List[Dict]:
+    if 'messages' not in store.tables():
+        return []
+    cols = store.columns('messages')
+    sql, args = 'SELECT * FROM messages WHERE chat_id = ?', [chat_id]
+    if before:
+        sql += ' AND message_id < ?'
+        args.append(before)
+    if since:
+        sql += ' AND datetime(date) >= datetime(?)'
+        args.append(since.isoformat())
+    if until:
+        sql += ' AND datetime(date) < datetime(?)'
+        args.append(until.isoformat())
+    if account and 'account' in cols:
+        sql += ' AND account = ?'
+        args.append(account)
+    rows = store.conn.execute(sql + ' ORDER BY message_id DESC LIMIT ?', args + [limit]).fetchall()
+    out = []
+    for row in rows:
+        r = {f: row[f] if f in cols else None for f in MESSAGE_FIELDS}
+        r['is_mention'] = bool(r['is_mention'])
+        date = _parse_date(r['date'])
+        r['date'] = date.isoformat() if date else None
+        out.append(r)
+    return out
+
+def query_summaries(store: Store, chat_id: Optional[int] = None) -> List[Dict]:
+    """Newest summary per chat: sync summaries from the changelog, on-demand ones from `summaries`."""
+    tables = store.tables()
+    latest: Dict[int, Dict] = {}
+    if 'changelog' in tables:
+        for row in store.conn.execute(
+                "SELECT chat_id, ts, data FROM changelog WHERE seq IN "
+                "(SELECT MAX(seq) FROM changelog WHERE kind = 'summary' GROUP BY chat_id)"):
+            data = json.loads(row['data'])
+            latest[row['chat_id']] = {'chat_id': row['chat_id'], 'summary': data.get('summary'),
+                                      'source': data.get('source'), 'created_at': row['ts']}
+    if 'summaries' in tables:
+        for row in store.conn.execute('SELECT chat_id, summary, created_at FROM summaries'):
+            if row['chat_id'] not in latest or (row['created_at'] or 0) > latest[row['chat_id']]['created_at']:
+                latest[row['chat_id']] = {'chat_id': row['chat_id'], 'summary': row['summary'],
+                                          'source': 'on_demand', 'created_at': row['created_at']}
+    out = sorted(latest.values(), key=lambda r: r['created_at'] or 0, reverse=True)
+    for r in out:
+        r['created_at'] = datetime.fromtimestamp(r['created_at'], timezone.utc).isoformat() if r['created_at'] else None
+    return [r for r in out if chat_id is None or r['chat_id'] == chat_id]
+
+def query_opportunities(store: Store, service: Optional[str], chat_id: Optional[int], since: Optional[datetime],
+                        until: Optional[datetime], offset: int, limit: int) -> List[Dict]:
+    if 'opportunities' not in store.tables():
+        return []
+    cols = store.columns('opportunities')
+    sql, args = 'SELECT * FROM opportunities WHERE 1 = 1', []
+    for column, value in (('service', service), ('chat_id', chat_id)):
+        if value is not None:
+            sql += f' AND {column} = ?'
+            args.append(value)
+    if since:
+        sql += ' AND datetime(timestamp) >= datetime(?)'
+        args.append(since.isoformat())
+    if until:
+        sql += ' AND datetime(timestamp) < datetime(?)'
+        args.append(until.isoformat())
+    rows = store.conn.execute(sql + ' ORDER BY datetime(timestamp) DESC, message_id DESC LIMIT ? OFFSET ?',
+                              args + [limit, offset]).fetchall()
+    out = []
+    for row in rows:
+        r = {f: row[f] if f in cols else None for f in OPPORTUNITY_FIELDS}
+        ts = _parse_date(r['timestamp'])
+        r['timestamp'] = ts.isoformat() if ts else None
+        out.append(r)
+    return out
+
+
+# === HTTP ===
+def make_app(store: Store):
+    from tornado.web import Application, HTTPError, RequestHandler
+
+    class Handler(RequestHandler):
+        live = False  # response depends on the clock too (urgency decay)
+
+        def initialize(self, store: Store):
+            self.store = store
+
+        def set_default_headers(self):
+            self.set_header('Content-Type', 'application/json; charset=utf-8')
+            self.set_header('Cache-Control', 'no-cache')  # revalidate with If-None-Match every time
+
+        def write_error(self, status_code: int, **kwargs):
+            exc = kwargs.get('exc_info', (None, None))[1]
+            self.finish(json.dumps({'error': getattr(exc, 'log_message', None) or self._reason}))
+
+        # --- parameters ---
+        def int_arg(self, name: str, default: Optional[int] = None) -> Optional[int]:
+            value = self.get_query_argument(name, None)
+            try:
+                return default if value in (None, '') else int(value)
+            except ValueError:
+                raise HTTPError(400, f"{name} must be an integer")
+
+        def bool_arg(self, name: str) -> Optional[bool]:
+            value = self.get_query_argument(name, None)
+            if value in (None, ''):
+                return None
+            if value.lower() not in ('1', '0', 'true', 'false', 'yes', 'no'):
+                raise HTTPError(400, f"{name} must be true or false")
+            return value.lower() in ('1', 'true', 'yes')
+
+        def date_arg(self, name: str) -> Optional[datetime]:
+            try:
+                return _parse_date(self.get_query_argument(name, None))
+            except ValueError:
+                raise HTTPError(400, f"{name} must be an ISO 8601 date")
+
+        def page_args(self) -> Tuple[int, int]:
+            limit = self.int_arg('limit', DEFAULT_LIMIT)
+            offset = self.int_arg('offset', 0)
+            if not 1 <= limit <= MAX_LIMIT or offset < 0:
+                raise HTTPError(400, f"limit must be 1-{MAX_LIMIT} and offset >= 0")
+            return offset, limit
+
+        def fields_arg(self, allowed: Sequence[str]) -> Optional[List[str]]:
+            value = self.get_query_argument('fields', None)
+            if not value:
+                return None
+            fields = [f.strip() for f in value.split(',') if f.strip()]
+            unknown = set(fields) - set(allowed)
+            if unknown:
+                raise HTTPError(400, f"unknown fields {sorted(unknown)}; choose from {list(allowed)}")
+            return fields
+
+        def params(self, *skip: str) -> Dict[str, str]:
+            """The query string as a dict, for building `next` links."""
+            return {k: self.get_query_argument(k) for k in self.request.query_arguments if k not in skip}
+
+        # --- response ---
+        def respond(self, build: Callable[[], object]):
+            """304 if the client's ETag still matches, else the (cached) JSON body."""
+            version = self.store.version()
+            if self.live:
+                version += f'.{int(time.time() // 60)}'
+            etag = hashlib.sha1(f'{version} {self.request.uri}'.encode()).hexdigest()[:20]
+            self.set_header('ETag', f'"{etag}"')
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+            self.finish(self.store.cached(etag, lambda: json.dumps(build(), default=str).encode()))
+
+    class IndexHandler(Handler):
+        def get(self):
+            self.respond(lambda: {'version': self.store.version(), 'db': self.store.path,
+                                  'endpoints': ['/chats', '/chats/<chat_id>', '/chats/<chat_id>/messages',
+                                                '/summaries', '/opportunities', '/metrics', '/changes']})
+
+    class ChatsHandler(Handler):
+        live = True
+
+        def get(self):
+            offset, limit = self.page_args()
+            fields = self.fields_arg(CHAT_FIELDS)
+            is_group, since, until = self.bool_arg('is_group'), self.date_arg('since'), self.date_arg('until')
+            low, high = self.int_arg('min_urgency'), self.int_arg('max_urgency')
+            sort = self.get_query_argument('sort', 'urgency')
+            if sort not in ('urgency', 'last_message_date'):
+                raise HTTPError(400, "sort must be urgency or last_message_date")
+            account = self.get_query_argument('account', None)
+
+            def build():
+                chats = [c for c in query_chats(self.store, is_group, since, until, account)
+                         if (low is None or (c['urgency_score'] or 0) >= low)
+                         and (high is None or (c['urgency_score'] or 0) <= high)]
+                key = 'urgency_score' if sort == 'urgency' else 'last_message_date'
+                chats.sort(key=lambda c: (c[key] is not None, c[key] or 0), reverse=True)
+                page = _project(chats[offset:offset + limit], fields)
+                return {**_page(page, self.params('offset'), offset, limit, offset + limit < len(chats)),
+                        'total': len(chats)}
+            self.respond(build)
+
+    class ChatHandler(Handler):
+        live = True
+
+        def get(self, chat_id: str):
+            fields = self.fields_arg(CHAT_FIELDS)
+            account = self.get_query_argument('account', None)
+
+            def build():
+                chat = next((c for c in query_chats(self.store, account=account) if c['chat_id'] == int(chat_id)), None)
+                if chat is None:
+                    raise HTTPError(404, f"chat {chat_id} not found")
+                return _project([chat], fields)[0]
+            self.respond(build)
+
+    class MessagesHandler(Handler):
+        def get(self, chat_id: str):
+            _, limit = self.page_args()
+            fields = self.fields_arg(MESSAGE_FIELDS)
+            before, since, until = self.int_arg('before'), self.date_arg('since'), self.date_arg('until')
+            account = self.get_query_argument('account', None)
+
+            def build():
+                rows = query_messages(self.store, int(chat_id), before, since, until, limit, account)
+                more = len(rows) == limit
+                return {'items': _project(rows, fields),
+                        'next': urlencode({**self.params('before'), 'before': rows[-1]['message_id']}) if more else None}
+            self.respond(build)
+
+    class SummariesHandler(Handler):
+        def get(self):
+            offset, limit = self.page_args()
+            fields = self.fields_arg(SUMMARY_FIELDS)
+            chat_id = self.int_arg('chat_id')
+
+            def build():
+                rows = query_summaries(self.store, chat_id)
+                return _page(_project(rows[offset:offset + limit], fields), self.params('offset'), offset, limit,
+                             offset + limit < len(rows))
+            self.respond(build)
+
+    class OpportunitiesHandler(Handler):
+        def get(self):
+            offset, limit = self.page_args()
+            fields = self.fields_arg(OPPORTUNITY_FIELDS)
+            service, chat_id = self.get_query_argument('service', None), self.int_arg('chat_id')
+            since, until = self.date_arg('since'), self.date_arg('until')
+
+            def build():
+                # One extra row tells whether there is a next page
+                rows = query_opportunities(self.store, service, chat_id, since, until, offset, limit + 1)
+                return _page(_project(rows[:limit], fields), self.params('offset'), offset, limit, len(rows) > limit)
+            self.respond(build)
+
+    class MetricsHandler(Handler):
+        live = True
+
+        def get(self):
+            self.respond(lambda: metrics(self.store.path))
+
+    class ChangesHandler(Handler):
+        def get(self):
+            _, limit = self.page_args()
+            since = self.int_arg('since', 0)
+            kinds = [k for k in self.get_query_argument('kinds', '').split(',') if k]
+            if set(kinds) - set(changelog.KINDS):
+                raise HTTPError(400, f"kinds must be among {list(changelog.KINDS)}")
+
+            def build():
+                if 'changelog' not in self.store.tables():
+                    return {'items': [], 'cursor': since, 'next': None}
+                records, cursor = changelog.read(self.store.conn, since, limit, kinds or None)
+                return {'items': records, 'cursor': cursor,
+                        'next': urlencode({**self.params('since'), 'since': cursor}) if len(records) == limit else None}
+            self.respond(build)
+
+    routes = [
+        (r'/', IndexHandler),
+        (r'/chats', ChatsHandler),
+        (r'/chats/(-?\d+)', ChatHandler),
+        (r'/chats/(-?\d+)/messages', MessagesHandler),
+        (r'/summaries', SummariesHandler),
+        (r'/opportunities', OpportunitiesHandler),
+        (r'/metrics', MetricsHandler),
+        (r'/changes', ChangesHandler),
+    ]
+    return Application([(path, handler, {'store': store}) for path, handler in routes])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read-only JSON API over telegram.db')
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen on (default: local only)')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--db', default=DB_FILE)
+    args = parser.parse_args()
+
+    import asyncio
+
+    async def main():
+        make_app(Store(args.db)).listen(args.port, args.host)
+        logging.info(f"Serving {args.db} on http://{args.host}:{args.port}/")
+        await asyncio.Event().wait()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -4,8 +4,21 @@ from datetime import datetime, timedelta
 import os
 import pytz
 import json
+import sqlite3
+import time
+from contextlib import closing
+
+import outbox
+import replies
+import rollups
+from exporter import ExportJob
+from search_index import SUMMARY_MESSAGE_ID, IndexSet
+from store import account_key
+from urgency import with_live_urgency
 
 CONFIG_FILE = 'config.json'
+CSV_FILE = 'tg_detailed_ww5905.csv'
+DB_FILE = 'telegram.db'
 
 def load_config():
     if os.path.exists(CONFIG_FILE):
@@ -125,10 +138,18 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load data from CSV
-@st.cache_data
-def load_data():
+def data_version():
+    """Modification time of the CSV; every cached view below is keyed on it."""
+    return os.stat(CSV_FILE).st_mtime_ns if os.path.exists(CSV_FILE) else 0
+
+def current_minute():
+    # Urgency decays in 10-minute steps, so minute-resolution views stay exact enough
+    return int(time.time() // 60)
+
+@st.cache_data(max_entries=2)
+def load_data(version):
     try:
-        df = pd.read_csv('tg_detailed_ww5905.csv')
+        df = pd.read_csv(CSV_FILE)
         date_columns = ['Last Unread Message Date', 'last_reply_date']
         for col in date_columns:
             if col in df.columns:
@@ -140,6 +161,73 @@ def load_data():
         st.error(f"Error loading data: {e}")
         return None
 
+@st.cache_data(max_entries=4)
+def live_data(version, minute):
+    return with_live_urgency(load_data(version))
+
+@st.cache_data(max_entries=4)
+def metrics_view(version, minute):
+    df = live_data(version, minute)
+    now = pd.Timestamp.now(tz='UTC')
+    return {
+        'group_unread': df[df['Is Group']]['Unread Count'].sum(),
+        'private_unread': df[~df['Is Group']]['Unread Count'].sum(),
+        'active_groups': len(df[df['Is Group'] & (df['Last Unread Message Date'] > now - pd.Timedelta(days=7))]),
+        'total_groups': len(df[df['Is Group']]),
+        'urgent_count': len(df[df['Urgency Score'] >= 7]),
+        'today_count': len(df[df['Last Unread Message Date'].dt.date == now.date()]),
+    }
+
+@st.cache_data(max_entries=4)
+def unreplied_view(version):
+    df = load_data(version)
+    return df[df['Needs Followup']].sort_values('Last Unread Message Date', ascending=False)
+
+@st.cache_data(max_entries=4)
+def suggestions_view(version, minute):
+    df = live_data(version, minute)
+    has_reply = df['AI Reply'].map(outbox.sendable)
+    if 'Last Message ID' in df.columns:
+        # Chats the sync didn't write a reply for get one on demand
+        has_reply |= df['Last Message ID'].notna()
+    return df[has_reply].sort_values('Urgency Score', ascending=False)
+
+@st.cache_data(max_entries=8)
+def activity_view(version, days):
+    """Rollup queries for the Analytics page; cheap, but re-run only when a sync lands."""
+    since = time.time() - days * rollups.DAY
+    with closing(sqlite3.connect(DB_FILE)) as conn:
+        rollups.init_tables(conn)
+        daily = pd.DataFrame(rollups.daily_volume(conn, since), columns=['Day', 'Messages'])
+        hours = pd.DataFrame(rollups.busiest_hours(conn, since), columns=['Hour (UTC)', 'Messages'])
+        chats = pd.DataFrame(rollups.totals_by(conn, 'chat_id', since), columns=['Chat ID', 'Messages'])
+        types = pd.DataFrame(rollups.totals_by(conn, 'msg_type', since), columns=['Type', 'Messages'])
+        langs = pd.DataFrame(rollups.totals_by(conn, 'language', since), columns=['Language', 'Messages'])
+    daily['Day'] = pd.to_datetime(daily['Day'], unit='s')
+    return {'daily': daily, 'hours': hours, 'chats': chats, 'types': types, 'langs': langs}
+
+@st.cache_data(max_entries=32)
+def groups_view(version, minute, activity_filter, sort_by):
+    df = live_data(version, minute)
+    groups = df[df['Is Group']]
+    now = pd.Timestamp.now(tz='UTC')
+    if activity_filter == "Active (24h)":
+        groups = groups[groups['Last Unread Message Date'] > now - pd.Timedelta(days=1)]
+    elif activity_filter == "Active (7d)":
+        groups = groups[groups['Last Unread Message Date'] > now - pd.Timedelta(days=7)]
+    elif activity_filter == "Inactive (>7d)":
+        groups = groups[groups['Last Unread Message Date'] <= now - pd.Timedelta(days=7)]
+
+    if sort_by == "Last Activity":
+        return groups.sort_values('Last Unread Message Date', ascending=False)
+    elif sort_by == "Unread Count":
+        return groups.sort_values('Unread Count', ascending=False)
+    return groups.sort_values('Urgency Score', ascending=False)
+
+@st.cache_resource
+def get_search_index():
+    return IndexSet()
+
 def format_time_ago(timestamp):
     if pd.isna(timestamp):
         return "Unknown"
@@ -154,10 +242,71 @@ def format_time_ago(timestamp):
         days = int(hours / 24)
         return f"{days}d ago"
 
-def handle_use_reply(chat_id, reply_text):
-    st.toast(f"Reply sent to chat {chat_id}", icon="✅")
-    # Here you would integrate with your Telegram sending function
-    return True
+def db_conn():
+    # Short-lived: callbacks and fragments run on Streamlit's script threads
+    conn = sqlite3.connect(DB_FILE, timeout=outbox.DB_TIMEOUT)
+    outbox.init_tables(conn)
+    replies.init_tables(conn)
+    return conn
+
+def resolve_reply(row, stored):
+    """The sync's reply, else one generated on demand for the same newest message."""
+    # Older CSVs hold "Error: ..." / "Skipped: ..." placeholders in this column
+    if outbox.sendable(row['AI Reply']):
+        return row['AI Reply']
+    message_id, reply = stored.get((row['Chat ID'], account_key(reply_target(row)[1])), (None, None))
+    return reply if message_id is not None and message_id == row.get('Last Message ID') else None
+
+def reply_target(row):
+    """(message_id, account) a reply to `row` answers and is sent from, for the outbox key."""
+    message_id = row.get('Last Message ID')
+    account = row.get('Account')
+    return (int(message_id) if pd.notna(message_id) else None,
+            account if isinstance(account, str) and account else None)
+
+def delivery_key(row):
+    """The key of outbox.statuses() for the reply to `row`."""
+    message_id, account = reply_target(row)
+    return row['Chat ID'], message_id, account_key(account)
+
+def handle_draft_reply(chat_id):
+    # The draft itself streams inside suggestion_list on the rerun this click triggers
+    st.session_state.drafting = chat_id
+
+def draft_reply(row):
+    """Stream a reply for `row` into the page and persist it once complete."""
+    services = row['Service Opportunities']
+    services = [s for s in str(services).split(', ') if s and s != 'None'] if pd.notna(services) else []
+    stream = replies.stream_reply(row['Last Message Text'], services)
+    st.write_stream(stream)
+    st.session_state.drafting = None
+    reply = stream.text.strip()
+    if stream.error or not reply:
+        return None
+    with closing(db_conn()) as conn:
+        replies.save_reply(conn, row['Chat ID'], int(row['Last Message ID']), reply, reply_target(row)[1])
+    if stream.first_token is not None:
+        st.caption(f"First token after {stream.first_token:.1f}s")
+    return reply
+
+def handle_use_reply(chat_id, reply_text, message_id=None, account=None):
+    # Queued for `python outbox.py`; the idempotency key makes repeat clicks no-ops
+    try:
+        with closing(db_conn()) as conn:
+            _, status, created = outbox.enqueue(conn, chat_id, reply_text, account, message_id)
+    except ValueError:
+        st.toast(f"Nothing to send to chat {chat_id}: the suggestion is not a reply", icon="⚠️")
+        return False
+    if created:
+        st.toast(f"Reply to chat {chat_id} queued", icon="📬")
+    else:
+        st.toast(f"Reply to chat {chat_id} already {status}", icon="ℹ️")
+    return created
+
+def handle_approve_all(replies):
+    with closing(db_conn()) as conn:
+        queued = outbox.enqueue_many(conn, replies)
+    st.toast(f"Queued {queued} of {len(replies)} replies", icon="📬")
 
 def handle_edit_reply(chat_id, reply_text):
     st.session_state.editing_chat = chat_id
@@ -167,17 +316,227 @@ def handle_skip_suggestion(chat_id):
     st.session_state.skipped_suggestions.add(chat_id)
     st.toast(f"Suggestion skipped", icon="ℹ️")
 
-def export_data(df):
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"telegram_export_{timestamp}.csv"
-    df.to_csv(filename, index=False)
-    st.toast(f"Data exported to {filename}", icon="📤")
+def export_data(df, fmt='csv'):
+    # Runs in a background thread; export_status() reports progress and the download
+    job = st.session_state.get('export_job')
+    if job is not None and job.running:
+        st.toast("An export is already running", icon="⏳")
+        return
+    st.session_state.export_job = ExportJob(df, fmt).start()
+    st.toast(f"Exporting {len(df):,} rows to {st.session_state.export_job.path}", icon="📤")
 
 def sync_data():
     st.session_state.last_sync = datetime.now(pytz.UTC)
     st.cache_data.clear()
     st.toast("Data synchronized", icon="🔄")
 
+# Fragments: widgets inside each one rerun only that fragment, not the whole page
+@st.fragment(run_every=1)
+def export_progress(job):
+    if job.running:
+        st.progress(job.progress, text=f"Exporting {job.rows_done:,} / {job.total:,} rows…")
+    else:
+        st.rerun()  # once, to swap the poller for the result below
+
+def export_status():
+    # Only a running export polls; the download button is rendered once, outside the fragment
+    job = st.session_state.get('export_job')
+    if job is None:
+        return
+    if job.running:
+        export_progress(job)
+    elif job.status == 'failed':
+        st.error(f"Export failed: {job.error}")
+    elif os.path.exists(job.path):
+        with open(job.path, 'rb') as f:
+            st.download_button(f"⬇️ Download {job.path} ({job.elapsed:.1f}s)", f,
+                               file_name=os.path.basename(job.path), mime=job.mime)
+
+@st.fragment
+def metrics_bar(version):
+    m = metrics_view(version, current_minute())
+    m1, m2, m3, m4 = st.columns(4)
+    
+    with m1:
+        st.markdown("""
+            <div class='metric-card'>
+                <div class='metric-value'>%d / %d</div>
+                <div class='metric-label'>Unread (Groups/Private)</div>
+            </div>
+        """ % (m['group_unread'], m['private_unread']), unsafe_allow_html=True)
+    
+    with m2:
+        st.markdown("""
+            <div class='metric-card'>
+                <div class='metric-value'>%d / %d</div>
+                <div class='metric-label'>Active/Total Groups (7d)</div>
+            </div>
+        """ % (m['active_groups'], m['total_groups']), unsafe_allow_html=True)
+    
+    with m3:
+        st.markdown("""
+            <div class='metric-card'>
+                <div class='metric-value'>%d</div>
+                <div class='metric-label'>High Urgency Chats</div>
+            </div>
+        """ % m['urgent_count'], unsafe_allow_html=True)
+    
+    with m4:
+        st.markdown("""
+            <div class='metric-card'>
+                <div class='metric-value'>%d</div>
+                <div class='metric-label'>Messages Today</div>
+            </div>
+        """ % m['today_count'], unsafe_allow_html=True)
+
+@st.fragment
+def suggestion_list(version, limit=None):
+    suggestions = suggestions_view(version, current_minute())
+    suggestions = suggestions[~suggestions['Chat ID'].isin(st.session_state.skipped_suggestions)]
+    preview = limit is not None
+    if preview:
+        suggestions = suggestions.head(limit)
+    key_suffix = "" if preview else "_full"
+    with closing(db_conn()) as conn:
+        delivery = outbox.statuses(conn)
+        queue_counts = outbox.counts(conn)
+        stored = replies.stored_replies(conn)
+    
+    if not preview and len(suggestions) > 0:
+        pending = [(row['Chat ID'], reply_target(row)[0], resolve_reply(row, stored), reply_target(row)[1])
+                   for _, row in suggestions.iterrows()
+                   if delivery.get(delivery_key(row)) not in ('queued', 'sending', 'sent')]
+        pending = [p for p in pending if p[2]]
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            st.button(f"✅ Approve all ({len(pending)})", key="approve_all", disabled=not pending,
+                      on_click=handle_approve_all, args=(pending,))
+        with col2:
+            st.caption("Outbox: " + (" · ".join(f"{n} {s}" for s, n in sorted(queue_counts.items())) or "empty")
+                       + " — sent by `python outbox.py`")
+    
+    for _, row in suggestions.iterrows():
+        confidence = row['Urgency Score'] * 10
+        confidence_class = 'confidence-high' if confidence >= 85 else 'confidence-medium' if confidence >= 70 else 'confidence-low'
+        message_text = f"{row['Last Message Text'][:100]}..." if preview else row['Last Message Text']
+        reply = resolve_reply(row, stored)
+        drafting = reply is None and st.session_state.get('drafting') == row['Chat ID']
+        if drafting:
+            reply_text = "<small>Drafting…</small>"
+        elif reply is None:
+            reply_text = "<small>Not generated yet</small>"
+        else:
+            reply_text = f"{reply[:100]}..." if preview else reply
+        
+        with st.container():
+            st.markdown(f"""
+                <div class='suggestion-card'>
+                    <strong>{row['Chat Name']}</strong>
+                    <p>{message_text}</p>
+                    <p><em>Suggested Reply:</em><br>{reply_text}</p>
+                    <div style='display: flex; justify-content: space-between; align-items: center;'>
+                        <span class='{confidence_class}'>{confidence:.0f}% confidence</span>
+                        <small>{'📬 ' + delivery[delivery_key(row)] if delivery_key(row) in delivery else ''}</small>
+                    </div>
+                </div>
+            """, unsafe_allow_html=True)
+            if drafting:
+                reply = draft_reply(row)
+            
+            # Callbacks run before the fragment re-renders, so a skip disappears at once
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if reply is None:
+                    st.button("✨ Draft Reply", key=f"gen_{row['Chat ID']}{key_suffix}",
+                              on_click=handle_draft_reply, args=(row['Chat ID'],))
+                else:
+                    st.button("Use Reply", key=f"use_{row['Chat ID']}{key_suffix}",
+                              on_click=handle_use_reply, args=(row['Chat ID'], reply, *reply_target(row)))
+            with col2:
+                st.button("Edit", key=f"edit_{row['Chat ID']}{key_suffix}", disabled=reply is None,
+                          on_click=handle_edit_reply, args=(row['Chat ID'], reply))
+            with col3:
+                st.button("Skip", key=f"skip_{row['Chat ID']}{key_suffix}",
+                          on_click=handle_skip_suggestion, args=(row['Chat ID'],))
+    
+    if preview and len(suggestions) > 0:
+        if st.button("View all AI suggestions", key="view_all_suggestions"):
+            st.session_state.page = "🤖 AI Suggestions"
+            st.rerun()
+
+@st.fragment
+def activity_charts(version, names):
+    days = st.selectbox("Range", [7, 30, 90, 365], index=1, format_func=lambda d: f"Last {d} days")
+    a = activity_view(version, days)
+    if a['daily'].empty:
+        st.info("No activity recorded yet — it builds up from the next sync.")
+        return
+    st.subheader("Message Volume")
+    st.line_chart(a['daily'].set_index('Day'))
+    c1, c2 = st.columns(2)
+    with c1:
+        st.subheader("Busiest Hours")
+        st.bar_chart(a['hours'].set_index('Hour (UTC)'))
+    with c2:
+        st.subheader("Most Active Chats")
+        chats = a['chats'].assign(Chat=a['chats']['Chat ID'].map(lambda c: names.get(c, f"Chat {c}")))
+        st.bar_chart(chats.set_index('Chat')['Messages'])
+    c3, c4 = st.columns(2)
+    with c3:
+        st.subheader("Messages by Type")
+        st.bar_chart(a['types'].set_index('Type'))
+    with c4:
+        st.subheader("Messages by Language")
+        st.bar_chart(a['langs'].set_index('Language'))
+
+@st.fragment
+def groups_list(version):
+    # Add group activity filters
+    col1, col2 = st.columns(2)
+    with col1:
+        activity_filter = st.selectbox(
+            "Activity Filter",
+            ["All Groups", "Active (24h)", "Active (7d)", "Inactive (>7d)"]
+        )
+    with col2:
+        sort_by = st.selectbox(
+            "Sort By",
+            ["Last Activity", "Unread Count", "Urgency Score"]
+        )
+    
+    groups = groups_view(version, current_minute(), activity_filter, sort_by)
+    
+    # Display groups with enhanced information
+    for _, row in groups.iterrows():
+        time_ago = format_time_ago(row['Last Unread Message Date'])
+        urgency_class = 'confidence-high' if row['Urgency Score'] >= 7 else 'confidence-medium' if row['Urgency Score'] >= 4 else 'confidence-low'
+        
+        st.markdown(f"""
+            <div class='message-card'>
+                <div style='display: flex; justify-content: space-between; align-items: start;'>
+                    <div>
+                        <strong>{row['Chat Name']}</strong>
+                        <p>
+                            🔔 {row['Unread Count']} unread messages<br>
+                            👤 Last message by: {row['Last Sender Name'] or row['Last Sender Username'] or 'Unknown'}<br>
+                            💬 "{row['Last Message Text'][:100]}..."
+                        </p>
+                    </div>
+                    <div style='text-align: right;'>
+                        <span class='{urgency_class}'>Priority: {row['Urgency Score']}/10</span>
+                    </div>
+                </div>
+                <small>
+                    Last activity: {time_ago} • 
+                    Message type: {row['Last Message Type']} • 
+                    Language: {row['Language']}
+                </small>
+            </div>
+        """, unsafe_allow_html=True)
+    
+    if len(groups) == 0:
+        st.info(f"No groups found matching the filter: {activity_filter}")
+
 # Sidebar Navigation
 with st.sidebar:
     st.title("💬 Telegram Manager")
@@ -199,17 +558,14 @@ with st.sidebar:
     st.session_state.page = st.radio(
         "Navigation",
         ["📊 Dashboard", "📩 Unreplied Messages", "👥 Groups", 
-         "🤖 AI Suggestions", "📈 Database Analysis", "⚙️ Settings"]
+         "🤖 AI Suggestions", "🔎 Search", "📈 Database Analysis", "⚙️ Settings"]
     )
 
-# Load the data
-df = load_data()
+# Load the data (cached per data version; urgency decay re-applied each minute)
+version = data_version()
+df = live_data(version, current_minute())
 
 if df is not None:
-    unreplied_count = len(df[df['Needs Followup']])
-    groups_count = len(df[df['Is Group']])
-    ai_suggestions = len(df[df['AI Reply'].notna()])
-    
     # Top Action Buttons
     col1, col2, col3 = st.columns([6, 1, 1])
     with col1:
@@ -221,49 +577,10 @@ if df is not None:
     with col3:
         if st.button("🔄 Sync Now", use_container_width=True):
             sync_data()
+    export_status()
     
     # Enhanced metrics
-    m1, m2, m3, m4 = st.columns(4)
-    
-    with m1:
-        group_unread = df[df['Is Group']]['Unread Count'].sum()
-        private_unread = df[~df['Is Group']]['Unread Count'].sum()
-        st.markdown("""
-            <div class='metric-card'>
-                <div class='metric-value'>%d / %d</div>
-                <div class='metric-label'>Unread (Groups/Private)</div>
-            </div>
-        """ % (group_unread, private_unread), unsafe_allow_html=True)
-    
-    with m2:
-        active_groups = len(df[df['Is Group'] & (df['Last Unread Message Date'] > pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=7))])
-        total_groups = len(df[df['Is Group']])
-        st.markdown("""
-            <div class='metric-card'>
-                <div class='metric-value'>%d / %d</div>
-                <div class='metric-label'>Active/Total Groups (7d)</div>
-            </div>
-        """ % (active_groups, total_groups), unsafe_allow_html=True)
-    
-    with m3:
-        urgent_count = len(df[df['Urgency Score'] >= 7])
-        ai_suggestions = len(df[df['AI Reply'].notna()])
-        st.markdown("""
-            <div class='metric-card'>
-                <div class='metric-value'>%d</div>
-                <div class='metric-label'>High Urgency Chats</div>
-            </div>
-        """ % urgent_count, unsafe_allow_html=True)
-    
-    with m4:
-        today = pd.Timestamp.now(tz='UTC').date()
-        today_count = len(df[df['Last Unread Message Date'].dt.date == today])
-        st.markdown("""
-            <div class='metric-card'>
-                <div class='metric-value'>%d</div>
-                <div class='metric-label'>Messages Today</div>
-            </div>
-        """ % today_count, unsafe_allow_html=True)
+    metrics_bar(version)
     
     # Main Content Area
     st.markdown("---")
@@ -273,7 +590,7 @@ if df is not None:
         
         with col1:
             st.subheader("📩 Recent Unreplied Messages")
-            unreplied = df[df['Needs Followup']].sort_values('Last Unread Message Date', ascending=False).head(3)
+            unreplied = unreplied_view(version).head(3)
             
             for _, row in unreplied.iterrows():
                 time_ago = format_time_ago(row['Last Unread Message Date'])
@@ -291,45 +608,11 @@ if df is not None:
         
         with col2:
             st.subheader("🤖 AI Reply Suggestions")
-            suggestions = df[
-                (df['AI Reply'].notna()) & 
-                (~df['Chat ID'].isin(st.session_state.skipped_suggestions))
-            ].sort_values('Urgency Score', ascending=False).head(3)
-            
-            for _, row in suggestions.iterrows():
-                confidence = row['Urgency Score'] * 10
-                confidence_class = 'confidence-high' if confidence >= 85 else 'confidence-medium' if confidence >= 70 else 'confidence-low'
-                
-                with st.container():
-                    st.markdown(f"""
-                        <div class='suggestion-card'>
-                            <strong>{row['Chat Name']}</strong>
-                            <p>{row['Last Message Text'][:100]}...</p>
-                            <p><em>Suggested Reply:</em><br>{row['AI Reply'][:100]}...</p>
-                            <div style='display: flex; justify-content: space-between; align-items: center;'>
-                                <span class='{confidence_class}'>{confidence:.0f}% confidence</span>
-                            </div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        if st.button("Use Reply", key=f"use_{row['Chat ID']}"):
-                            handle_use_reply(row['Chat ID'], row['AI Reply'])
-                    with col2:
-                        if st.button("Edit", key=f"edit_{row['Chat ID']}"):
-                            handle_edit_reply(row['Chat ID'], row['AI Reply'])
-                    with col3:
-                        if st.button("Skip", key=f"skip_{row['Chat ID']}"):
-                            handle_skip_suggestion(row['Chat ID'])
-            
-            if len(suggestions) > 0:
-                if st.button("View all AI suggestions", key="view_all_suggestions"):
-                    st.session_state.page = "🤖 AI Suggestions"
+            suggestion_list(version, limit=3)
     
     elif st.session_state.page == "📩 Unreplied Messages":
         st.subheader("📩 All Unreplied Messages")
-        unreplied = df[df['Needs Followup']].sort_values('Last Unread Message Date', ascending=False)
+        unreplied = unreplied_view(version)
         for _, row in unreplied.iterrows():
             time_ago = format_time_ago(row['Last Unread Message Date'])
             st.markdown(f"""
@@ -342,101 +625,34 @@ if df is not None:
     
     elif st.session_state.page == "👥 Groups":
         st.subheader("👥 Group Activity Overview")
-        
-        # Add group activity filters
-        col1, col2 = st.columns(2)
-        with col1:
-            activity_filter = st.selectbox(
-                "Activity Filter",
-                ["All Groups", "Active (24h)", "Active (7d)", "Inactive (>7d)"]
-            )
-        with col2:
-            sort_by = st.selectbox(
-                "Sort By",
-                ["Last Activity", "Unread Count", "Urgency Score"]
-            )
-        
-        # Filter and sort groups
-        groups = df[df['Is Group']].copy()
-        
-        if activity_filter == "Active (24h)":
-            groups = groups[groups['Last Unread Message Date'] > pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=1)]
-        elif activity_filter == "Active (7d)":
-            groups = groups[groups['Last Unread Message Date'] > pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=7)]
-        elif activity_filter == "Inactive (>7d)":
-            groups = groups[groups['Last Unread Message Date'] <= pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=7)]
-        
-        if sort_by == "Last Activity":
-            groups = groups.sort_values('Last Unread Message Date', ascending=False)
-        elif sort_by == "Unread Count":
-            groups = groups.sort_values('Unread Count', ascending=False)
-        else:
-            groups = groups.sort_values('Urgency Score', ascending=False)
-        
-        # Display groups with enhanced information
-        for _, row in groups.iterrows():
-            time_ago = format_time_ago(row['Last Unread Message Date'])
-            urgency_class = 'confidence-high' if row['Urgency Score'] >= 7 else 'confidence-medium' if row['Urgency Score'] >= 4 else 'confidence-low'
-            
-            st.markdown(f"""
-                <div class='message-card'>
-                    <div style='display: flex; justify-content: space-between; align-items: start;'>
-                        <div>
-                            <strong>{row['Chat Name']}</strong>
-                            <p>
-                                🔔 {row['Unread Count']} unread messages<br>
-                                👤 Last message by: {row['Last Sender Name'] or row['Last Sender Username'] or 'Unknown'}<br>
-                                💬 "{row['Last Message Text'][:100]}..."
-                            </p>
-                        </div>
-                        <div style='text-align: right;'>
-                            <span class='{urgency_class}'>Priority: {row['Urgency Score']}/10</span>
-                        </div>
-                    </div>
-                    <small>
-                        Last activity: {time_ago} • 
-                        Message type: {row['Last Message Type']} • 
-                        Language: {row['Language']}
-                    </small>
-                </div>
-            """, unsafe_allow_html=True)
-        
-        if len(groups) == 0:
-            st.info(f"No groups found matching the filter: {activity_filter}")
+        groups_list(version)
     
     elif st.session_state.page == "🤖 AI Suggestions":
         st.subheader("🤖 All AI Suggestions")
-        suggestions = df[
-            (df['AI Reply'].notna()) & 
-            (~df['Chat ID'].isin(st.session_state.skipped_suggestions))
-        ].sort_values('Urgency Score', ascending=False)
-        
-        for _, row in suggestions.iterrows():
-            confidence = row['Urgency Score'] * 10
-            confidence_class = 'confidence-high' if confidence >= 85 else 'confidence-medium' if confidence >= 70 else 'confidence-low'
-            
-            with st.container():
+        suggestion_list(version)
+    
+    elif st.session_state.page == "🔎 Search":
+        st.subheader("🔎 Search Conversations")
+        query = st.text_input("Search messages and summaries", placeholder="teams asking for a Cairo audit")
+        if query.strip():
+            start = time.perf_counter()
+            hits = get_search_index().search(query, k=20)
+            st.caption(f"{len(hits)} chats found in {(time.perf_counter() - start) * 1000:.0f} ms")
+            chats = df.set_index('Chat ID')
+            for chat_id, score, message_id in hits:
+                row = chats.loc[chat_id] if chat_id in chats.index else None
+                name = row['Chat Name'] if row is not None else f"Chat {chat_id}"
+                matched = "summary" if message_id == SUMMARY_MESSAGE_ID else f"message #{message_id}"
+                last_text = str(row['Last Message Text'])[:100] if row is not None else ""
                 st.markdown(f"""
-                    <div class='suggestion-card'>
-                        <strong>{row['Chat Name']}</strong>
-                        <p>{row['Last Message Text']}</p>
-                        <p><em>Suggested Reply:</em><br>{row['AI Reply']}</p>
-                        <div style='display: flex; justify-content: space-between; align-items: center;'>
-                            <span class='{confidence_class}'>{confidence:.0f}% confidence</span>
-                        </div>
+                    <div class='message-card'>
+                        <strong>{name}</strong>
+                        <p>{last_text}...</p>
+                        <small>Relevance {score:.2f} • matched {matched}</small>
                     </div>
                 """, unsafe_allow_html=True)
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    if st.button("Use Reply", key=f"use_{row['Chat ID']}_full"):
-                        handle_use_reply(row['Chat ID'], row['AI Reply'])
-                with col2:
-                    if st.button("Edit", key=f"edit_{row['Chat ID']}_full"):
-                        handle_edit_reply(row['Chat ID'], row['AI Reply'])
-                with col3:
-                    if st.button("Skip", key=f"skip_{row['Chat ID']}_full"):
-                        handle_skip_suggestion(row['Chat ID'])
+            if not hits:
+                st.info("No matching chats found.")
     
     elif st.session_state.page == "📈 Database Analysis":
         st.subheader("📈 Message Analytics")
@@ -457,6 +673,9 @@ if df is not None:
             'Chat Type': ['Group Chats', 'Private Chats'],
             'Count': [chat_types.get(True, 0), chat_types.get(False, 0)]
         }).set_index('Chat Type'))
+        
+        st.subheader("📊 Activity")
+        activity_charts(version, dict(zip(df['Chat ID'], df['Chat Name'])))
     
     elif st.session_state.page == "⚙️ Settings":
         st.subheader("⚙️ Settings")
@@ -486,17 +705,28 @@ if df is not None:
 
         st.markdown("---")
 
+        # --- AI Replies ---
+        st.write("### AI Replies")
+        st.caption("Other chats get a reply when you open them under 🤖 AI Suggestions.")
+        reply_private = st.checkbox("Generate during sync for every private chat",
+                                    value=config.get('reply_private', True))
+        reply_min_urgency = st.slider("Generate during sync for groups with urgency at least", 0, 100,
+                                      value=int(config.get('reply_min_urgency', replies.DEFAULT_MIN_URGENCY)))
+        if (reply_private, reply_min_urgency) != (config.get('reply_private', True),
+                                                  config.get('reply_min_urgency', replies.DEFAULT_MIN_URGENCY)):
+            config['reply_private'] = reply_private
+            config['reply_min_urgency'] = reply_min_urgency
+            save_config(config)
+            st.toast("Reply policy saved — applies to the next sync", icon="✅")
+
+        st.markdown("---")
+
         # --- Export Options ---
         st.write("### Export Options")
-        export_format = st.selectbox("Export Format", ["CSV", "Excel"])
+        export_formats = {"CSV": 'csv', "CSV (gzip)": 'csv.gz', "Excel": 'xlsx'}
+        export_format = st.selectbox("Export Format", list(export_formats))
         if st.button("Export Data"):
-            if export_format == "CSV":
-                export_data(df)
-            else:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"telegram_export_{timestamp}.xlsx"
-                df.to_excel(filename, index=False)
-                st.toast(f"Data exported to {filename}", icon="📤")
+            export_data(df, export_formats[export_format])
 
         st.write("### Display Preferences")
         st.number_input("Messages to fetch per chat", min_value=5, max_value=100, value=10)
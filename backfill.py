@@ -0,0 +1,204 @@
+"""
+Bulk history backfill through a Telegram takeout session.
+
+A normal sync reads the last 100 (or unread) messages per dialog. Importing
+months of history the same way runs into Telegram's regular flood limits
+within minutes. iter_messages also waits 1s between pages once the limit
+passes 3000, and the fetchers give up after MAX_RETRIES flood waits. A
+takeout session ("export my data") is rate-limited far more leniently, so
+backfill() reads history through one, with no pause between pages.
+
+History is read newest to oldest and written to the messages table in
+batches of BATCH. Each dialog's progress is checkpointed in backfill_state
+after every batch: the oldest message id stored, and whether the start of
+history (or `since`) was reached. A flood wait or an interrupted run
+resumes from the checkpoint instead of starting over. Each batch is also
+counted into the activity rollups. Going newest-first keeps every batch
+below the rollups' counted range, as in maintenance.py.
+
+By default nothing older than the retention window ("retention" ->
+"messages_days" in config.json) is imported, since maintenance would only
+expire it again.
+
+Telegram asks the user to confirm a takeout request from another logged-in
+app the first time; until then TakeoutInitDelayError is raised.
+
+Usage:
+    python backfill.py [--days N] [--no-takeout] [--reset] [--no-rollups]
+"""
+
+import argparse
+import asyncio
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Sequence
+
+import rollups
+from store import init_messages_table, save_messages
+
+BATCH = 500
+TAKEOUT_SCOPES = dict(contacts=False, users=True, chats=True, megagroups=True, channels=True, files=False)
+
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS backfill_state (
+        chat_id INTEGER,
+        account TEXT NOT NULL DEFAULT '',
+        oldest_id INTEGER,
+        count INTEGER NOT NULL DEFAULT 0,
+        done BOOLEAN NOT NULL DEFAULT 0,
+        updated_at REAL,
+        PRIMARY KEY (chat_id, account)
+    )''')
+    conn.commit()
+
+def checkpoint(conn: sqlite3.Connection, chat_id: int, account: Optional[str] = None) -> Dict:
+    """{'oldest_id', 'count', 'done'} for a dialog; oldest_id None means not started."""
+    row = conn.execute('SELECT oldest_id, count, done FROM backfill_state WHERE chat_id = ? AND account = ?',
+                       (chat_id, account or '')).fetchone()
+    return {'oldest_id': row[0], 'count': row[1], 'done': bool(row[2])} if row else \
+        {'oldest_id': None, 'count': 0, 'done': False}
+
+def _save_checkpoint(conn: sqlite3.Connection, chat_id: int, account: Optional[str], state: Dict):
+    conn.execute('INSERT INTO backfill_state (chat_id, account, oldest_id, count, done, updated_at) '
+                 'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (chat_id, account) DO UPDATE SET '
+                 'oldest_id = excluded.oldest_id, count = excluded.count, done = excluded.done, '
+                 'updated_at = excluded.updated_at',
+                 (chat_id, account or '', state['oldest_id'], state['count'], state['done'], time.time()))
+
+def reset(conn: sqlite3.Connection, account: Optional[str] = None):
+    """Forget every checkpoint of `account`, so the next backfill starts from the newest message."""
+    conn.execute('DELETE FROM backfill_state WHERE account = ?', (account or '',))
+    conn.commit()
+
+def default_since(now: Optional[datetime] = None) -> Optional[datetime]:
+    """Start of the message retention window; None (the whole history) when messages are kept forever."""
+    from maintenance import retention
+    days = retention()['messages_days']
+    return (now or datetime.now(timezone.utc)) - timedelta(days=days) if days else None
+
+async def backfill_dialog(client, dialog, conn: sqlite3.Connection, classify, detect=None,
+                          account: Optional[str] = None, since: Optional[datetime] = None,
+                          wait_time: Optional[float] = None, batch: int = BATCH) -> Dict:
+    """Import one dialog's history below its checkpoint; returns the updated checkpoint.
+
+    A dialog is marked done only once its history is exhausted. Stopping at
+    `since` keeps the checkpoint open, so a later run with a longer window
+    carries on below it. `classify` maps a Telethon message to its type. `detect` is the language
+    detector used for the rollups; None skips them.
+    """
+    from telethon.errors import FloodWaitError
+    from analysis import message_row
+
+    state = checkpoint(conn, dialog.id, account)
+    if state['done']:
+        return state
+    rows = []
+
+    def flush():
+        if not rows:
+            return
+        save_messages(conn, dialog.id, rows, account)
+        fresh = rollups.uncounted(conn, dialog.id, rows, account) if detect is not None else []
+        if fresh:
+            ids = [r.id for r in fresh]
+            rollups.add(conn, dialog.id, rollups.bucketize(fresh, detect), max(ids), min(ids), account)
+        state['oldest_id'] = rows[-1].id
+        state['count'] += len(rows)
+        _save_checkpoint(conn, dialog.id, account, state)
+        conn.commit()
+        rows.clear()
+
+    while True:
+        try:
+            exhausted = True
+            async for message in client.iter_messages(dialog.id, offset_id=state['oldest_id'] or 0,
+                                                      wait_time=wait_time):
+                if since is not None and message.date < since:
+                    exhausted = False
+                    break
+                rows.append(message_row(message, classify(message)))
+                if len(rows) >= batch:
+                    flush()
+            flush()
+            state['done'] = exhausted
+            _save_checkpoint(conn, dialog.id, account, state)
+            conn.commit()
+            return state
+        except FloodWaitError as e:
+            # Everything before the wait is kept; the next pass resumes below it
+            flush()
+            logging.info(f"Backfill of {dialog.name}: flood wait {e.seconds}s at {state['count']} messages")
+            await asyncio.sleep(e.seconds)
+
+async def backfill(client, dialogs: Sequence, conn: sqlite3.Connection, classify, detect=None,
+                   account: Optional[str] = None, since: Optional[datetime] = None,
+                   takeout: bool = True, batch: int = BATCH) -> Dict[int, Dict]:
+    """Backfill every dialog, through a takeout session unless `takeout` is False.
+
+    Returns {chat_id: checkpoint}. A dialog that fails is logged and left at
+    its last checkpoint.
+    """
+    init_messages_table(conn)
+    init_tables(conn)
+    rollups.init_tables(conn)
+
+    async def run(source, wait_time):
+        results = {}
+        for dialog in dialogs:
+            try:
+                results[dialog.id] = await backfill_dialog(source, dialog, conn, classify, detect, account,
+                                                           since, wait_time, batch)
+                logging.info(f"Backfill of {dialog.name}: {results[dialog.id]['count']} messages")
+            except Exception as e:
+                logging.error(f"Backfill of {dialog.name} failed: {e}")
+        return results
+
+    if not takeout:
+        return await run(client, None)
+    from telethon.errors import TakeoutInitDelayError
+    try:
+        async with client.takeout(finalize=True, **TAKEOUT_SCOPES) as session:
+            return await run(session, 0)  # takeout is exempt from the per-page pause
+    except TakeoutInitDelayError as e:
+        raise RuntimeError(f"Telegram wants the takeout request confirmed in another app first; "
+                           f"retry in {e.seconds}s or run with --no-takeout") from e
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk-import message history into telegram.db')
+    parser.add_argument('--days', type=int, help='history to import (default: the message retention window, else everything)')
+    parser.add_argument('--no-takeout', action='store_true', help='use the regular, flood-limited API')
+    parser.add_argument('--reset', action='store_true', help='ignore checkpoints and start from the newest message')
+    parser.add_argument('--no-rollups', action='store_true', help="don't count backfilled messages into the rollups")
+    args = parser.parse_args()
+
+    import tg
+    from telethon import TelegramClient
+    from dialog_policy import select_dialogs
+
+    async def main():
+        since = (datetime.now(timezone.utc) - timedelta(days=args.days)) if args.days else default_since()
+        client = TelegramClient(tg.SESSION_NAME, tg.API_ID, tg.API_HASH)
+        await client.start()
+        try:
+            dialogs = await select_dialogs(client, await client.get_dialogs())
+            with sqlite3.connect(tg.DB_FILE, timeout=tg.DB_TIMEOUT) as conn:
+                init_tables(conn)
+                if args.reset:
+                    reset(conn)
+                start = time.monotonic()
+                results = await backfill(client, dialogs, conn, tg.classify_message_type,
+                                         None if args.no_rollups else tg.detect_language,
+                                         since=since, takeout=not args.no_takeout)
+            total = sum(s['count'] for s in results.values())
+            done = sum(s['done'] for s in results.values())
+            print(f"Backfilled {total:,} messages; {done}/{len(dialogs)} dialogs complete "
+                  f"in {time.monotonic() - start:.0f}s")
+        finally:
+            await client.disconnect()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+Microbenchmarks for the per-message analysis helpers.
+
+tg.py, tellegram_summartizer.py and standalone.py each carry their own copy
+of the message classifier, urgency score, service detector, follow-up check
+and language detector. Every copy is run over the same synthetic corpus
+(benchmarks/corpus.py), fully offline, and reported as calls per second and
+peak traced memory over the first PEAK_SAMPLE messages. Results are compared with
+the "analysis_ops" and "analysis_peak_kib" sections of
+benchmarks/baselines.json. A copy that is slower than baseline / TOLERANCE,
+or allocates more than TOLERANCE x baseline + SLACK_KIB, fails the run.
+
+standalone.py is a Streamlit script and cannot be imported without running
+the app, so its helpers are compiled from the source on their own (see
+load_functions).
+
+Usage:
+    python benchmarks/bench_analysis.py                  # compare against baselines
+    python benchmarks/bench_analysis.py --update         # record new baselines
+    python benchmarks/bench_analysis.py -k urgency       # only matching benchmarks
+"""
+
+import __future__
+import argparse
+import ast
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_startup import load_baselines, save_baselines  # noqa: E402
+from corpus import messages  # noqa: E402
+
+CORPUS_SIZE = 2000
+REPEAT = 5
+MIN_SECONDS = 0.2  # per round
+CHUNK = 25         # calls between clock reads; language detection alone takes ~10 ms a call
+PEAK_SAMPLE = 100  # messages traced for peak memory; tracing is slow
+TOLERANCE = 1.5
+SLACK_KIB = 16
+
+
+def load_functions(path: str, names: Iterable[str], namespace: Dict) -> Dict:
+    """Compile only the named top-level functions and constants from `path` into `namespace`."""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    wanted, found, body = set(names), set(), []
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            defined = {node.name}
+        elif isinstance(node, ast.Assign):
+            defined = {t.id for t in node.targets if isinstance(t, ast.Name)}
+        else:
+            continue
+        if defined & wanted:
+            body.append(node)
+            found |= defined
+    if wanted - found:
+        raise LookupError(f"{path} no longer defines {sorted(wanted - found)}")
+    # The source relies on `from __future__ import annotations` for its TYPE_CHECKING-only hints
+    code = compile(ast.Module(body=body, type_ignores=[]), path, 'exec', flags=__future__.annotations.compiler_flag)
+    exec(code, namespace)
+    return namespace
+
+def targets() -> Dict[str, Callable]:
+    """{benchmark name: fn(message)} for every copy of every helper."""
+    from langdetect import DetectorFactory
+    from urgency import current_urgency
+    import tellegram_summartizer
+    import tg
+
+    DetectorFactory.seed = 0  # langdetect is randomised otherwise
+    standalone = load_functions(
+        os.path.join(ROOT, 'standalone.py'),
+        ['URGENT_KEYWORDS', 'FOLLOWUP_KEYWORDS', 'classify_msg', 'detect_lang', 'urgency_base',
+         'urgency_score', 'needs_followup'],
+        {'current_urgency': current_urgency, '__name__': 'standalone'})
+    replied = datetime.now() - timedelta(days=3)
+
+    out = {}
+    for prefix, mod in (('tg', tg), ('summarizer', tellegram_summartizer)):
+        out[f'{prefix}.classify_message_type'] = mod.classify_message_type
+        out[f'{prefix}.calculate_urgency'] = lambda m, f=mod.calculate_urgency: f(m, True)
+        out[f'{prefix}.detect_service_opportunities'] = lambda m, f=mod.detect_service_opportunities: f(m.text)
+        out[f'{prefix}.needs_followup'] = lambda m, f=mod.needs_followup: f(m.text, replied)
+        out[f'{prefix}.detect_language'] = lambda m, f=mod.detect_language: f(m.text or '')
+    out['standalone.classify_msg'] = standalone['classify_msg']
+    out['standalone.urgency_score'] = lambda m, f=standalone['urgency_score']: f(m, True)
+    out['standalone.needs_followup'] = lambda m, f=standalone['needs_followup']: f(m.text)
+    out['standalone.detect_lang'] = lambda m, f=standalone['detect_lang']: f(m.text or '')
+    return out
+
+def _round(fn: Callable, corpus: List) -> float:
+    """Calls per second over at least MIN_SECONDS, cycling through the corpus."""
+    calls, i, start = 0, 0, time.perf_counter()
+    while True:
+        for m in corpus[i:i + CHUNK]:
+            fn(m)
+        calls += len(corpus[i:i + CHUNK])
+        i = (i + CHUNK) % len(corpus)
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            return calls / elapsed
+
+def _peak_kib(fn: Callable, corpus: List) -> float:
+    tracemalloc.start()
+    try:
+        for m in corpus:
+            fn(m)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+def run(pattern: str = '') -> Dict[str, Dict[str, float]]:
+    corpus = messages(CORPUS_SIZE)
+    fns = {name: fn for name, fn in targets().items() if pattern in name}
+    for fn in fns.values():
+        _round(fn, corpus)  # warm-up: lazy imports, langdetect profiles
+    # Rounds are interleaved across benchmarks, so a burst of machine noise
+    # costs each benchmark one round rather than all of one benchmark's rounds
+    ops = {name: 0.0 for name in fns}
+    for _ in range(REPEAT):
+        for name, fn in fns.items():
+            ops[name] = max(ops[name], _round(fn, corpus))
+    peak = {name: round(_peak_kib(fn, corpus[:PEAK_SAMPLE]), 1) for name, fn in fns.items()}
+    return {'analysis_ops': {name: round(v) for name, v in ops.items()}, 'analysis_peak_kib': peak}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analysis helper microbenchmarks')
+    parser.add_argument('--update', action='store_true', help='overwrite the stored baselines')
+    parser.add_argument('-k', dest='pattern', default='', help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    results = run(args.pattern)
+    base_ops, base_peak = load_baselines('analysis_ops'), load_baselines('analysis_peak_kib')
+    failed = False
+    for name, ops in results['analysis_ops'].items():
+        kib = results['analysis_peak_kib'][name]
+        verdict = ''
+        if name in base_ops:
+            slow = ops < base_ops[name] / TOLERANCE
+            fat = name in base_peak and kib > base_peak[name] * TOLERANCE + SLACK_KIB
+            verdict = (f"baseline {base_ops[name]:>10,} ops/s {base_peak.get(name, 0):>8.1f} KiB  "
+                       f"{'REGRESSION' if slow or fat else 'ok'}")
+            failed |= slow or fat
+        print(f"{name:<42} {ops:>10,} ops/s {kib:>8.1f} KiB  {verdict}")
+
+    if args.update:
+        # A filtered run only refreshes the benchmarks it ran
+        save_baselines('analysis_ops', {**base_ops, **results['analysis_ops']})
+        save_baselines('analysis_peak_kib', {**base_peak, **results['analysis_peak_kib']})
+        print("Baselines written to benchmarks/baselines.json")
+    sys.exit(1 if failed and not args.update else 0)
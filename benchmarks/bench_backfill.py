@@ -0,0 +1,202 @@
+"""
+Backfill benchmark: takeout session against the regular API, offline.
+
+A fake client serves DIALOGS x HISTORY synthetic messages
+(benchmarks/corpus.py) in pages of PAGE. Every request costs LATENCY. It
+raises FloodWaitError on a fixed request cadence: the regular API's limits,
+or the far looser takeout ones. iter_messages' own pause between pages
+(1s by default past 3000 messages) is honoured. Waiting happens on a
+virtual clock: asyncio.sleep is swapped for one that advances the clock
+and returns at once. So an import that would take Telegram an hour
+finishes here in seconds, and the same run always produces the same
+number. The flood cadences are assumptions about Telegram's behaviour,
+not measurements; adjust the *_LIMITS constants to match what you see in
+production.
+
+Each mode reports:
+
+    virtual_s    time the import would take against Telegram
+    cpu_s        real time spent here, i.e. classifying and storing
+    floods       flood waits hit
+
+A resume check also interrupts a run partway through, reruns it, and
+verifies that the checkpoints picked up where they stopped: every message
+is stored exactly once.
+
+Results are compared with the "backfill" section of
+benchmarks/baselines.json; more than TOLERANCE x baseline + SLACK_S fails
+the run.
+
+Usage:
+    python benchmarks/bench_backfill.py                   # compare against baselines
+    python benchmarks/bench_backfill.py --history 100000  # messages per dialog
+    python benchmarks/bench_backfill.py --update          # record new baselines
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_startup import load_baselines, save_baselines  # noqa: E402
+from corpus import messages  # noqa: E402
+
+DIALOGS = 5
+HISTORY = 20000   # messages per dialog
+PAGE = 100        # messages per GetHistory request, as Telethon asks for
+LATENCY = 0.15    # seconds per request
+# (requests between flood waits, seconds of each wait)
+REGULAR_LIMITS = (30, 30)
+TAKEOUT_LIMITS = (600, 5)
+TOLERANCE = 1.5
+SLACK_S = 0.25
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    async def sleep(self, seconds, result=None):
+        self.now += seconds or 0
+        await _real_sleep(0)
+        return result
+
+_real_sleep = asyncio.sleep
+
+@contextmanager
+def virtual_time(clock: Clock):
+    asyncio.sleep = clock.sleep
+    try:
+        yield
+    finally:
+        asyncio.sleep = _real_sleep
+
+
+class FakeHistoryClient:
+    """Serves the same history for every dialog, newest first, like iter_messages(offset_id=...)."""
+
+    def __init__(self, clock: Clock, history, limits=REGULAR_LIMITS, fail_after: int = 0):
+        self.clock = clock
+        self.history = history
+        self.flood_every, self.flood_seconds = limits
+        self.fail_after = fail_after  # raise a non-flood error on this request, once
+        self.requests = 0
+        self.floods = 0
+
+    async def _request(self):
+        from telethon.errors import FloodWaitError
+        self.requests += 1
+        await asyncio.sleep(LATENCY)
+        if self.fail_after and self.requests == self.fail_after:
+            raise ConnectionError("simulated disconnect")
+        if self.requests % self.flood_every == 0:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def iter_messages(self, chat, offset_id: int = 0, wait_time=None, **kwargs):
+        if wait_time is None:
+            wait_time = 1 if len(self.history) > 3000 else 0  # Telethon's default for large limits
+        rest = [m for m in self.history if not offset_id or m.id < offset_id]
+        for i in range(0, len(rest), PAGE):
+            if i:
+                await asyncio.sleep(wait_time)
+            await self._request()
+            for m in rest[i:i + PAGE]:
+                yield m
+
+    @asynccontextmanager
+    async def takeout(self, finalize=True, **scopes):
+        session = FakeHistoryClient(self.clock, self.history, TAKEOUT_LIMITS, self.fail_after)
+        try:
+            yield session
+        finally:
+            self.requests += session.requests
+            self.floods += session.floods
+
+
+class Dialog:
+    def __init__(self, id: int):
+        self.id = id
+        self.name = f"Dialog {id}"
+
+
+def _import(history, takeout: bool, fail_after: int = 0, db: str = None) -> Dict:
+    from backfill import backfill
+    from tg import classify_message_type
+
+    clock = Clock()
+    client = FakeHistoryClient(clock, history, fail_after=fail_after)
+    dialogs = [Dialog(1000 + i) for i in range(DIALOGS)]
+    conn = sqlite3.connect(db)
+    start = time.perf_counter()
+    with virtual_time(clock):
+        results = asyncio.run(backfill(client, dialogs, conn, classify_message_type, takeout=takeout))
+    cpu = time.perf_counter() - start
+    stored = conn.execute('SELECT COUNT(*), COUNT(DISTINCT chat_id || ":" || message_id) FROM messages').fetchone()
+    conn.close()
+    return {'virtual_s': round(clock.now, 1), 'cpu_s': round(cpu, 3), 'floods': client.floods,
+            'requests': client.requests, 'done': sum(s['done'] for s in results.values()), 'stored': stored[0],
+            'unique': stored[1]}
+
+def run(history_size: int = HISTORY) -> Dict[str, Dict]:
+    history = messages(history_size)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, takeout in (('regular', False), ('takeout', True)):
+            results[mode] = _import(history, takeout, db=os.path.join(tmp, f'{mode}.db'))
+        # Interrupted halfway through, then rerun: the checkpoints must carry it to the end
+        db = os.path.join(tmp, 'resume.db')
+        total_requests = DIALOGS * -(-history_size // PAGE)
+        first = _import(history, True, fail_after=total_requests // 2, db=db)
+        second = _import(history, True, db=db)
+        results['resume'] = {'first_done': first['done'], 'done': second['done'], 'stored': second['stored'],
+                             'unique': second['unique'], 'requests': first['requests'] + second['requests']}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Takeout vs regular backfill benchmark')
+    parser.add_argument('--history', type=int, default=HISTORY, help='messages per dialog')
+    parser.add_argument('--update', action='store_true', help='overwrite the stored baselines')
+    args = parser.parse_args()
+
+    results = run(args.history)
+    expected = DIALOGS * args.history
+    baselines = load_baselines('backfill')
+    failed = False
+    for mode in ('regular', 'takeout'):
+        r = results[mode]
+        rate = expected / r['virtual_s'] if r['virtual_s'] else float('inf')
+        print(f"{mode:<8} {r['virtual_s']:>9,.0f}s virtual  {r['cpu_s']:>7.2f}s cpu  {r['floods']:>4} floods  "
+              f"{r['requests']:>6} requests  {rate:>8,.0f} msg/s")
+        failed |= r['stored'] != expected or r['done'] != DIALOGS
+    speedup = results['regular']['virtual_s'] / max(results['takeout']['virtual_s'], 1e-9)
+    print(f"takeout speedup: {speedup:.1f}x")
+
+    resume = results['resume']
+    ok = resume['stored'] == resume['unique'] == expected and resume['done'] == DIALOGS
+    print(f"resume: {resume['first_done']}/{DIALOGS} dialogs before the interruption, "
+          f"{resume['done']}/{DIALOGS} after, {resume['stored']:,}/{expected:,} messages  {'ok' if ok else 'FAILED'}")
+    failed |= not ok
+
+    flat = {f"{mode}@{args.history} {metric}": results[mode][metric]
+            for mode in ('regular', 'takeout') for metric in ('virtual_s', 'cpu_s')}
+    for key, value in flat.items():
+        base = baselines.get(key)
+        if base is not None:
+            regressed = value > base * TOLERANCE + SLACK_S
+            print(f"  {key:<32} {value:>10.2f}  baseline {base:>10.2f}  {'REGRESSION' if regressed else 'ok'}")
+            failed |= regressed
+
+    if args.update:
+        save_baselines('backfill', {**baselines, **flat})
+        print("Baselines written to benchmarks/baselines.json")
+    sys.exit(1 if failed and not args.update else 0)
@@ -0,0 +1,154 @@
+"""
+Headless scaling benchmark for the Streamlit dashboards.
+
+For each snapshot size a synthetic CSV (benchmarks/synth.py) is written to
+a scratch directory, and app.py and standalone.py are each driven through
+Streamlit's AppTest in a fresh interpreter. A fresh interpreter per run
+keeps caches and memory from leaking between runs. Each run records:
+
+    load_s      first script run with cold caches
+    <page>      first visit to each navigation page (first_s), a plain
+                rerun of it with warm caches (rerun_s), and resident memory
+                after the visit (rss_mb)
+    peak_mb     peak resident memory of the whole run
+
+Results are compared with the "dashboard" section of
+benchmarks/baselines.json; a time above TOLERANCE x baseline + SLACK_S, or
+memory above TOLERANCE x baseline + SLACK_MB, fails the run.
+
+Usage:
+    python benchmarks/bench_dashboard.py                     # 1k and 10k chats
+    python benchmarks/bench_dashboard.py --sizes 100000      # where does it break?
+    python benchmarks/bench_dashboard.py --update            # record new baselines
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_startup import load_baselines, save_baselines  # noqa: E402
+
+SIZES = [1000, 10000]
+SCRIPTS = {'app.py': 'tg_detailed_ww5905.csv', 'standalone.py': 'tg_detailed_ww99.csv'}
+SESSION_FILE = 'tg_session.session'  # lets standalone.py skip the login pages
+TIMEOUT = 600  # seconds per script run inside AppTest
+TOLERANCE = 1.5
+SLACK_S = 0.25
+SLACK_MB = 50
+
+
+def _rss_mb(field: str = 'VmRSS') -> float:
+    """Resident (VmRSS) or peak resident (VmHWM) memory of this process, Linux only."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def measure(script: str) -> Dict:
+    """Drive one dashboard through every navigation page; runs in the scratch directory."""
+    from streamlit.testing.v1 import AppTest
+
+    def nav():
+        return next(r for r in at.radio if r.label == 'Navigation')
+
+    def errors():
+        return [e.value for e in at.exception]
+
+    at = AppTest.from_file(os.path.join(ROOT, script), default_timeout=TIMEOUT)
+    start = time.perf_counter()
+    at.run()
+    result = {'load_s': round(time.perf_counter() - start, 3), 'pages': {}, 'errors': errors()}
+    for page in nav().options:
+        start = time.perf_counter()
+        nav().set_value(page).run()
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        at.run()
+        rerun = time.perf_counter() - start
+        name = page.split(' ', 1)[-1]  # drop the emoji
+        result['pages'][name] = {'first_s': round(first, 3), 'rerun_s': round(rerun, 3), 'rss_mb': _rss_mb()}
+        result['errors'] += [f"{name}: {e}" for e in errors()]
+    result['peak_mb'] = _rss_mb('VmHWM')
+    return result
+
+def run(sizes=SIZES, scripts=SCRIPTS) -> Dict[str, Dict]:
+    from synth import snapshot
+
+    results = {}
+    for size in sizes:
+        workdir = tempfile.mkdtemp(prefix=f'bench_dashboard_{size}_')
+        try:
+            csv = os.path.join(workdir, 'snapshot.csv')
+            snapshot(size).to_csv(csv, index=False)
+            open(os.path.join(workdir, SESSION_FILE), 'w').close()
+            for script in scripts:
+                shutil.copy(csv, os.path.join(workdir, SCRIPTS[script]))
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', script],
+                                      cwd=workdir, capture_output=True, text=True)
+                if proc.returncode:
+                    raise RuntimeError(f"{script} @ {size} failed:\n{proc.stderr[-2000:]}")
+                results[f'{script}@{size}'] = json.loads(proc.stdout.strip().splitlines()[-1])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def flatten(results: Dict[str, Dict]) -> Dict[str, float]:
+    """{'app.py@1000 Groups rerun_s': 0.41, ...}, the shape stored in baselines.json."""
+    flat = {}
+    for run_name, r in results.items():
+        flat[f'{run_name} load_s'] = r['load_s']
+        flat[f'{run_name} peak_mb'] = r['peak_mb']
+        for page, metrics in r['pages'].items():
+            for metric, value in metrics.items():
+                flat[f'{run_name} {page} {metric}'] = value
+    return flat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dashboard scaling benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='chats per snapshot')
+    parser.add_argument('--scripts', nargs='+', choices=list(SCRIPTS), default=list(SCRIPTS))
+    parser.add_argument('--update', action='store_true', help='overwrite the stored baselines')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        sys.exit(0)
+
+    results = run(args.sizes, args.scripts)
+    baselines = load_baselines('dashboard')
+    failed = False
+    for run_name, r in results.items():
+        print(f"{run_name}: load {r['load_s']:.2f}s, peak {r['peak_mb']:.0f} MB")
+        for e in r['errors']:
+            print(f"  ERROR {e}")
+        failed |= bool(r['errors'])
+    flat = flatten(results)
+    for key, value in flat.items():
+        base = baselines.get(key)
+        verdict = ''
+        if base is not None:
+            limit = base * TOLERANCE + (SLACK_MB if key.endswith('_mb') else SLACK_S)
+            verdict = f"baseline {base:>8.2f}  {'REGRESSION' if value > limit else 'ok'}"
+            failed |= value > limit
+        print(f"  {key:<52} {value:>8.2f}  {verdict}")
+
+    if args.update:
+        save_baselines('dashboard', {**baselines, **flat})
+        print("Baselines written to benchmarks/baselines.json")
+    sys.exit(1 if failed and not args.update else 0)
@@ -0,0 +1,85 @@
+"""
+Cold-start benchmark: time fresh interpreters importing each entry point.
+
+Each target runs in a new `python` process REPEAT times and the median wall
+time is compared with benchmarks/baselines.json. A target slower than
+TOLERANCE x baseline + SLACK_MS fails the run.
+
+Usage:
+    python benchmarks/bench_startup.py            # compare against baselines
+    python benchmarks/bench_startup.py --update   # record new baselines
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+REPEAT = 7
+TOLERANCE = 1.5
+SLACK_MS = 30
+
+TARGETS = {
+    'python': ['-c', 'pass'],
+    'import tg': ['-c', 'import tg'],
+    'import tellegram_summartizer': ['-c', 'import tellegram_summartizer'],
+    'cli.py status': ['cli.py', 'status', '--db', os.path.join('benchmarks', 'missing.db')],
+}
+
+
+def _time(args) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+def run() -> dict:
+    results = {}
+    for name, args in TARGETS.items():
+        _time(args)  # warm the OS file cache
+        results[name] = round(statistics.median(_time(args) for _ in range(REPEAT)), 1)
+    return results
+
+def load_baselines(section: str) -> dict:
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES) as f:
+        return json.load(f).get(section, {})
+
+def save_baselines(section: str, results: dict):
+    data = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            data = json.load(f)
+    data[section] = results
+    with open(BASELINES, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold-start benchmark')
+    parser.add_argument('--update', action='store_true', help='overwrite the stored baselines')
+    args = parser.parse_args()
+
+    results = run()
+    baselines = load_baselines('startup_ms')
+    failed = False
+    for name, ms in results.items():
+        base = baselines.get(name)
+        verdict = ''
+        if base is not None:
+            limit = base * TOLERANCE + SLACK_MS
+            verdict = f"baseline {base:>7.1f} ms  {'REGRESSION' if ms > limit else 'ok'}"
+            failed |= ms > limit
+        print(f"{name:<32} {ms:>7.1f} ms  {verdict}")
+
+    if args.update:
+        save_baselines('startup_ms', results)
+        print(f"Baselines written to {BASELINES}")
+    sys.exit(1 if failed and not args.update else 0)
@@ -0,0 +1,82 @@
+"""
+Synthetic, offline stand-ins for Telethon messages, for the benchmarks.
+
+messages(n) returns a reproducible mix of the traffic the fetchers see:
+short chatter and long paragraphs in several languages, keyword-bearing
+business messages, bot commands, and media, voice, poll, contact and geo
+messages with no text. Stand-ins carry only the attributes the analysis
+helpers read (id, date, sender_id, text, media, voice, poll, contact, geo,
+reply_to_msg_id, mentioned).
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+SEED = 42
+
+PHRASES = {
+    'en': ["gm everyone", "thanks, talking soon", "Can we schedule a call to discuss next steps?",
+           "We need a security audit for our smart contract before the mainnet launch, this is urgent",
+           "The DeFi protocol proposal is ready, please review the deal terms before the deadline",
+           "Has anyone tried the new Starknet release? Ethereum gas was wild today"],
+    'ru': ["привет всем", "спасибо, созвонимся завтра", "Нужен аудит безопасности смарт-контракта до запуска",
+           "Кто-нибудь уже смотрел новый протокол? Обсудим на встрече"],
+    'es': ["hola a todos", "gracias por la ayuda", "Necesitamos una auditoría de seguridad para el contrato",
+           "La propuesta está lista, revisemos los próximos pasos mañana"],
+    'de': ["Guten Morgen zusammen", "Danke für das Update", "Wir brauchen bis Freitag ein Angebot für das Audit"],
+    'zh': ["大家早上好", "我们需要在上线前完成智能合约安全审计", "明天开会讨论下一步计划"],
+}
+LANG_WEIGHTS = {'en': 6, 'ru': 2, 'es': 1, 'de': 1, 'zh': 1}
+COMMANDS = ["/start", "/help", "/price eth", "/subscribe"]
+KINDS = ('text', 'long', 'command', 'media', 'voice', 'poll', 'contact', 'geo')
+KIND_WEIGHTS = (60, 10, 4, 14, 5, 3, 2, 2)
+
+
+class MediaStub:
+    """Stands in for a MessageMedia* object; any non-empty media is 'media' to the classifiers."""
+
+
+class FakeMessage:
+    __slots__ = ('id', 'date', 'sender_id', 'text', 'media', 'voice', 'poll', 'contact', 'geo',
+                 'reply_to_msg_id', 'mentioned')
+
+    def __init__(self, id: int, date: datetime, sender_id: int, text: Optional[str] = None, **attrs):
+        self.id = id
+        self.date = date
+        self.sender_id = sender_id
+        self.text = text
+        for name in ('media', 'voice', 'poll', 'contact', 'geo', 'reply_to_msg_id'):
+            setattr(self, name, attrs.get(name))
+        self.mentioned = attrs.get('mentioned', False)
+
+
+def _text(rng: random.Random, kind: str) -> Optional[str]:
+    lang = rng.choices(list(LANG_WEIGHTS), weights=list(LANG_WEIGHTS.values()))[0]
+    if kind == 'text':
+        return rng.choice(PHRASES[lang])
+    if kind == 'long':
+        return ' '.join(rng.choice(PHRASES[lang]) for _ in range(rng.randint(5, 25)))
+    if kind == 'command':
+        return rng.choice(COMMANDS)
+    if kind == 'media' and rng.random() < 0.4:
+        return rng.choice(PHRASES[lang])  # captioned photo
+    return None
+
+def messages(n: int = 2000, seed: int = SEED, now: Optional[datetime] = None) -> List[FakeMessage]:
+    """n messages, newest first, spread over the last week."""
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    out, age = [], 0
+    for i in range(n):
+        kind = rng.choices(KINDS, weights=KIND_WEIGHTS)[0]
+        attrs = {kind: MediaStub()} if kind in ('media', 'voice', 'poll', 'contact', 'geo') else {}
+        if kind == 'voice':
+            attrs['media'] = MediaStub()  # Telegram sends voice notes as documents
+        if rng.random() < 0.15:
+            attrs['reply_to_msg_id'] = max(1, n - i - rng.randint(1, 20))
+        age += rng.randint(30, 600)
+        out.append(FakeMessage(n - i, now - timedelta(seconds=age),
+                               rng.choice([123456, 789012] + list(range(1000, 1050))),
+                               _text(rng, kind), mentioned=rng.random() < 0.05, **attrs))
+    return out
@@ -0,0 +1,109 @@
+"""
+Synthetic chat snapshots: the CSV the fetchers export, at any size.
+
+snapshot(n) builds n chat rows with the columns of both tg.py's and
+standalone.py's exports, so either dashboard can load the file. The
+distributions mirror real accounts rather than uniform noise:
+
+    - about two thirds groups/channels, one third private chats
+    - heavy-tailed unread counts: most chats have a handful, a few thousands
+    - mostly English, then Russian, Spanish, German, Chinese, some undetected
+    - last activity skewed to the recent past, over roughly two months
+    - urgency and service tags derived from the text with tg.py's own rules
+    - texts from one-word chatter to multi-paragraph announcements
+
+Usage:
+    python benchmarks/synth.py 10000 -o tg_detailed_ww5905.csv
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from corpus import COMMANDS, LANG_WEIGHTS, PHRASES  # noqa: E402
+from tg import URGENT_KEYWORDS, detect_service_opportunities  # noqa: E402
+from urgency import live_urgency  # noqa: E402
+
+SEED = 7
+GROUP_RATIO = 0.65
+TYPES = {'text': 70, 'media': 15, 'voice': 5, 'bot_command': 3, 'poll': 2, 'location': 1, 'other': 4}
+
+
+def _weights(d: dict) -> np.ndarray:
+    w = np.array(list(d.values()), dtype=float)
+    return w / w.sum()
+
+def _texts(rng: np.random.Generator, langs: np.ndarray, types: np.ndarray) -> list:
+    # Paragraph length is heavy tailed too: most 1 sentence, some 20+
+    lengths = np.minimum(rng.geometric(0.45, len(langs)), 40)
+    out = []
+    for lang, kind, k in zip(langs, types, lengths):
+        if kind == 'bot_command':
+            out.append(COMMANDS[rng.integers(len(COMMANDS))])
+        elif kind in ('text', 'media'):
+            phrases = PHRASES.get(lang, PHRASES['en'])
+            out.append(' '.join(phrases[i] for i in rng.integers(len(phrases), size=k)))
+        else:
+            out.append(f"[{kind} message]")
+    return out
+
+def snapshot(n: int, seed: int = SEED, now: pd.Timestamp = None) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    now = now or pd.Timestamp.now(tz='UTC')
+    is_group = rng.random(n) < GROUP_RATIO
+    unread = np.minimum(rng.pareto(1.2, n) * 4, 20000).astype(int)
+    lang_codes = list(LANG_WEIGHTS) + ['unknown']
+    langs = rng.choice(lang_codes, n, p=_weights({**LANG_WEIGHTS, 'unknown': 1}))
+    types = rng.choice(list(TYPES), n, p=_weights(TYPES))
+    texts = _texts(rng, langs, types)
+
+    last = now - pd.to_timedelta(rng.exponential(4 * 86400, n).clip(0, 60 * 86400), unit='s')
+    first = last - pd.to_timedelta(rng.exponential(6 * 3600, n) * (unread > 0), unit='s')
+    lowered = [t.lower() for t in texts]
+    urgent_kw = np.array([any(kw in t for kw in URGENT_KEYWORDS) for t in lowered])
+    known = rng.random(n) < 0.03
+    base = 40 * urgent_kw + 20 * known + 10 * is_group
+    score = live_urgency(pd.Series(base), pd.Series(last), now)
+    followup = rng.random(n) < 0.25
+    services = [', '.join(detect_service_opportunities(t)) or 'None' for t in texts]
+    eager = ~is_group | (score >= 50)
+    sender = rng.integers(10**6, 10**9, n)
+
+    return pd.DataFrame({
+        'Chat Name': [f"{'Group' if g else 'Contact'} {i}" for i, g in enumerate(is_group)],
+        'Chat ID': np.where(is_group, -1001000000000 - np.arange(n), 10**8 + np.arange(n)),
+        'Is Group': is_group,
+        'Unread Count': unread,
+        'Urgency Score': score,
+        'Urgency Base': base,
+        'Needs Followup': followup,
+        'Service Opportunities': services,
+        'First Message Date': first,
+        'Last Unread Message Date': last,
+        'Duration Unread (min)': (last - first).total_seconds() / 60,
+        'Last Sender ID': sender,
+        'Last Sender Username': [f"user{s}" for s in sender],
+        'Last Sender Name': [f"User {s % 1000}" for s in sender],
+        'Last Message Type': types,
+        'Language': langs,
+        'Duplicate Messages': rng.poisson(0.3, n) * is_group,
+        'Last Message ID': rng.integers(1, 10**6, n),
+        'Last Message Text': texts,
+        'AI Reply': np.where(eager, 'Thanks for reaching out, happy to help. When suits you for a quick call?', 'N/A'),
+        'Summary': [t[:200] for t in texts],
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic chat snapshot CSV')
+    parser.add_argument('chats', type=int)
+    parser.add_argument('-o', '--output', default='tg_detailed_ww5905.csv')
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+    snapshot(args.chats, args.seed).to_csv(args.output, index=False)
+    print(f"Wrote {args.chats:,} chats to {args.output}")
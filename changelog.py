@@ -0,0 +1,215 @@
+"""
+Change feed for telegram.db: what changed, in order, since a cursor.
+
+Downstream tools (CRM import, digest bots) used to diff whole CSV exports to
+find what changed between syncs. Every change is now also appended to the
+`changelog` table instead. Each record has a `seq` (AUTOINCREMENT, so it
+only ever grows, even after old records are expired), a kind, the chat and
+message it concerns, and a small JSON payload:
+
+    message          a message seen for the first time
+    message_edited   a stored message whose text changed
+    urgency          a chat's urgency base or follow-up flag changed
+    opportunity      a new (message, service) opportunity
+    summary          a chat summary was written (sync or on demand)
+    reply            an AI reply draft was stored for a chat's newest message
+    reply_status     the outbox sent, failed or queued a chat's reply
+
+Most records are written by triggers, so every writer (the three fetchers,
+backfill, sweep, the outbox, the dashboards) feeds the changelog without
+knowing about it. Triggers compare against the stored row, so re-syncing
+unchanged messages adds nothing. Sync summaries never reach a table, so
+the fetchers call record() for them.
+
+A consumer keeps the last seq it processed and asks for everything after
+it, with read() or `python changelog.py --since N`. Named consumers can
+let the table keep their cursor instead (--consumer). Records are kept
+until "changelog_days" is set under "retention" (see maintenance.py).
+
+Usage:
+    python changelog.py [--since N | --consumer NAME] [--kinds K ...] [--limit N] [-o out.jsonl]
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from store import has_account_key
+
+DB_FILE = 'telegram.db'
+KINDS = ('message', 'message_edited', 'urgency', 'opportunity', 'summary', 'reply', 'reply_status')
+PAGE = 1000
+_NOW = "((julianday('now') - 2440587.5) * 86400.0)"  # epoch seconds, inside a trigger
+
+# {table: [(trigger name, SQL)]}; installed once the table exists and, except for
+# summaries, is keyed by account (see store.py)
+_TRIGGERS = {
+    'messages': [
+        ('changelog_message', f'''BEFORE INSERT ON messages
+            WHEN NOT EXISTS (SELECT 1 FROM messages WHERE chat_id = NEW.chat_id AND message_id = NEW.message_id
+                             AND account = NEW.account)
+            BEGIN INSERT INTO changelog (ts, kind, chat_id, message_id, account, data) VALUES ({_NOW}, 'message',
+                NEW.chat_id, NEW.message_id, NEW.account,
+                json_object('date', NEW.date, 'sender_id', NEW.sender_id, 'text', NEW.text,
+                            'reply_to_msg_id', NEW.reply_to_msg_id, 'is_mention', NEW.is_mention)); END'''),
+        ('changelog_message_edited', f'''BEFORE INSERT ON messages
+            WHEN EXISTS (SELECT 1 FROM messages WHERE chat_id = NEW.chat_id AND message_id = NEW.message_id
+                         AND account = NEW.account AND text IS NOT NEW.text)
+            BEGIN INSERT INTO changelog (ts, kind, chat_id, message_id, account, data) VALUES ({_NOW}, 'message_edited',
+                NEW.chat_id, NEW.message_id, NEW.account, json_object('text', NEW.text)); END'''),
+    ],
+    'chats': [
+        ('changelog_urgency', f'''BEFORE INSERT ON chats
+            WHEN NOT EXISTS (SELECT 1 FROM chats WHERE chat_id = NEW.chat_id AND account = NEW.account
+                             AND urgency_base IS NEW.urgency_base AND needs_followup IS NEW.needs_followup)
+            BEGIN INSERT INTO changelog (ts, kind, chat_id, account, data) VALUES ({_NOW}, 'urgency', NEW.chat_id,
+                NEW.account,
+                json_object('name', NEW.name, 'urgency_base', NEW.urgency_base, 'urgency_score', NEW.urgency_score,
+                            'needs_followup', NEW.needs_followup,
+                            'previous_base', (SELECT urgency_base FROM chats WHERE chat_id = NEW.chat_id
+                                              AND account = NEW.account))); END'''),
+    ],
+    'opportunities': [
+        ('changelog_opportunity', f'''AFTER INSERT ON opportunities
+            BEGIN INSERT INTO changelog (ts, kind, chat_id, message_id, account, data) VALUES ({_NOW}, 'opportunity',
+                NEW.chat_id, NEW.message_id, NEW.account, json_object('service', NEW.service, 'timestamp', NEW.timestamp)); END'''),
+    ],
+    'summaries': [
+        ('changelog_summary', f'''AFTER INSERT ON summaries
+            BEGIN INSERT INTO changelog (ts, kind, chat_id, data) VALUES ({_NOW}, 'summary', NEW.chat_id,
+                json_object('summary', NEW.summary, 'source', 'on_demand')); END'''),
+    ],
+    'ai_replies': [
+        ('changelog_reply', f'''AFTER INSERT ON ai_replies
+            BEGIN INSERT INTO changelog (ts, kind, chat_id, message_id, account, data) VALUES ({_NOW}, 'reply',
+                NEW.chat_id, NEW.message_id, NEW.account, json_object('reply', NEW.reply)); END'''),
+    ],
+}
+# Needs a column that outbox.py adds later
+_STATUS_TRIGGER = ('changelog_reply_status', f'''AFTER UPDATE OF reply_status ON chats
+    WHEN NEW.reply_status IS NOT OLD.reply_status
+    BEGIN INSERT INTO changelog (ts, kind, chat_id, account, data) VALUES ({_NOW}, 'reply_status', NEW.chat_id,
+        NEW.account, json_object('status', NEW.reply_status, 'sent_at', NEW.reply_sent_at)); END''')
+
+
+def init_tables(conn: sqlite3.Connection):
+    """Create the changelog and install triggers on whichever source tables exist; safe to repeat."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS changelog (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL,
+        kind TEXT,
+        chat_id INTEGER,
+        message_id INTEGER,
+        account TEXT,
+        data TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS changelog_cursors (
+        consumer TEXT PRIMARY KEY,
+        seq INTEGER,
+        updated_at REAL
+    )''')
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    # A table still on its pre-account key gets its triggers after the migration that rebuilds it;
+    # installed now, they would fail every insert for want of NEW.account
+    keyed = {t for t in tables if t == 'summaries' or has_account_key(conn, t)}
+    triggers = [t for table, ts in _TRIGGERS.items() if table in keyed for t in ts]
+    if 'chats' in keyed and 'reply_status' in {r[1] for r in conn.execute('PRAGMA table_info(chats)')}:
+        triggers.append(_STATUS_TRIGGER)
+    for name, body in triggers:
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+    conn.commit()
+
+def record(conn: sqlite3.Connection, kind: str, chat_id: int, data: Dict, message_id: Optional[int] = None,
+           account: Optional[str] = None):
+    """Append one record by hand, for changes that are not a row in some table. Not committed."""
+    conn.execute('INSERT INTO changelog (ts, kind, chat_id, message_id, account, data) VALUES (?, ?, ?, ?, ?, ?)',
+                 (time.time(), kind, chat_id, message_id, account, json.dumps(data, default=str)))
+
+def latest(conn: sqlite3.Connection) -> int:
+    """The newest seq, 0 for an empty changelog."""
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changelog').fetchone()[0]
+
+def read(conn: sqlite3.Connection, since: int = 0, limit: int = PAGE,
+         kinds: Optional[Sequence[str]] = None) -> Tuple[List[Dict], int]:
+    """Up to `limit` records with seq > since, oldest first, and the cursor to pass next time."""
+    # Bounded by the newest seq seen first: a filtered, short page can then move the
+    # cursor past everything scanned without skipping a record committed meanwhile
+    upper = latest(conn)
+    sql = 'SELECT seq, ts, kind, chat_id, message_id, account, data FROM changelog WHERE seq > ? AND seq <= ?'
+    params: list = [since, upper]
+    if kinds:
+        sql += f" AND kind IN ({', '.join('?' * len(kinds))})"
+        params += list(kinds)
+    rows = conn.execute(sql + ' ORDER BY seq LIMIT ?', params + [limit]).fetchall()
+    records = [{'seq': seq, 'ts': ts, 'kind': kind, 'chat_id': chat_id, 'message_id': message_id,
+                'account': account, 'data': json.loads(data) if data else None}
+               for seq, ts, kind, chat_id, message_id, account, data in rows]
+    return records, records[-1]['seq'] if len(records) == limit else max(since, upper)
+
+def iter_since(conn: sqlite3.Connection, since: int = 0, kinds: Optional[Sequence[str]] = None,
+               page: int = PAGE) -> Iterable[Dict]:
+    """Every record after `since`, read a page at a time."""
+    while True:
+        records, since = read(conn, since, page, kinds)
+        yield from records
+        if len(records) < page:
+            return
+
+def cursor(conn: sqlite3.Connection, consumer: str) -> int:
+    row = conn.execute('SELECT seq FROM changelog_cursors WHERE consumer = ?', (consumer,)).fetchone()
+    return row[0] if row else 0
+
+def commit_cursor(conn: sqlite3.Connection, consumer: str, seq: int):
+    conn.execute('INSERT INTO changelog_cursors (consumer, seq, updated_at) VALUES (?, ?, ?) '
+                 'ON CONFLICT (consumer) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at',
+                 (consumer, seq, time.time()))
+    conn.commit()
+
+def export_jsonl(conn: sqlite3.Connection, out, since: int = 0, kinds: Optional[Sequence[str]] = None,
+                 limit: Optional[int] = None) -> Tuple[int, int]:
+    """Write records after `since` to `out`, one JSON object per line; returns (count, new cursor)."""
+    count = 0
+    while limit is None or count < limit:
+        page = PAGE if limit is None else min(PAGE, limit - count)
+        records, since = read(conn, since, page, kinds)
+        for rec in records:
+            out.write(json.dumps(rec, ensure_ascii=False) + '\n')
+        count += len(records)
+        if len(records) < page:
+            break
+    return count, since
+
+def expire(conn: sqlite3.Connection, before: float, dry_run: bool = False) -> int:
+    """Drop records written before `before` (epoch seconds). seq numbers are never reused."""
+    if dry_run:
+        return conn.execute('SELECT COUNT(*) FROM changelog WHERE ts < ?', (before,)).fetchone()[0]
+    with conn:
+        return conn.execute('DELETE FROM changelog WHERE ts < ?', (before,)).rowcount
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export changelog records as JSONL')
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--since', type=int, default=0, help='export records after this seq')
+    where.add_argument('--consumer', help='resume from, and then advance, this named cursor')
+    parser.add_argument('--kinds', nargs='+', choices=KINDS)
+    parser.add_argument('--limit', type=int, help='at most this many records')
+    parser.add_argument('-o', '--output', help='append to this file instead of stdout')
+    parser.add_argument('--db', default=DB_FILE)
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.db) as conn:
+        init_tables(conn)
+        since = cursor(conn, args.consumer) if args.consumer else args.since
+        out = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+        try:
+            count, last = export_jsonl(conn, out, since, args.kinds, args.limit)
+        finally:
+            if args.output:
+                out.close()
+        if args.consumer:
+            commit_cursor(conn, args.consumer, last)
+    print(f"{count} records, next cursor {last}", file=sys.stderr)
@@ -0,0 +1,116 @@
+"""
+Lightweight command line for status and metrics queries.
+
+Reads telegram.db and the index files directly with the standard library, so
+it answers in milliseconds without importing pandas, telethon or openai.
+
+Usage:
+    python cli.py status [--json]
+    python cli.py metrics [--json]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+from urgency import current_urgency
+
+DB_FILE = 'telegram.db'
+INDEX_IDS = os.path.join('index', 'ids.i64')
+HIGH_URGENCY = 50
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    dt = datetime.fromisoformat(str(value))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _tables(conn: sqlite3.Connection) -> set:
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def status(db_file: str = DB_FILE) -> Dict:
+    info = {
+        'db_file': db_file,
+        'db_exists': os.path.exists(db_file),
+        'db_bytes': os.path.getsize(db_file) if os.path.exists(db_file) else 0,
+        'index_rows': os.path.getsize(INDEX_IDS) // 16 if os.path.exists(INDEX_IDS) else 0,
+        'sessions': sorted(glob.glob('*.session')),
+        'csv_exports': sorted(glob.glob('*.csv')),
+        'tables': {},
+    }
+    if info['db_exists']:
+        with sqlite3.connect(db_file) as conn:
+            for table in sorted(_tables(conn)):
+                if not table.startswith('sqlite_'):
+                    info['tables'][table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            if 'chats' in info['tables']:
+                info['latest_message'] = conn.execute('SELECT MAX(last_message_date) FROM chats').fetchone()[0]
+    return info
+
+def metrics(db_file: str = DB_FILE) -> Dict:
+    """Dashboard headline numbers from the chats table, with urgency decayed to now."""
+    if not os.path.exists(db_file):
+        return {}
+    now = datetime.now(timezone.utc)
+    with sqlite3.connect(db_file) as conn:
+        conn.row_factory = sqlite3.Row
+        cols = {r[1] for r in conn.execute('PRAGMA table_info(chats)')}
+        rows = conn.execute('SELECT * FROM chats').fetchall()
+        opportunities = dict(conn.execute('SELECT service, COUNT(*) FROM opportunities GROUP BY service').fetchall()) \
+            if 'opportunities' in _tables(conn) else {}
+
+    out = {'chats': len(rows), 'groups': 0, 'private': 0, 'group_unread': 0, 'private_unread': 0,
+           'active_groups_7d': 0, 'needs_followup': 0, 'high_urgency': 0, 'messages_today': 0,
+           'opportunities': opportunities}
+    if 'needs_deep_sync' in cols:
+        out['needs_deep_sync'] = 0
+    for r in rows:
+        last = _parse_date(r['last_message_date'])
+        # A quick sync (quicksync.py) may have seen a newer message than the last full sync
+        top = _parse_date(r['top_message_date']) if 'top_message_date' in cols else None
+        seen = max(top, last) if top and last else top or last
+        unread = (r['unread_count'] or 0) if 'unread_count' in cols else 0
+        base = r['urgency_base'] if 'urgency_base' in cols and r['urgency_base'] is not None else None
+        urgency = current_urgency(base, last, now) if base is not None and last else (r['urgency_score'] or 0)
+        if r['is_group']:
+            out['groups'] += 1
+            out['group_unread'] += unread
+            if seen and seen > now - timedelta(days=7):
+                out['active_groups_7d'] += 1
+        else:
+            out['private'] += 1
+            out['private_unread'] += unread
+        out['needs_followup'] += bool(r['needs_followup'])
+        out['high_urgency'] += urgency >= HIGH_URGENCY
+        out['messages_today'] += bool(seen and seen.date() == now.date())
+        if 'needs_deep_sync' in cols:
+            out['needs_deep_sync'] += bool(r['needs_deep_sync'])
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=['status', 'metrics'])
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    args = parser.parse_args(argv)
+
+    result = status(args.db) if args.command == 'status' else metrics(args.db)
+    if args.json:
+        print(json.dumps(result, indent=2, default=str))
+    elif not result:
+        print(f"No data yet ({args.db} not found)")
+    else:
+        for key, value in result.items():
+            print(f"{key:>18}: {value}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Near-duplicate detection for crossposted announcements and spam.
+
+Each message is reduced to a MinHash signature over character shingles and
+bucketed with banded LSH. Signatures and buckets live in telegram.db, so a
+text first seen in one chat is recognised when it turns up in another chat
+on a later sync. The first copy becomes the canonical member of its cluster
+and every later copy is marked as a duplicate.
+"""
+
+import re
+import sqlite3
+import zlib
+from typing import Collection, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from store import account_key, create_keyed_table
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS  # ~0.5 Jaccard threshold for a candidate match
+SHINGLE = 5
+MIN_CHARS = 30            # short replies ("gm", "ok thanks") are never collapsed
+THRESHOLD = 0.7           # estimated Jaccard needed to join a cluster
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(27)
+_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, NUM_PERM, dtype=np.uint64)
+_WS_RE = re.compile(r'\s+')
+_URL_RE = re.compile(r'https?://\S+')
+
+
+def normalize(text: str) -> str:
+    text = _URL_RE.sub('<url>', (text or '').lower())
+    return _WS_RE.sub(' ', text).strip()
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """MinHash signature of the text, or None if it is too short to dedupe."""
+    text = normalize(text)
+    if len(text) < MIN_CHARS:
+        return None
+    shingles = {text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    return ((np.outer(hashes, _A) + _B) % _MERSENNE).min(axis=0)
+
+def band_keys(signature: np.ndarray) -> List[int]:
+    return [zlib.crc32(signature[b * ROWS:(b + 1) * ROWS].tobytes()) for b in range(BANDS)]
+
+
+class DuplicateDetector:
+    """Assigns messages to near-duplicate clusters, persisting state in `conn`.
+
+    Clusters span accounts; a message's membership is stored per `account`.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, account: Optional[str] = None):
+        self.conn = conn
+        self.account = account_key(account)
+        self._signatures: Dict[int, np.ndarray] = {}
+        init_tables(conn)
+
+    def _signature(self, cluster_id: int) -> np.ndarray:
+        if cluster_id not in self._signatures:
+            row = self.conn.execute('SELECT signature FROM dup_clusters WHERE cluster_id = ?',
+                                    (cluster_id,)).fetchone()
+            self._signatures[cluster_id] = np.frombuffer(row[0], dtype=np.uint64)
+        return self._signatures[cluster_id]
+
+    def check(self, chat_id: int, message_id: int, text: str,
+              signature: Optional[np.ndarray] = None) -> Tuple[Optional[int], bool]:
+        """Return (cluster_id, is_duplicate) for a message, registering it if new.
+
+        Short or empty messages get (None, False). Re-checking a message that
+        was already registered returns its stored result. `signature` may be
+        passed in when minhash() was already computed off the event loop.
+        """
+        known = self._known(chat_id, message_id, None)
+        if known is not None:
+            return known
+        c = self.conn.cursor()
+
+        sig = signature if signature is not None else minhash(text)
+        if sig is None:
+            return None, False
+        keys = band_keys(sig)
+
+        cluster_id = None
+        candidates = set()
+        for band, key in enumerate(keys):
+            c.execute('SELECT cluster_id FROM dup_bands WHERE band = ? AND bucket = ?', (band, key))
+            candidates.update(r[0] for r in c.fetchall())
+        for cand in sorted(candidates):
+            if np.mean(self._signature(cand) == sig) >= THRESHOLD:
+                cluster_id = cand
+                break
+
+        if cluster_id is None:
+            is_duplicate = False
+            c.execute('INSERT INTO dup_clusters (chat_id, message_id, size, signature) VALUES (?, ?, 1, ?)',
+                      (chat_id, message_id, sig.tobytes()))
+            cluster_id = c.lastrowid
+            self._signatures[cluster_id] = sig
+            c.executemany('INSERT OR IGNORE INTO dup_bands (band, bucket, cluster_id) VALUES (?, ?, ?)',
+                          [(band, key, cluster_id) for band, key in enumerate(keys)])
+        else:
+            # The canonical copy itself, registered first by another account, is no repeat
+            canonical = c.execute('SELECT chat_id, message_id FROM dup_clusters WHERE cluster_id = ?',
+                                  (cluster_id,)).fetchone()
+            is_duplicate = tuple(canonical) != (chat_id, message_id)
+            if is_duplicate:
+                c.execute('UPDATE dup_clusters SET size = size + 1 WHERE cluster_id = ?', (cluster_id,))
+        c.execute('INSERT INTO message_clusters (chat_id, message_id, account, cluster_id, is_duplicate) '
+                  'VALUES (?, ?, ?, ?, ?)', (chat_id, message_id, self.account, cluster_id, is_duplicate))
+        return cluster_id, is_duplicate
+
+    def check_many(self, chat_id: int, messages: Sequence,
+                   signatures: Optional[Dict[int, Optional[np.ndarray]]] = None) -> Dict[int, Tuple[Optional[int], bool]]:
+        """Check Telethon-style messages (newest first, as iter_messages yields them).
+
+        Messages are registered oldest first so the earliest copy in a chat is
+        the canonical one. Returns {message_id: (cluster_id, is_duplicate)}.
+        """
+        if signatures is None:
+            return {m.id: self.check(chat_id, m.id, m.text) for m in reversed(messages)}
+        # Precomputed: a None signature means "too short", so skip minhash() entirely
+        result = {}
+        for m in reversed(messages):
+            sig = signatures.get(m.id)
+            result[m.id] = self.check(chat_id, m.id, m.text, sig) if sig is not None else self._known(chat_id, m.id)
+        return result
+
+    def crossposted(self, chat_id: int, clusters: Dict[int, Tuple[Optional[int], bool]]) -> Set[int]:
+        """The clusters among `clusters` whose canonical copy was seen in another chat."""
+        ids = {cid for cid, _ in clusters.values() if cid is not None}
+        if not ids:
+            return set()
+        rows = self.conn.execute(f"SELECT cluster_id FROM dup_clusters WHERE chat_id != ? "
+                                 f"AND cluster_id IN ({', '.join('?' * len(ids))})", (chat_id, *ids))
+        return {r[0] for r in rows}
+
+    def _known(self, chat_id: int, message_id: int, default=(None, False)) -> Optional[Tuple[Optional[int], bool]]:
+        row = self.conn.execute('SELECT cluster_id, is_duplicate FROM message_clusters '
+                                'WHERE chat_id = ? AND message_id = ? AND account = ?',
+                                (chat_id, message_id, self.account)).fetchone()
+        return (row[0], bool(row[1])) if row else default
+
+
+def init_tables(conn: sqlite3.Connection):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS dup_clusters (
+        cluster_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        message_id INTEGER,
+        size INTEGER,
+        signature BLOB
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS dup_bands (
+        band INTEGER,
+        bucket INTEGER,
+        cluster_id INTEGER,
+        PRIMARY KEY (band, bucket, cluster_id)
+    )''')
+    conn.commit()
+    create_keyed_table(conn, 'message_clusters', '''CREATE TABLE IF NOT EXISTS {name} (
+        chat_id INTEGER,
+        message_id INTEGER,
+        account TEXT NOT NULL DEFAULT '',
+        cluster_id INTEGER,
+        is_duplicate BOOLEAN,
+        PRIMARY KEY (chat_id, message_id, account)
+    )''')
+
+def only_duplicates(clusters: Dict[int, Tuple[Optional[int], bool]], among: Optional[Collection[int]] = None) -> bool:
+    """True when every message is a copy of something already seen.
+
+    With `among` (e.g. the ids save_messages newly stored) only those count;
+    when it is empty nothing is new and the verdict over all of them stands.
+    """
+    if among:
+        clusters = {message_id: c for message_id, c in clusters.items() if message_id in among}
+    return bool(clusters) and all(dup for _, dup in clusters.values())
+
+def collapse(messages: Iterable, clusters: Dict[int, Tuple[Optional[int], bool]],
+             crossposted: Collection[int] = ()) -> List[Tuple[object, int, bool]]:
+    """Fold repeated copies of the same cluster into one entry.
+
+    Returns (message, copies_in_this_list, crossposted) triples in the order
+    each cluster first appears. The canonical copy stands for its cluster
+    when it is in the list, else the first copy. `crossposted` is True when
+    the cluster is in `crossposted`, i.e. its canonical copy is in another
+    chat (see DuplicateDetector.crossposted).
+    """
+    kept: List[list] = []
+    by_cluster: Dict[int, list] = {}
+    for msg in messages:
+        cluster_id, dup = clusters.get(msg.id, (None, False))
+        if cluster_id is not None and cluster_id in by_cluster:
+            entry = by_cluster[cluster_id]
+            entry[1] += 1
+            if not dup:
+                entry[0] = msg
+            continue
+        entry = [msg, 1, cluster_id in crossposted]
+        kept.append(entry)
+        if cluster_id is not None:
+            by_cluster[cluster_id] = entry
+    return [tuple(e) for e in kept]
@@ -0,0 +1,168 @@
+"""
+Which dialogs a fetch should process, decided from get_dialogs() metadata.
+
+Every fetcher used to run the full pipeline (history, analysis, LLM) on
+every dialog, including archived chats, muted mega-groups and broadcast
+channels followed only for news. DialogPolicy filters the dialog list
+before any history is requested, using only what get_dialogs() already
+returned. Rules are applied in order, and the first one that matches
+decides:
+
+    1. deny list         -> skip
+    2. allow list        -> keep (overrides every rule below)
+    3. migrated groups   -> skip (the supergroup they became is its own dialog)
+    4. type              -> keep only 'private' / 'group' / 'channel' in `types`
+    5. archived          -> 'include' | 'exclude' | 'only'
+    6. muted             -> 'include' | 'exclude' | 'only'
+    7. folders           -> keep only chats listed in these chat folders
+    8. min_unread        -> skip chats with fewer unread messages
+
+Settings live under "dialog_policy" in config.json, e.g.
+    {"dialog_policy": {"types": ["private", "group"], "muted": "exclude",
+                       "min_unread": 1, "deny": [-1001234567890]}}
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
+TYPES = ('private', 'group', 'channel')
+MODES = ('include', 'exclude', 'only')
+
+
+def dialog_type(dialog) -> str:
+    if dialog.is_user:
+        return 'private'
+    if dialog.is_channel and not dialog.is_group:
+        return 'channel'
+    return 'group'
+
+def is_muted(dialog, now: Optional[datetime] = None) -> bool:
+    settings = getattr(getattr(dialog, 'dialog', None), 'notify_settings', None)
+    mute_until = getattr(settings, 'mute_until', None)
+    if mute_until is None:
+        return False
+    if isinstance(mute_until, int):  # raw timestamp on some layers
+        mute_until = datetime.fromtimestamp(mute_until, timezone.utc)
+    return mute_until > (now or datetime.now(timezone.utc))
+
+def is_migrated(dialog) -> bool:
+    """A basic group that was upgraded to a supergroup, or deactivated."""
+    entity = getattr(dialog, 'entity', None)
+    return bool(getattr(entity, 'migrated_to', None) or getattr(entity, 'deactivated', False))
+
+def _mode_allows(mode: str, flag: bool) -> bool:
+    return mode == 'include' or (flag if mode == 'only' else not flag)
+
+
+class DialogPolicy:
+    """Filter for get_dialogs() results; see the module docstring for the rules."""
+
+    def __init__(self, types: Iterable[str] = TYPES, archived: str = 'include', muted: str = 'include',
+                 folders: Iterable[str] = (), min_unread: int = 0,
+                 allow: Iterable[int] = (), deny: Iterable[int] = (), skip_migrated: bool = True):
+        self.types = set(types)
+        self.archived = archived
+        self.muted = muted
+        self.folders = list(folders)
+        self.min_unread = min_unread
+        self.allow: Set[int] = {int(c) for c in allow}
+        self.deny: Set[int] = {int(c) for c in deny}
+        self.skip_migrated = skip_migrated
+        unknown = self.types - set(TYPES)
+        if unknown:
+            raise ValueError(f"Unknown dialog types: {sorted(unknown)}")
+        for name, mode in (('archived', archived), ('muted', muted)):
+            if mode not in MODES:
+                raise ValueError(f"{name} must be one of {MODES}, not {mode!r}")
+        self._folder_peers: Optional[Set[int]] = None
+
+    @classmethod
+    def from_dict(cls, cfg: Dict) -> 'DialogPolicy':
+        return cls(**{k: v for k, v in cfg.items() if k in (
+            'types', 'archived', 'muted', 'folders', 'min_unread', 'allow', 'deny', 'skip_migrated')})
+
+    @classmethod
+    def from_config(cls, path: str = CONFIG_FILE) -> 'DialogPolicy':
+        cfg = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    cfg = json.load(f).get('dialog_policy', {})
+            except Exception as e:
+                logging.error(f"Ignoring unreadable dialog_policy in {path}: {e}")
+        return cls.from_dict(cfg)
+
+    def to_dict(self) -> Dict:
+        return {'types': sorted(self.types), 'archived': self.archived, 'muted': self.muted,
+                'folders': self.folders, 'min_unread': self.min_unread, 'allow': sorted(self.allow),
+                'deny': sorted(self.deny), 'skip_migrated': self.skip_migrated}
+
+    async def resolve_folders(self, client):
+        """Look up the chat ids in the configured chat folders (one request; no-op without folders).
+
+        Only chats listed in a folder explicitly (included or pinned) count;
+        rule-based membership such as "all non-contacts" is not expanded.
+        """
+        if not self.folders:
+            return
+        from telethon import functions, utils
+
+        result = await client(functions.messages.GetDialogFiltersRequest())
+        filters = getattr(result, 'filters', result)  # a plain list on older layers
+        wanted = set(self.folders)
+        self._folder_peers = set()
+        for f in filters:
+            title = getattr(f, 'title', None)
+            title = getattr(title, 'text', title)  # TextWithEntities on newer layers
+            if title in wanted:
+                for peer in list(getattr(f, 'include_peers', [])) + list(getattr(f, 'pinned_peers', [])):
+                    self._folder_peers.add(utils.get_peer_id(peer))
+
+    def reason_to_skip(self, dialog, now: Optional[datetime] = None) -> Optional[str]:
+        """None if the dialog should be fetched, else a short reason."""
+        if dialog.id in self.deny:
+            return 'denied'
+        if dialog.id in self.allow:
+            return None
+        if self.skip_migrated and is_migrated(dialog):
+            return 'migrated'
+        if dialog_type(dialog) not in self.types:
+            return dialog_type(dialog)
+        if not _mode_allows(self.archived, bool(getattr(dialog, 'archived', False))):
+            return 'archived' if self.archived == 'exclude' else 'not archived'
+        if not _mode_allows(self.muted, is_muted(dialog, now)):
+            return 'muted' if self.muted == 'exclude' else 'not muted'
+        if self.folders and self._folder_peers is not None and dialog.id not in self._folder_peers:
+            return 'not in folder'
+        if (dialog.unread_count or 0) < self.min_unread:
+            return 'too few unread'
+        return None
+
+    def select(self, dialogs: Iterable) -> Tuple[List, Dict[str, int]]:
+        """Split dialogs into (kept, {skip reason: count})."""
+        now = datetime.now(timezone.utc)
+        kept, skipped = [], {}
+        for dialog in dialogs:
+            reason = self.reason_to_skip(dialog, now)
+            if reason is None:
+                kept.append(dialog)
+            else:
+                skipped[reason] = skipped.get(reason, 0) + 1
+        return kept, skipped
+
+
+async def select_dialogs(client, dialogs: List, policy: Optional[DialogPolicy] = None) -> List:
+    """Apply `policy` (default: from config.json) and log what was skipped."""
+    policy = policy or DialogPolicy.from_config()
+    try:
+        await policy.resolve_folders(client)
+    except Exception as e:
+        logging.error(f"Could not load chat folders, ignoring the folder rule: {e}")
+    kept, skipped = policy.select(dialogs)
+    if skipped:
+        logging.info(f"Dialog policy kept {len(kept)}/{len(dialogs)} dialogs; skipped {skipped}")
+    return kept
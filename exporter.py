@@ -0,0 +1,133 @@
+"""
+Background exports of the dashboard frame to CSV, gzipped CSV or Excel.
+
+An ExportJob writes the frame in CHUNK_ROWS slices from a daemon thread,
+so the Streamlit script that started it returns at once and can poll
+`progress` on later reruns. Excel goes through xlsxwriter's constant_memory
+mode, which flushes every row to disk as it is written instead of building
+the workbook in memory. Output goes to a temporary name and is renamed into
+place when complete, so a half-written file is never offered for download.
+"""
+
+import gzip
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+
+CHUNK_ROWS = 5000
+EXCEL_MAX_ROWS = 1_048_576  # including the header row
+FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'xlsx': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def export_filename(fmt: str, prefix: str = 'telegram_export') -> str:
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FORMATS[fmt][0]}"
+
+
+class ExportJob:
+    """One export of `df` to `path`, run in the background by start()."""
+
+    def __init__(self, df: pd.DataFrame, fmt: str = 'csv', path: Optional[str] = None,
+                 chunk_rows: int = CHUNK_ROWS):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.df = df
+        self.fmt = fmt
+        self.path = path or export_filename(fmt)
+        self.mime = FORMATS[fmt][1]
+        self.chunk_rows = chunk_rows
+        self.total = len(df)
+        self.rows_done = 0
+        self.status = 'pending'   # pending -> running -> done | failed
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def progress(self) -> float:
+        return self.rows_done / self.total if self.total else 1.0
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def running(self) -> bool:
+        return self.status in ('pending', 'running')
+
+    def start(self) -> 'ExportJob':
+        self._thread = threading.Thread(target=self.run, name=f"export-{self.fmt}", daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """Write the export in the calling thread; start() runs this in the background."""
+        self.status = 'running'
+        self.started = time.monotonic()
+        tmp = f"{self.path}.part"
+        try:
+            if self.fmt == 'xlsx':
+                self._write_xlsx(tmp)
+            else:
+                self._write_csv(tmp)
+            os.replace(tmp, self.path)
+            self.status = 'done'
+        except Exception as e:
+            self.error = str(e)
+            self.status = 'failed'
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        finally:
+            self.finished = time.monotonic()
+
+    def _chunks(self):
+        for start in range(0, self.total, self.chunk_rows):
+            yield self.df.iloc[start:start + self.chunk_rows]
+
+    def _write_csv(self, path: str):
+        opener = gzip.open if self.fmt == 'csv.gz' else open
+        with opener(path, 'wt', newline='', encoding='utf-8') as f:
+            if self.total == 0:
+                self.df.to_csv(f, index=False)
+            for i, chunk in enumerate(self._chunks()):
+                chunk.to_csv(f, index=False, header=i == 0)
+                self.rows_done += len(chunk)
+
+    def _write_xlsx(self, path: str):
+        import xlsxwriter
+
+        if self.total + 1 > EXCEL_MAX_ROWS:
+            raise ValueError(f"{self.total:,} rows exceed Excel's sheet limit; export as CSV instead")
+        # constant_memory: rows must be written in order and are flushed as they go
+        workbook = xlsxwriter.Workbook(path, {
+            'constant_memory': True,
+            'remove_timezone': True,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        })
+        try:
+            sheet = workbook.add_worksheet('Chats')
+            sheet.write_row(0, 0, [str(c) for c in self.df.columns])
+            row = 1
+            for chunk in self._chunks():
+                # Python scalars with None for NaN/NaT, which xlsxwriter writes as blanks
+                chunk = chunk.astype(object).where(chunk.notna(), None)
+                for values in chunk.itertuples(index=False, name=None):
+                    sheet.write_row(row, 0, values)
+                    row += 1
+                self.rows_done += len(chunk)
+        finally:
+            workbook.close()
@@ -0,0 +1,77 @@
+"""
+Process-wide, single-flight runner for the dashboard's background fetch.
+
+standalone.py used to start a fetch thread per browser session, so two open
+tabs ran two full syncs against the same session file, telegram.db and CSV.
+FetchService is created once per server process (st.cache_resource) and
+runs at most one fetch at a time: request() starts a run, or returns the id
+of the one already in flight, and every session polls the same progress and
+outcome by that id.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+Progress = Tuple[int, int, str]  # (current, total, chat_name)
+
+
+class FetchService:
+    """Runs `target(report)` in a daemon thread, one run at a time.
+
+    `target` is an async callable; it calls report(current, total, name) as
+    it goes. Runs are numbered from 1.
+    """
+
+    def __init__(self, target: Callable):
+        self._target = target
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._outcomes: Dict[int, Optional[str]] = {}  # run_id -> error, None on success
+        self.run_id = 0
+        self.progress: Optional[Progress] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.requests = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def request(self) -> int:
+        """Start a fetch unless one is already running; returns the run to follow."""
+        with self._lock:
+            self.requests += 1
+            if self.running:
+                return self.run_id
+            self.run_id += 1
+            self.progress = None
+            self.started = time.time()
+            self.finished = None
+            self._thread = threading.Thread(target=self._run, args=(self.run_id,),
+                                            name=f"fetch-{self.run_id}", daemon=True)
+            self._thread.start()
+            return self.run_id
+
+    def done(self, run_id: int) -> bool:
+        return run_id in self._outcomes
+
+    def error(self, run_id: int) -> Optional[str]:
+        return self._outcomes.get(run_id)
+
+    def report(self, current: int, total: int, name: str):
+        self.progress = (current, total, name)
+
+    def _run(self, run_id: int):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        error = None
+        try:
+            loop.run_until_complete(self._target(self.report))
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            loop.close()
+            self.finished = time.time()
+            self._outcomes[run_id] = error
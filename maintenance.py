@@ -0,0 +1,283 @@
+"""
+Retention, compaction and vacuum for the local data store.
+
+Without this, telegram.db, ./messages and the telegram_export_* files only
+ever grow. Each data class has its own retention, under "retention" in
+config.json (days; 0 or null keeps that class forever). Nothing is deleted
+until a window is set there; every class defaults to forever:
+
+    messages     raw rows in `messages` (and their `message_clusters` entries)
+    transcripts  ./messages/*.txt not rewritten by a sync for that long
+    summaries    generated text: `summaries` and `ai_replies`
+    changelog    change records in `changelog` (see changelog.py)
+    exports      telegram_export_* files written by the dashboards
+
+Expired messages are compacted before they are deleted: any the activity
+rollups have not counted yet are added to them first (see rollups.py), so the
+Analytics charts keep their history. Rows are deleted in small batches, one
+transaction each, so a sync running at the same time is never blocked for
+long. The database is then switched to auto_vacuum=INCREMENTAL (a one-time
+full VACUUM) and freed pages are returned to the filesystem with
+`PRAGMA incremental_vacuum`.
+
+The fetchers call run_if_due() after every sync, which does a pass at most
+once per "interval_hours". From cron or by hand:
+
+    python maintenance.py [--dry-run] [--if-due] [--json]
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import changelog
+import rollups
+from dedup import init_tables as init_dup_tables
+from store import init_messages_table
+
+DB_FILE = 'telegram.db'
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
+MESSAGE_DIR = './messages'
+EXPORT_GLOB = 'telegram_export_*'
+BATCH = 2000
+DEFAULT_RETENTION = {
+    # days; 0 keeps forever, so only windows set in config.json delete anything
+    'messages_days': 0,
+    'transcripts_days': 0,
+    'summaries_days': 0,
+    'changelog_days': 0,
+    'exports_days': 0,
+    'interval_hours': 24,
+    'vacuum_pages': 0,  # pages returned per pass; 0 frees everything
+}
+
+
+def retention(path: str = CONFIG_FILE) -> Dict:
+    cfg = dict(DEFAULT_RETENTION)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                cfg.update(json.load(f).get('retention', {}))
+        except Exception as e:
+            logging.error(f"Ignoring unreadable retention settings in {path}: {e}")
+    return cfg
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS maintenance_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at REAL,
+        finished_at REAL,
+        report TEXT
+    )''')
+    if _has_table(conn, 'messages'):
+        # Lets each expiry batch find its rows without scanning the whole table
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (date)')
+    conn.commit()
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def _cutoff(days: Optional[float], now: float) -> Optional[datetime]:
+    return datetime.fromtimestamp(now, timezone.utc) - timedelta(days=days) if days else None
+
+def _db_date(dt: datetime) -> str:
+    # Same text form sqlite3 stores for the aware datetimes the fetchers save
+    return str(dt.replace(microsecond=0))
+
+def _detect(text: str) -> str:
+    try:
+        from langdetect import detect
+        return detect(text)
+    except Exception:
+        return 'unknown'
+
+
+# === Messages ===
+_Row = namedtuple('_Row', 'id date text type')  # the fields rollups.bucketize() reads
+
+def _row(message_id: int, date, text: Optional[str]) -> _Row:
+    dt = datetime.fromisoformat(str(date))
+    dt = dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    msg_type = ('bot_command' if text.startswith('/') else 'text') if text else 'other'  # media is not stored
+    return _Row(message_id, dt, text, msg_type)
+
+def _compact(conn: sqlite3.Connection, chat_id: int, rows: List[tuple], account: str):
+    """Count expiring rows the rollups have not seen yet, so deleting them loses no history."""
+    fresh = rollups.uncounted(conn, chat_id, [_row(message_id, date, text) for _, message_id, date, text in rows], account)
+    if fresh:
+        ids = [r.id for r in fresh]
+        rollups.add(conn, chat_id, rollups.bucketize(fresh, _detect), max(ids), min(ids), account)
+
+def expire_messages(conn: sqlite3.Connection, before: datetime, batch: int = BATCH, dry_run: bool = False) -> int:
+    """Roll up, then delete messages older than `before`, `batch` rows per transaction."""
+    if not _has_table(conn, 'messages'):
+        return 0
+    cutoff = _db_date(before)
+    if dry_run:
+        return conn.execute('SELECT COUNT(*) FROM messages WHERE date < ?', (cutoff,)).fetchone()[0]
+    rollups.init_tables(conn)
+    init_messages_table(conn)
+    clusters = _has_table(conn, 'message_clusters')
+    if clusters:
+        init_dup_tables(conn)
+    chats = conn.execute('SELECT DISTINCT chat_id, account FROM messages WHERE date < ?', (cutoff,)).fetchall()
+    removed = 0
+    for chat_id, account in chats:
+        while True:
+            # Newest first, so each batch extends the chat's counted id range downwards without gaps
+            rows = conn.execute('SELECT rowid, message_id, date, text FROM messages WHERE chat_id = ? AND account = ? '
+                                'AND date < ? ORDER BY message_id DESC LIMIT ?',
+                                (chat_id, account, cutoff, batch)).fetchall()
+            if not rows:
+                break
+            _compact(conn, chat_id, rows, account)
+            with conn:
+                if clusters:
+                    conn.executemany('DELETE FROM message_clusters WHERE chat_id = ? AND message_id = ? AND account = ?',
+                                     [(chat_id, r[1], account) for r in rows])
+                conn.executemany('DELETE FROM messages WHERE rowid = ?', [(r[0],) for r in rows])
+            removed += len(rows)
+    return removed
+
+
+# === Summaries ===
+def expire_summaries(conn: sqlite3.Connection, before: datetime, dry_run: bool = False) -> int:
+    """Drop generated summaries and reply drafts older than `before`; they are regenerated on demand."""
+    targets = []
+    if _has_table(conn, 'summaries'):
+        targets.append(('summaries', before.timestamp()))  # epoch seconds
+    if _has_table(conn, 'ai_replies'):
+        targets.append(('ai_replies', str(before)))
+    removed = 0
+    for table, cutoff in targets:
+        if dry_run:
+            removed += conn.execute(f'SELECT COUNT(*) FROM {table} WHERE created_at < ?', (cutoff,)).fetchone()[0]
+        else:
+            with conn:
+                removed += conn.execute(f'DELETE FROM {table} WHERE created_at < ?', (cutoff,)).rowcount
+    return removed
+
+
+# === Files ===
+def expire_files(pattern: str, before: datetime, dry_run: bool = False) -> Dict[str, int]:
+    """Delete files matching `pattern` last modified before `before`; returns {'files', 'bytes'}."""
+    files = bytes_ = 0
+    for path in glob.glob(pattern):
+        try:
+            st = os.stat(path)
+            if st.st_mtime >= before.timestamp():
+                continue
+            if not dry_run:
+                os.remove(path)
+        except OSError as e:
+            logging.error(f"Could not remove {path}: {e}")
+            continue
+        files += 1
+        bytes_ += st.st_size
+    return {'files': files, 'bytes': bytes_}
+
+
+# === Vacuum ===
+def vacuum(conn: sqlite3.Connection, pages: int = 0) -> Dict[str, int]:
+    """Return free pages to the filesystem and truncate the WAL.
+
+    The first call on a database created without auto_vacuum converts it
+    with one full VACUUM; later calls only run the incremental pass.
+    """
+    conn.commit()
+    converted = conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2
+    if converted:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # executescript steps the pragma to completion; execute() would free a single page
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});' if pages else 'PRAGMA incremental_vacuum;')
+    freed = free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    conn.execute('PRAGMA optimize')
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return {'converted': int(converted), 'pages_freed': freed, 'bytes_freed': freed * page_size}
+
+
+# === Passes ===
+def run(conn: sqlite3.Connection, cfg: Optional[Dict] = None, now: Optional[float] = None,
+        dry_run: bool = False) -> Dict:
+    """One full maintenance pass; returns what was (or, with dry_run, would be) removed."""
+    cfg = cfg or retention()
+    now = now or time.time()
+    started = time.time()
+    init_tables(conn)
+    report: Dict = {'dry_run': dry_run}
+
+    before = _cutoff(cfg.get('messages_days'), now)
+    report['messages'] = expire_messages(conn, before, dry_run=dry_run) if before else 0
+    before = _cutoff(cfg.get('summaries_days'), now)
+    report['summaries'] = expire_summaries(conn, before, dry_run) if before else 0
+    before = _cutoff(cfg.get('changelog_days'), now)
+    report['changelog'] = changelog.expire(conn, before.timestamp(), dry_run) if before and _has_table(conn, 'changelog') else 0
+    before = _cutoff(cfg.get('transcripts_days'), now)
+    report['transcripts'] = expire_files(os.path.join(MESSAGE_DIR, '*.txt'), before, dry_run) if before else {}
+    before = _cutoff(cfg.get('exports_days'), now)
+    report['exports'] = expire_files(EXPORT_GLOB, before, dry_run) if before else {}
+    if not dry_run:
+        report['rollups_downsampled'] = rollups.downsample(conn, now=now)
+        report['vacuum'] = vacuum(conn, cfg.get('vacuum_pages') or 0)
+        with conn:
+            conn.execute('INSERT INTO maintenance_runs (started_at, finished_at, report) VALUES (?, ?, ?)',
+                         (started, time.time(), json.dumps(report)))
+    return report
+
+def last_run(conn: sqlite3.Connection) -> Optional[float]:
+    init_tables(conn)
+    return conn.execute('SELECT MAX(finished_at) FROM maintenance_runs').fetchone()[0]
+
+def run_if_due(conn: sqlite3.Connection, cfg: Optional[Dict] = None, now: Optional[float] = None) -> Optional[Dict]:
+    """run() unless a pass finished within the last interval_hours; never raises."""
+    cfg = cfg or retention()
+    now = now or time.time()
+    try:
+        last = last_run(conn)
+        if last and now - last < float(cfg.get('interval_hours') or 0) * 3600:
+            return None
+        report = run(conn, cfg, now)
+        logging.info(f"Maintenance: {report}")
+        return report
+    except Exception as e:
+        logging.error(f"Maintenance pass failed: {e}")
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Apply retention and vacuum telegram.db")
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--dry-run', action='store_true', help="report what would be removed, change nothing")
+    parser.add_argument('--if-due', action='store_true', help="skip unless interval_hours have passed (for cron)")
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No data yet ({args.db} not found)")
+        return 0
+    with sqlite3.connect(args.db, timeout=30) as conn:
+        report = run_if_due(conn) if args.if_due else run(conn, dry_run=args.dry_run)
+    if report is None:
+        print("Maintenance not due yet")
+    elif args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>20}: {value}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Mention- and reply-focused fetching for large, noisy groups.
+
+Instead of reading the last N messages of a dialog, ask Telegram only for
+the messages that mention us (replies to our messages count as mentions
+server-side) and pull a small window of surrounding messages plus the
+replied-to message for context. Dialogs whose unread-mentions counter is
+zero cost no history request at all.
+
+Every fetcher reads the mode from TG_FETCH_MODE (standalone.py: "fetch_mode"
+in config.json) and keeps its own default. 'mentions' is opt-in everywhere:
+
+    unread      the dialog's unread messages (tg.py's default)
+    recent      the last RECENT_LIMIT messages, read or not (the default of
+                tellegram_summartizer.py and standalone.py)
+    mentions    fetch_mention_messages() below
+"""
+
+from typing import List, Set
+
+FETCH_MODES = ('unread', 'recent', 'mentions')
+RECENT_LIMIT = 100
+MENTION_CONTEXT = 2   # messages fetched on each side of a mention
+MENTION_LIMIT = 50    # cap on mentions read per dialog
+
+
+def history_limit(mode: str, dialog) -> int:
+    """How many of the newest messages an 'unread' or 'recent' fetch reads from `dialog`."""
+    return RECENT_LIMIT if mode == 'recent' else dialog.unread_count or 0
+
+
+async def fetch_mention_messages(client, dialog, context: int = MENTION_CONTEXT,
+                                 limit: int = MENTION_LIMIT) -> List:
+    """Return mentions/replies in `dialog` plus their context, newest first.
+
+    Private chats are addressed to us in full, so their unread messages are
+    returned as in the normal unread fetch.
+    """
+    from telethon.tl.types import InputMessagesFilterMyMentions
+
+    if not (dialog.is_group or dialog.is_channel):
+        return [m async for m in client.iter_messages(dialog.id, limit=dialog.unread_count or 0)]
+
+    wanted = min(dialog.unread_mentions_count or 0, limit)
+    if wanted == 0:
+        return []
+
+    hits = [m async for m in client.iter_messages(dialog.id, limit=wanted,
+                                                  filter=InputMessagesFilterMyMentions)]
+    ids: Set[int] = set()
+    for m in hits:
+        ids.update(range(max(1, m.id - context), m.id + context + 1))
+        if m.reply_to_msg_id:
+            ids.add(m.reply_to_msg_id)
+    ids -= {m.id for m in hits}
+
+    extra = await client.get_messages(dialog.id, ids=sorted(ids)) if ids else []
+    messages = {m.id: m for m in hits}
+    messages.update((m.id, m) for m in extra if m is not None)
+    return sorted(messages.values(), key=lambda m: m.id, reverse=True)
@@ -0,0 +1,118 @@
+"""
+Sync several Telegram accounts in parallel, one worker process per account.
+
+Each worker imports tg.py on its own, opens its own session file and runs
+fetch_data() in its own event loop, so a slow or flood-limited account does
+not hold up the others. All workers write to the shared telegram.db (WAL
+mode, rows tagged with `account`), and the coordinator merges their results
+into a single CSV with an "Account" column.
+
+Workers cannot prompt for a login code, so sessions must already be
+authorised. `--login` signs every account in interactively, one after the
+other, and keeps the session files for later syncs. (tg.py cannot do it:
+it deletes its session file when it exits.)
+
+Usage:
+    python multi_sync.py [accounts.json] [--login]
+
+accounts.json:
+    [{"name": "alice", "session": "tg_alice"},
+     {"name": "bob", "session": "tg_bob", "api_id": 123, "api_hash": "..."}]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+ACCOUNTS_FILE = 'accounts.json'
+
+
+def load_accounts(path: str = ACCOUNTS_FILE) -> List[Dict]:
+    with open(path) as f:
+        accounts = json.load(f)
+    for acc in accounts:
+        acc.setdefault('session', acc['name'])
+    return accounts
+
+def _credentials(account: Dict) -> Tuple[int, str]:
+    import tg
+    return int(account.get('api_id') or tg.API_ID), account.get('api_hash') or tg.API_HASH
+
+def login(accounts: List[Dict]):
+    """Authorise each account's session file interactively (phone, code, 2FA) in this process."""
+    from telethon import TelegramClient
+
+    async def _login(account: Dict):
+        client = TelegramClient(account['session'], *_credentials(account))
+        print(f"Logging in {account['name']} (session {account['session']})")
+        await client.start()
+        await client.disconnect()
+
+    for account in accounts:
+        asyncio.run(_login(account))
+
+def _sync_account(account: Dict) -> Tuple[str, int, int, List[Dict], float]:
+    """Worker entry point: run one account's full fetch in this process."""
+    import tg  # imported here so every worker builds its own clients
+
+    start = time.monotonic()
+    api_id, api_hash = _credentials(account)
+    private_unread, group_unread, log = asyncio.run(tg.fetch_data(
+        session_name=account['session'],
+        account=account['name'],
+        api_id=api_id,
+        api_hash=api_hash,
+    ))
+    for row in log:
+        row['Account'] = account['name']
+    return account['name'], private_unread, group_unread, log, time.monotonic() - start
+
+def sync_accounts(accounts: List[Dict], max_workers: Optional[int] = None) -> Tuple[Dict[str, Tuple[int, int]], List[Dict]]:
+    """Fetch all accounts concurrently; returns ({account: (private, group)}, merged log)."""
+    totals: Dict[str, Tuple[int, int]] = {}
+    merged: List[Dict] = []
+    if not accounts:
+        return totals, merged
+    # spawn, not fork: Telethon/asyncio state must not leak into the workers
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers or len(accounts), mp_context=ctx) as pool:
+        futures = {pool.submit(_sync_account, acc): acc['name'] for acc in accounts}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                name, private_unread, group_unread, log, elapsed = future.result()
+            except Exception as e:
+                logging.error(f"Sync failed for account {name}: {e}")
+                continue
+            logging.info(f"Account {name}: {len(log)} chats in {elapsed:.1f}s")
+            totals[name] = (private_unread, group_unread)
+            merged.extend(log)
+    return totals, merged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sync several Telegram accounts in parallel')
+    parser.add_argument('accounts', nargs='?', default=ACCOUNTS_FILE, help='accounts file (default: %(default)s)')
+    parser.add_argument('--login', action='store_true', help='authorise every session interactively, then exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    accounts = load_accounts(args.accounts)
+    if not accounts:
+        raise SystemExit(f"No accounts in {args.accounts}")
+    if args.login:
+        login(accounts)
+        raise SystemExit(0)
+    start = time.monotonic()
+    totals, log = sync_accounts(accounts)
+
+    import tg
+    tg.export_to_csv(log, tg.CSV_FILE)
+    print(f"Exported {len(log)} chats from {len(totals)}/{len(accounts)} accounts to {tg.CSV_FILE} "
+          f"in {time.monotonic() - start:.1f}s")
+    for name, (private_unread, group_unread) in sorted(totals.items()):
+        print(f"  {name}: private unread {private_unread}, group unread {group_unread}")
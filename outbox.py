@@ -0,0 +1,304 @@
+"""
+Persistent outbound reply queue in telegram.db.
+
+The dashboards only enqueue: each approved reply becomes a row in `outbox`
+keyed by an idempotency key over (chat_id, the message it answers, reply
+text), so clicking "Use Reply" twice, or a Streamlit rerun replaying the
+callback, never queues a second copy. The same text can still be sent to
+the chat again as the answer to a later message. A sender worker
+(`python outbox.py`) drains the queue of one account through its Telethon
+client, spacing sends by a global and a per-chat minimum interval,
+re-queueing on FloodWait and writing the delivery status back to the row
+and to `chats.reply_status`.
+
+A 'failed' row goes back to 'queued' when it is enqueued again. A row left
+in 'sending' by a crashed worker may or may not have reached Telegram, so
+it is marked 'unknown' on the next start instead of being resent; only an
+explicit enqueue() of that reply (the "Use Reply" button) re-queues it.
+
+Usage:
+    python outbox.py [--once] [--account NAME [--accounts accounts.json]]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import changelog
+from store import ensure_columns
+
+DB_FILE = 'telegram.db'
+DB_TIMEOUT = 30
+GLOBAL_INTERVAL = float(os.getenv('TG_SEND_INTERVAL', '1.0'))          # seconds between any two sends
+CHAT_INTERVAL = float(os.getenv('TG_SEND_CHAT_INTERVAL', '3.0'))       # keeps a group under 20 msgs/min
+MAX_ATTEMPTS = 5
+BASE_WAIT = 5
+BATCH = 100
+POLL_SECONDS = 5
+NOT_REPLIES = ('Error:', 'Skipped:')  # prefixes of fetcher placeholders
+
+
+def sendable(text) -> bool:
+    """False for empty text and the placeholders the fetchers write instead of a reply."""
+    if not isinstance(text, str) or not text.strip():
+        return False
+    return text.strip() != 'N/A' and not text.startswith(NOT_REPLIES)
+
+def reply_key(chat_id: int, message_id: Optional[int], text: str) -> str:
+    """Idempotency key for sending `text` to `chat_id` in answer to `message_id`."""
+    answers = '' if message_id is None else int(message_id)
+    return hashlib.sha256(f"{int(chat_id)}\n{answers}\n{text.strip()}".encode('utf-8')).hexdigest()[:32]
+
+def _has_chats(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chats'").fetchone() is not None
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idem_key TEXT UNIQUE,
+        chat_id INTEGER,
+        text TEXT,
+        account TEXT,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        not_before REAL DEFAULT 0,
+        created_at DATETIME,
+        sent_at DATETIME,
+        sent_message_id INTEGER,
+        error TEXT
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id)')
+    conn.commit()
+    ensure_columns(conn, 'outbox', {'message_id': 'INTEGER'})
+    if _has_chats(conn):
+        ensure_columns(conn, 'chats', {'reply_status': 'TEXT', 'reply_sent_at': 'DATETIME'})
+        changelog.init_tables(conn)
+
+def _insert_sql(requeue: Sequence[str]) -> str:
+    # A new key is queued; an existing one only goes back to 'queued' from one of `requeue`
+    return ('INSERT INTO outbox (idem_key, chat_id, message_id, text, account, status, created_at) '
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?) ON CONFLICT (idem_key) DO UPDATE SET "
+            "status = 'queued', attempts = 0, not_before = 0, error = NULL "
+            f"WHERE outbox.status IN ({', '.join(repr(s) for s in requeue)})")
+
+def _row(chat_id: int, message_id: Optional[int], text: str, account: Optional[str], now) -> Tuple:
+    message_id = None if message_id is None else int(message_id)
+    return (reply_key(chat_id, message_id, text), int(chat_id), message_id, text.strip(), account or None, now)
+
+def enqueue(conn: sqlite3.Connection, chat_id: int, text: str, account: str = None,
+            message_id: Optional[int] = None) -> Tuple[int, str, bool]:
+    """Queue a reply to `message_id`; returns (outbox_id, status, newly_queued).
+
+    Re-enqueueing the same reply returns the existing row untouched, unless it
+    ended 'failed' or 'unknown', which queues it again. Raises ValueError for
+    text that is not a reply (see sendable()).
+    """
+    if not sendable(text):
+        raise ValueError(f"not a reply: {text!r}")
+    row = _row(chat_id, message_id, text, account, datetime.now(timezone.utc))
+    c = conn.execute(_insert_sql(('failed', 'unknown')), row)
+    queued = c.rowcount == 1
+    found = conn.execute('SELECT id, status FROM outbox WHERE idem_key = ?', (row[0],)).fetchone()
+    conn.commit()
+    return found[0], found[1], queued
+
+def enqueue_many(conn: sqlite3.Connection,
+                 replies: Iterable[Tuple[int, Optional[int], str, Optional[str]]]) -> int:
+    """Queue several (chat_id, message_id, text, account) replies in one transaction.
+
+    Returns how many were queued. 'failed' rows are queued again; 'unknown'
+    ones are left for a person to check. Placeholders and empty text are left out.
+    """
+    now = datetime.now(timezone.utc)
+    before = conn.total_changes
+    conn.executemany(_insert_sql(('failed',)),
+                     [_row(chat_id, message_id, text, account, now)
+                      for chat_id, message_id, text, account in replies if sendable(text)])
+    conn.commit()
+    return conn.total_changes - before
+
+def statuses(conn: sqlite3.Connection) -> Dict[Tuple[int, Optional[int], str], str]:
+    """Latest outbox status per reply target, {(chat_id, message_id, account or ''): status}."""
+    rows = conn.execute("SELECT chat_id, message_id, COALESCE(account, ''), status FROM outbox WHERE id IN "
+                        "(SELECT MAX(id) FROM outbox GROUP BY chat_id, message_id, COALESCE(account, ''))")
+    return {(chat_id, message_id, account): status for chat_id, message_id, account, status in rows}
+
+def counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    return dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+
+class OutboxSender:
+    """Drains one account's rows of the outbox through that account's connected Telethon client.
+
+    `account` None stands for the single-account setup (rows queued without one).
+    """
+
+    def __init__(self, client, conn: sqlite3.Connection, account: Optional[str] = None,
+                 global_interval: float = GLOBAL_INTERVAL, chat_interval: float = CHAT_INTERVAL):
+        self.client = client
+        self.conn = conn
+        self.account = account or ''
+        self.global_interval = global_interval
+        self.chat_interval = chat_interval
+        self._next_global = 0.0
+        self._next_chat: Dict[int, float] = {}
+        self._dialogs_loaded = False
+        init_tables(conn)
+        self._has_chats = _has_chats(conn)
+        self._chats_by_account = self._has_chats and 'account' in {
+            r[1] for r in conn.execute('PRAGMA table_info(chats)')}
+
+    def recover(self) -> int:
+        """Mark rows a previous worker left mid-send as 'unknown' rather than resending them."""
+        c = self.conn.execute(
+            "UPDATE outbox SET status = 'unknown', error = 'interrupted mid-send; check the chat before re-queueing' "
+            "WHERE status = 'sending' AND COALESCE(account, '') = ?", (self.account,))
+        self.conn.commit()
+        return c.rowcount
+
+    def _pending(self) -> List[Tuple[int, int, str, int, float]]:
+        return self.conn.execute(
+            "SELECT id, chat_id, text, attempts, not_before FROM outbox "
+            "WHERE status = 'queued' AND COALESCE(account, '') = ? ORDER BY id LIMIT ?",
+            (self.account, BATCH)).fetchall()
+
+    def _next_due(self, pending) -> Tuple[float, Tuple]:
+        # Earliest row allowed by its own backoff, its chat's spacing and the global spacing
+        ready = [(max(row[4], self._next_chat.get(row[1], 0.0), self._next_global), row) for row in pending]
+        return min(ready, key=lambda r: (r[0], r[1][0]))
+
+    async def drain(self) -> Dict[str, int]:
+        """Send everything queued, sleeping out rate limits and flood waits; returns counts by outcome."""
+        done: Dict[str, int] = {}
+        while True:
+            pending = self._pending()
+            if not pending:
+                return done
+            ready_at, row = self._next_due(pending)
+            delay = ready_at - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            outcome = await self._send(*row[:4])
+            done[outcome] = done.get(outcome, 0) + 1
+
+    async def run(self, poll: float = POLL_SECONDS):
+        """Worker loop: drain, then poll for newly queued replies."""
+        self.recover()
+        while True:
+            done = await self.drain()
+            if done:
+                logging.info(f"Outbox drained: {done}")
+            await asyncio.sleep(poll)
+
+    async def _send(self, outbox_id: int, chat_id: int, text: str, attempts: int) -> str:
+        from telethon.errors import FloodWaitError, RPCError
+
+        # Claim the row; another worker may already have it
+        if self.conn.execute("UPDATE outbox SET status = 'sending' WHERE id = ? AND status = 'queued'",
+                             (outbox_id,)).rowcount != 1:
+            self.conn.commit()
+            return 'skipped'
+        self.conn.commit()
+
+        now = time.time()
+        self._next_global = now + self.global_interval
+        self._next_chat[chat_id] = now + self.chat_interval
+        try:
+            msg = await self.client.send_message(await self._entity(chat_id), text)
+        except FloodWaitError as e:
+            # Flood waits apply to the whole account, so pause every chat
+            logging.info(f"Flood wait for {e.seconds}s sending to {chat_id}")
+            self._next_global = time.time() + e.seconds
+            return self._retry(outbox_id, chat_id, attempts, e.seconds, f"flood wait {e.seconds}s")
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            return self._retry(outbox_id, chat_id, attempts, BASE_WAIT * (2 ** attempts), str(e))
+        except (RPCError, ValueError) as e:
+            # Permanent: no write rights, unknown peer, banned, ...
+            logging.error(f"Reply to {chat_id} failed: {e}")
+            self._finish(outbox_id, chat_id, 'failed', error=str(e))
+            return 'failed'
+        self._finish(outbox_id, chat_id, 'sent', message_id=msg.id)
+        return 'sent'
+
+    async def _entity(self, chat_id: int):
+        try:
+            return await self.client.get_input_entity(chat_id)
+        except ValueError:
+            # Not in this session's entity cache yet; loading the dialogs fills it once
+            if self._dialogs_loaded:
+                raise
+            self._dialogs_loaded = True
+            await self.client.get_dialogs()
+            return await self.client.get_input_entity(chat_id)
+
+    def _retry(self, outbox_id: int, chat_id: int, attempts: int, wait: float, error: str) -> str:
+        attempts += 1
+        if attempts >= MAX_ATTEMPTS:
+            self._finish(outbox_id, chat_id, 'failed', error=error, attempts=attempts)
+            return 'failed'
+        self.conn.execute("UPDATE outbox SET status = 'queued', attempts = ?, not_before = ?, error = ? WHERE id = ?",
+                          (attempts, time.time() + wait, error, outbox_id))
+        self.conn.commit()
+        return 'retried'
+
+    def _finish(self, outbox_id: int, chat_id: int, status: str, message_id: Optional[int] = None,
+                error: Optional[str] = None, attempts: Optional[int] = None):
+        sent_at = datetime.now(timezone.utc) if status == 'sent' else None
+        self.conn.execute(
+            'UPDATE outbox SET status = ?, sent_at = ?, sent_message_id = ?, error = ?, '
+            'attempts = COALESCE(?, attempts + 1) WHERE id = ?',
+            (status, sent_at, message_id, error, attempts, outbox_id))
+        if self._chats_by_account:
+            self.conn.execute("UPDATE chats SET reply_status = ?, reply_sent_at = ? "
+                              "WHERE chat_id = ? AND COALESCE(account, '') = ?",
+                              (status, sent_at, chat_id, self.account))
+        elif self._has_chats:
+            self.conn.execute('UPDATE chats SET reply_status = ?, reply_sent_at = ? WHERE chat_id = ?',
+                              (status, sent_at, chat_id))
+        self.conn.commit()
+
+
+async def main(once: bool = False, account: Optional[str] = None, accounts_file: Optional[str] = None):
+    from telethon import TelegramClient
+    import tg
+
+    session, api_id, api_hash = tg.SESSION_NAME, tg.API_ID, tg.API_HASH
+    if account:
+        # Same entries as multi_sync.py, so a reply leaves from the account that saw the chat
+        from multi_sync import ACCOUNTS_FILE, load_accounts
+        entry = next((a for a in load_accounts(accounts_file or ACCOUNTS_FILE) if a['name'] == account), None)
+        if entry is None:
+            raise RuntimeError(f"Account {account!r} is not in {accounts_file or ACCOUNTS_FILE}")
+        session = entry['session']
+        api_id, api_hash = int(entry.get('api_id') or api_id), entry.get('api_hash') or api_hash
+    if not (api_id and api_hash and session):
+        raise RuntimeError("Set TG_API_ID, TG_API_HASH and TG_SESSION_NAME before sending")
+    tg.init_db()
+    client = TelegramClient(session, api_id, api_hash)
+    await client.start(phone=tg.PHONE)
+    try:
+        with sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT) as conn:
+            sender = OutboxSender(client, conn, account)
+            if once:
+                sender.recover()
+                print(f"Outbox: {await sender.drain()} · remaining {counts(conn)}")
+            else:
+                await sender.run()
+    finally:
+        await client.disconnect()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Send queued replies from telegram.db")
+    parser.add_argument('--once', action='store_true', help="drain the queue and exit instead of polling")
+    parser.add_argument('--account', help="send this multi_sync account's replies, with its session")
+    parser.add_argument('--accounts', help="accounts file for --account (default accounts.json)")
+    args = parser.parse_args()
+    asyncio.run(main(args.once, args.account, args.accounts))
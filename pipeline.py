@@ -0,0 +1,142 @@
+"""
+Staged asyncio pipeline for a sync.
+
+A sync used to run fetch -> analyze -> LLM -> write for one dialog at a time
+(tellegram_summartizer.py, standalone.py) or for every dialog at once
+(tg.py). Pipeline runs it as a chain of stages instead: each stage has its
+own worker count and reads from a bounded queue filled by the stage before
+it. While one dialog waits for the LLM, the next ones are already being
+fetched and analysed. A stage that falls behind fills its input queue, and
+the stage upstream then waits on put(), so a slow LLM never lets fetched
+histories pile up in memory. Throughput ends up bounded by the slowest
+stage rather than by the sum of every stage's latency.
+
+Worker counts and the queue size live under "pipeline" in config.json, e.g.
+    {"pipeline": {"fetch": 4, "analyze": 2, "summarize": 4, "persist": 1, "queue_size": 8}}
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
+DEFAULT_WORKERS = {'fetch': 4, 'analyze': 2, 'summarize': 4, 'persist': 1}
+QUEUE_SIZE = 8
+
+_DONE = object()
+
+
+def pipeline_config(path: str = CONFIG_FILE) -> Dict[str, int]:
+    """Worker count per stage plus 'queue_size', with config.json overrides."""
+    cfg = {**DEFAULT_WORKERS, 'queue_size': QUEUE_SIZE}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                cfg.update({k: int(v) for k, v in json.load(f).get('pipeline', {}).items()})
+        except Exception as e:
+            logging.error(f"Ignoring unreadable pipeline settings in {path}: {e}")
+    return cfg
+
+
+class Stage:
+    """One step of the pipeline: `fn(item)` awaited by `workers` concurrent workers.
+
+    fn returns the item for the next stage; returning None drops it. An
+    exception is logged and drops only that item.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Awaitable[Any]], workers: int = 1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0       # summed seconds inside fn, across workers
+        self.max_queue = 0    # deepest the input queue got
+
+    def stats(self) -> Dict:
+        return {'workers': self.workers, 'processed': self.processed, 'failed': self.failed,
+                'busy_s': round(self.busy, 2), 'max_queue': self.max_queue}
+
+
+class Pipeline:
+    """Stages connected by bounded queues; run() feeds items through all of them."""
+
+    def __init__(self, stages: Sequence[Stage], queue_size: int = QUEUE_SIZE):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.elapsed = 0.0
+
+    @classmethod
+    def from_config(cls, stages: Dict[str, Callable], path: str = CONFIG_FILE) -> 'Pipeline':
+        """Stages in the given order, each sized by the "pipeline" worker count of the same name."""
+        cfg = pipeline_config(path)
+        return cls([Stage(name, fn, cfg.get(name, 1)) for name, fn in stages.items()], cfg['queue_size'])
+
+    async def run(self, items: Iterable) -> List:
+        """Push every item through the stages; returns what the last stage produced, in input order."""
+        queues = [asyncio.Queue(self.queue_size) for _ in self.stages]
+        results: Dict[int, Any] = {}
+        start = time.perf_counter()
+
+        async def feed():
+            for seq, item in enumerate(items):
+                await queues[0].put((seq, item))
+            for _ in range(self.stages[0].workers):
+                await queues[0].put(_DONE)
+
+        async def work(i: int, stage: Stage, remaining: List[int]):
+            inbox = queues[i]
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            while True:
+                stage.max_queue = max(stage.max_queue, inbox.qsize())
+                entry = await inbox.get()
+                if entry is _DONE:
+                    break
+                seq, item = entry
+                t = time.perf_counter()
+                try:
+                    out = await stage.fn(item)
+                except Exception as e:
+                    stage.failed += 1
+                    logging.error(f"Pipeline stage {stage.name} failed: {e}")
+                    continue
+                finally:
+                    stage.busy += time.perf_counter() - t
+                stage.processed += 1
+                if out is None:
+                    continue
+                if outbox is None:
+                    results[seq] = out
+                else:
+                    await outbox.put((seq, out))  # blocks while the next stage is behind
+            # The last worker of a stage out closes the next one
+            remaining[0] -= 1
+            if remaining[0] == 0 and outbox is not None:
+                for _ in range(self.stages[i + 1].workers):
+                    await outbox.put(_DONE)
+
+        tasks = [asyncio.create_task(feed())]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            tasks += [asyncio.create_task(work(i, stage, remaining)) for _ in range(stage.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.elapsed = time.perf_counter() - start
+        return [results[seq] for seq in sorted(results)]
+
+    def bottleneck(self) -> Optional[str]:
+        """The stage whose workers were busiest relative to their number."""
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda s: s.busy / s.workers).name
+
+    def stats(self) -> Dict:
+        return {'elapsed_s': round(self.elapsed, 2), 'bottleneck': self.bottleneck(),
+                **{s.name: s.stats() for s in self.stages}}
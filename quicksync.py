@@ -0,0 +1,159 @@
+"""
+Quick sync: refresh unread counts from dialog metadata alone.
+
+A full sync fetches history, detects languages and calls the LLM for every
+chat, which takes minutes. Often all that is wanted is "what's unread right
+now". quick_sync() uses nothing but the get_dialogs() listing (one request
+per 100 dialogs). From it, it updates each chat row in telegram.db:
+
+    unread_count, unread_mentions    Telegram's own counters
+    top_message_id, top_message_date the newest message in the chat
+    is_group, is_channel, name       in case the chat changed
+    needs_deep_sync                  the newest message is not in `messages` yet
+
+Chats seen for the first time get a bare row flagged for a deep sync.
+Existing rows are updated in place, so urgency, follow-up and reply state
+from the last full sync are kept. The "Unread Count" column of the
+dashboard CSV is patched too, so the dashboard metrics refresh. cli.py
+metrics reads the new columns directly.
+
+A full sync upserts only the columns it computes (store.save_chat), so
+these counters survive it. It clears needs_deep_sync explicitly for every
+chat it processes. pending() lists the flagged chats, busiest first.
+
+Usage:
+    python quicksync.py [--json] [--no-csv] [--pending]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence
+
+from store import account_key, ensure_columns, init_chats_table
+
+COLUMNS = {
+    'unread_count': 'INTEGER',
+    'unread_mentions': 'INTEGER',
+    'is_channel': 'BOOLEAN',
+    'top_message_id': 'INTEGER',
+    'top_message_date': 'DATETIME',
+    'needs_deep_sync': 'BOOLEAN',
+    'quick_synced_at': 'REAL',
+}
+
+
+def init_tables(conn: sqlite3.Connection):
+    init_chats_table(conn)
+    ensure_columns(conn, 'chats', COLUMNS)
+
+def _top_message_id(dialog) -> Optional[int]:
+    top = getattr(getattr(dialog, 'dialog', None), 'top_message', None)
+    if top is None and getattr(dialog, 'message', None) is not None:
+        top = dialog.message.id
+    return top
+
+def quick_sync(conn: sqlite3.Connection, dialogs: Sequence, account: Optional[str] = None,
+               now: Optional[float] = None) -> Dict:
+    """Write dialog metadata into `account`'s rows of `chats`; returns counts for the run."""
+    init_tables(conn)
+    now = now or time.time()
+    account = account_key(account)
+    has_messages = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()
+    known = {r[0] for r in conn.execute('SELECT chat_id FROM chats WHERE account = ?', (account,))}
+    rows, new = [], []
+    totals = {'dialogs': len(dialogs), 'new_chats': 0, 'needs_deep_sync': 0,
+              'private_unread': 0, 'group_unread': 0, 'unread_mentions': 0}
+    for d in dialogs:
+        is_group = bool(d.is_group or d.is_channel)
+        unread = d.unread_count or 0
+        top_id = _top_message_id(d)
+        # PK lookup per chat: cheap even with months of stored history
+        stored = conn.execute('SELECT MAX(message_id) FROM messages WHERE chat_id = ? AND account = ?',
+                              (d.id, account)).fetchone()[0] if has_messages else None
+        stale = top_id is not None and (stored is None or top_id > stored)
+        row = (d.name or "Unknown", is_group, bool(d.is_channel and not d.is_group), unread,
+               d.unread_mentions_count or 0, top_id, d.date, stale, now, account, d.id)
+        (rows if d.id in known else new).append(row)
+        totals['group_unread' if is_group else 'private_unread'] += unread
+        totals['unread_mentions'] += d.unread_mentions_count or 0
+        totals['needs_deep_sync'] += stale
+    with conn:
+        conn.executemany('UPDATE chats SET name = ?, is_group = ?, is_channel = ?, unread_count = ?, '
+                         'unread_mentions = ?, top_message_id = ?, top_message_date = ?, needs_deep_sync = ?, '
+                         'quick_synced_at = ? WHERE account = ? AND chat_id = ?', rows)
+        conn.executemany('INSERT INTO chats (name, is_group, is_channel, unread_count, unread_mentions, '
+                         'top_message_id, top_message_date, needs_deep_sync, quick_synced_at, account, chat_id) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', new)
+    totals['new_chats'] = len(new)
+    return totals
+
+def pending(conn: sqlite3.Connection) -> List[int]:
+    """Chats flagged by the last quick sync as having messages a full sync has not fetched."""
+    init_tables(conn)
+    return [r[0] for r in conn.execute('SELECT chat_id FROM chats WHERE needs_deep_sync '
+                                       'ORDER BY unread_count DESC, top_message_date DESC')]
+
+def update_csv(path: str, dialogs: Sequence) -> int:
+    """Patch 'Unread Count' in a dashboard CSV; returns rows changed. New chats wait for a full sync."""
+    if not os.path.exists(path):
+        return 0
+    import pandas as pd
+    df = pd.read_csv(path)
+    if 'Chat ID' not in df.columns or 'Unread Count' not in df.columns:
+        return 0
+    unread = {d.id: d.unread_count or 0 for d in dialogs}
+    fresh = df['Chat ID'].map(unread)
+    changed = fresh.notna() & (fresh != df['Unread Count'])
+    if changed.any():
+        df.loc[changed, 'Unread Count'] = fresh[changed].astype(int)
+        df.to_csv(path, index=False)
+    return int(changed.sum())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Refresh unread counts from dialog metadata only')
+    parser.add_argument('--json', action='store_true', help='machine-readable output')
+    parser.add_argument('--no-csv', action='store_true', help="don't patch the dashboard CSV")
+    parser.add_argument('--pending', action='store_true', help='only list chats flagged for a full sync')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    import asyncio
+    import tg
+    from cli import metrics
+
+    if args.pending:
+        tg.init_db()
+        with sqlite3.connect(tg.DB_FILE) as conn:
+            print(json.dumps(pending(conn)) if args.json else '\n'.join(map(str, pending(conn))))
+        raise SystemExit(0)
+
+    async def main() -> Dict:
+        from telethon import TelegramClient
+        from dialog_policy import select_dialogs
+
+        start = time.monotonic()
+        client = TelegramClient(tg.SESSION_NAME, tg.API_ID, tg.API_HASH)
+        await client.start()
+        try:
+            dialogs = await select_dialogs(client, await client.get_dialogs())
+        finally:
+            await client.disconnect()
+        tg.init_db()
+        with sqlite3.connect(tg.DB_FILE, timeout=tg.DB_TIMEOUT) as conn:
+            result = quick_sync(conn, dialogs)
+        result['csv_rows_updated'] = 0 if args.no_csv else update_csv(tg.CSV_FILE, dialogs)
+        result['elapsed_s'] = round(time.monotonic() - start, 2)
+        result['metrics'] = metrics(tg.DB_FILE)
+        return result
+
+    result = asyncio.run(main())
+    if args.json:
+        print(json.dumps(result, indent=2, default=str))
+    else:
+        for key, value in result.items():
+            print(f"{key:>18}: {value}")
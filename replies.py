@@ -0,0 +1,89 @@
+"""
+Persisted AI reply suggestions, generated on demand.
+
+A sync no longer asks the LLM for a reply to every dialog. tg.py generates
+one eagerly only for chats that pass ReplyPolicy (private chats, or groups
+above an urgency threshold; never broadcast channels). Every other chat
+gets its reply when it is opened in the dashboard's "AI Suggestions" view.
+Opening one streams the draft into the page (see streaming.py). Either
+way the text is stored in `ai_replies`, keyed by the chat's newest
+message id. It is reused until a newer message arrives, so re-syncing a quiet
+chat costs no LLM call.
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import changelog
+from store import account_key, create_keyed_table
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
+DEFAULT_MIN_URGENCY = 50
+
+
+class ReplyPolicy:
+    """Which chats get a reply generated during the sync itself."""
+
+    def __init__(self, min_urgency: int = DEFAULT_MIN_URGENCY, private: bool = True):
+        self.min_urgency = min_urgency   # groups at or above this urgency score
+        self.private = private           # every private chat, regardless of urgency
+
+    @classmethod
+    def from_config(cls, path: str = CONFIG_FILE) -> 'ReplyPolicy':
+        cfg = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    cfg = json.load(f)
+            except Exception:
+                pass
+        return cls(min_urgency=int(cfg.get('reply_min_urgency', DEFAULT_MIN_URGENCY)),
+                   private=bool(cfg.get('reply_private', True)))
+
+    def eager(self, urgency: int, is_group: bool, is_broadcast: bool = False) -> bool:
+        if is_broadcast:
+            return False
+        if not is_group:
+            return self.private
+        return urgency >= self.min_urgency
+
+
+def init_tables(conn: sqlite3.Connection):
+    create_keyed_table(conn, 'ai_replies', '''CREATE TABLE IF NOT EXISTS {name} (
+        chat_id INTEGER,
+        account TEXT NOT NULL DEFAULT '',
+        message_id INTEGER,
+        reply TEXT,
+        created_at DATETIME,
+        PRIMARY KEY (chat_id, account)
+    )''')
+    changelog.init_tables(conn)
+
+def cached_reply(conn: sqlite3.Connection, chat_id: int, message_id: int, account: Optional[str] = None) -> Optional[str]:
+    """The stored reply for this chat, if it was generated for the same newest message."""
+    row = conn.execute('SELECT reply FROM ai_replies WHERE chat_id = ? AND account = ? AND message_id = ?',
+                       (chat_id, account_key(account), message_id)).fetchone()
+    return row[0] if row else None
+
+def save_reply(conn: sqlite3.Connection, chat_id: int, message_id: int, reply: str, account: Optional[str] = None):
+    # Errors are not cached, so the next open retries
+    if reply.startswith('Error'):
+        return
+    conn.execute('INSERT OR REPLACE INTO ai_replies (chat_id, account, message_id, reply, created_at) VALUES (?, ?, ?, ?, ?)',
+                 (chat_id, account_key(account), message_id, reply, datetime.now(timezone.utc)))
+    conn.commit()
+
+def stored_replies(conn: sqlite3.Connection) -> Dict[Tuple[int, str], Tuple[int, str]]:
+    """{(chat_id, account): (message_id, reply)} for every persisted reply."""
+    return {(chat_id, account): (message_id, reply) for chat_id, account, message_id, reply
+            in conn.execute('SELECT chat_id, account, message_id, reply FROM ai_replies')}
+
+def stream_reply(text: str, services: List[str]):
+    """A CompletionStream drafting a reply, for st.write_stream() in the dashboard."""
+    import tg
+    from streaming import CompletionStream
+
+    return CompletionStream(tg.reply_messages(text, services), tg.MAX_TOKENS, tg._load_openai_key())
@@ -0,0 +1,149 @@
+"""
+Pre-aggregated message activity in telegram.db for the Analytics pages.
+
+Each sync adds the messages it has not counted before to `activity_hourly`,
+one row per (hour, chat, type, language). The range of message ids already
+counted is kept per chat and account, so re-fetching the same history never
+double counts. (Message ids in private chats and basic groups are per
+account; a chat that several accounts sync is counted once per account.)
+Hourly buckets older than the configured age are folded into
+`activity_daily`, so the tables stay small: months of history are a few
+thousand rows, and every chart query is a single indexed aggregate.
+
+Buckets are UTC epoch seconds. Hour-of-day charts can only use data
+that is still hourly.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from store import account_key, create_keyed_table
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
+HOUR = 3600
+DAY = 86400
+DEFAULT_HOURLY_DAYS = 30  # hourly detail is kept this long, then downsampled to days
+
+Bucket = Tuple[int, str, str]  # (bucket_start, msg_type, language)
+
+
+def hourly_days(path: str = CONFIG_FILE) -> int:
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                return int(json.load(f).get('rollup_hourly_days', DEFAULT_HOURLY_DAYS))
+        except Exception:
+            pass
+    return DEFAULT_HOURLY_DAYS
+
+def init_tables(conn: sqlite3.Connection):
+    for table in ('activity_hourly', 'activity_daily'):
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+            bucket INTEGER,
+            chat_id INTEGER,
+            msg_type TEXT,
+            language TEXT,
+            count INTEGER,
+            PRIMARY KEY (bucket, chat_id, msg_type, language)
+        )''')
+    conn.commit()
+    create_keyed_table(conn, 'rollup_watermarks', '''CREATE TABLE IF NOT EXISTS {name} (
+        chat_id INTEGER,
+        account TEXT NOT NULL DEFAULT '',
+        max_message_id INTEGER,
+        min_message_id INTEGER,
+        PRIMARY KEY (chat_id, account)
+    )''')
+
+
+# === Ingest ===
+def new_messages(conn: sqlite3.Connection, chat_id: int, messages: Sequence, account: Optional[str] = None) -> List:
+    """The messages (anything with .id) newer than what was already counted for the account's chat."""
+    row = conn.execute('SELECT max_message_id FROM rollup_watermarks WHERE chat_id = ? AND account = ?',
+                       (chat_id, account_key(account))).fetchone()
+    watermark = row[0] if row else 0
+    return [m for m in messages if m.id > watermark]
+
+def uncounted(conn: sqlite3.Connection, chat_id: int, messages: Sequence, account: Optional[str] = None) -> List:
+    """The messages outside the chat's counted id range, older ones included (used before deleting rows)."""
+    row = conn.execute('SELECT min_message_id, max_message_id FROM rollup_watermarks WHERE chat_id = ? AND account = ?',
+                       (chat_id, account_key(account))).fetchone()
+    if not row:
+        return list(messages)
+    low, high = row[0] or 0, row[1] or 0  # no recorded minimum: assume everything below was counted
+    return [m for m in messages if m.id < low or m.id > high]
+
+def bucketize(rows: Iterable, detect: Callable[[str], str]) -> Dict[Bucket, int]:
+    """Count MessageRow-like rows (.date, .text, .type) per (hour, type, language).
+
+    Pure, so it can run in the analysis pool; `detect` must be picklable there.
+    """
+    counts: Counter = Counter()
+    for r in rows:
+        hour = int(r.date.timestamp()) // HOUR * HOUR
+        counts[(hour, r.type, detect(r.text) if r.text else 'unknown')] += 1
+    return dict(counts)
+
+def add(conn: sqlite3.Connection, chat_id: int, buckets: Dict[Bucket, int], max_message_id: int,
+        min_message_id: Optional[int] = None, account: Optional[str] = None):
+    """Add counted buckets and widen the account's counted id range for the chat, in one transaction."""
+    conn.executemany(
+        'INSERT INTO activity_hourly (bucket, chat_id, msg_type, language, count) VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT (bucket, chat_id, msg_type, language) DO UPDATE SET count = count + excluded.count',
+        [(bucket, chat_id, msg_type, language, n) for (bucket, msg_type, language), n in buckets.items()])
+    low = max_message_id if min_message_id is None else min_message_id
+    conn.execute('INSERT INTO rollup_watermarks (chat_id, account, max_message_id, min_message_id) VALUES (?, ?, ?, ?) '
+                 'ON CONFLICT (chat_id, account) DO UPDATE SET max_message_id = MAX(max_message_id, excluded.max_message_id), '
+                 'min_message_id = MIN(COALESCE(min_message_id, excluded.min_message_id), excluded.min_message_id)',
+                 (chat_id, account_key(account), max_message_id, low))
+    conn.commit()
+
+def record(conn: sqlite3.Connection, chat_id: int, rows: Sequence, detect: Callable[[str], str],
+           account: Optional[str] = None) -> int:
+    """new_messages + bucketize + add in the calling thread; returns how many rows were counted."""
+    fresh = new_messages(conn, chat_id, rows, account)
+    if fresh:
+        ids = [r.id for r in fresh]
+        add(conn, chat_id, bucketize(fresh, detect), max(ids), min(ids), account)
+    return len(fresh)
+
+def downsample(conn: sqlite3.Connection, keep_days: Optional[int] = None, now: Optional[float] = None) -> int:
+    """Fold hourly buckets older than keep_days into daily ones; returns hourly rows removed."""
+    keep_days = hourly_days() if keep_days is None else keep_days
+    cutoff = int((now or time.time()) - keep_days * DAY) // DAY * DAY  # whole days only
+    with conn:
+        conn.execute(
+            'INSERT INTO activity_daily (bucket, chat_id, msg_type, language, count) '
+            'SELECT bucket / ? * ?, chat_id, msg_type, language, SUM(count) FROM activity_hourly '
+            'WHERE bucket < ? GROUP BY 1, 2, 3, 4 '
+            'ON CONFLICT (bucket, chat_id, msg_type, language) DO UPDATE SET count = count + excluded.count',
+            (DAY, DAY, cutoff))
+        removed = conn.execute('DELETE FROM activity_hourly WHERE bucket < ?', (cutoff,)).rowcount
+    return removed
+
+
+# === Queries ===
+_BOTH = ('SELECT bucket, chat_id, msg_type, language, count FROM activity_hourly WHERE bucket >= :since '
+         'UNION ALL '
+         'SELECT bucket, chat_id, msg_type, language, count FROM activity_daily WHERE bucket >= :since')
+
+def daily_volume(conn: sqlite3.Connection, since: float) -> List[Tuple[int, int]]:
+    """[(day_start, messages)] across hourly and daily buckets."""
+    return conn.execute(f'SELECT bucket / {DAY} * {DAY} AS day, SUM(count) FROM ({_BOTH}) GROUP BY day ORDER BY day',
+                        {'since': int(since)}).fetchall()
+
+def busiest_hours(conn: sqlite3.Connection, since: float) -> List[Tuple[int, int]]:
+    """[(hour_of_day_utc, messages)], from hourly buckets only."""
+    return conn.execute(f'SELECT bucket % {DAY} / {HOUR} AS hour, SUM(count) FROM activity_hourly '
+                        'WHERE bucket >= ? GROUP BY hour ORDER BY hour', (int(since),)).fetchall()
+
+def totals_by(conn: sqlite3.Connection, column: str, since: float, limit: int = 10) -> List[Tuple]:
+    """[(value, messages)] for column in chat_id / msg_type / language, largest first."""
+    if column not in ('chat_id', 'msg_type', 'language'):
+        raise ValueError(f"Cannot group activity by {column}")
+    return conn.execute(f'SELECT {column}, SUM(count) AS n FROM ({_BOTH}) GROUP BY {column} ORDER BY n DESC LIMIT :limit',
+                        {'since': int(since), 'limit': limit}).fetchall()
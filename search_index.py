@@ -0,0 +1,259 @@
+"""
+Local semantic search over stored message and summary text.
+
+Text is embedded with a hashed bag-of-words (unigrams + bigrams, signed
+feature hashing, log-tf, L2-normalised) so nothing leaves the machine.
+Vectors live in a memory-mapped float32 matrix under INDEX_DIR, next to a
+128-bit random-hyperplane code per row. Queries rank every row by Hamming
+distance on the codes (one vectorised popcount), then re-score the best
+candidates exactly against the float32 rows and collapse hits to chats.
+
+Message ids in private chats and basic groups are per Telegram account, so
+each account writes its own index (index_path) and IndexSet searches them
+together.
+"""
+
+import fcntl
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_DIR = './index'
+DIM = 256
+NBITS = 128
+SEED = 5905
+SUMMARY_MESSAGE_ID = 0  # Telegram message ids start at 1
+CANDIDATES_PER_HIT = 50
+MIN_CANDIDATES = 5000
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'the', 'to', 'we', 'with', 'you', 'our', 'us', 'this', 'that',
+}
+
+
+# === Embedding ===
+def tokenize(text: str) -> List[str]:
+    words = [w for w in _TOKEN_RE.findall((text or '').lower()) if w not in _STOPWORDS]
+    # Cheap plural folding so "audits" matches "audit"
+    words = [w[:-1] if len(w) > 3 and w.endswith('s') and not w.endswith('ss') else w for w in words]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+@lru_cache(maxsize=200_000)
+def _hash_token(token: str) -> Tuple[int, float]:
+    h = zlib.crc32(token.encode('utf-8'))
+    return h % DIM, (1.0 if h & 0x80000000 else -1.0)
+
+def embed(texts: Iterable[str]) -> np.ndarray:
+    texts = list(texts)
+    out = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts: Dict[Tuple[int, float], int] = {}
+        for tok in tokenize(text):
+            key = _hash_token(tok)
+            counts[key] = counts.get(key, 0) + 1
+        for (col, sign), n in counts.items():
+            out[row, col] += sign * (1.0 + np.log(n))
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out
+
+_PLANES = np.random.default_rng(SEED).standard_normal((DIM, NBITS)).astype(np.float32)
+_WORDS = NBITS // 64
+
+def binary_codes(vectors: np.ndarray) -> np.ndarray:
+    """Pack sign(v @ planes) into (n, NBITS // 64) uint64 words."""
+    bits = np.packbits((vectors @ _PLANES) > 0, axis=1)
+    return bits.view(np.uint64).reshape(len(vectors), _WORDS)
+
+
+# === Index ===
+def index_path(account: Optional[str] = None, root: str = INDEX_DIR) -> str:
+    """The index directory for `account`; the single-account setup ('') uses `root` itself."""
+    return os.path.join(root, re.sub(r'[^\w.-]', '_', account)) if account else root
+
+class VectorIndex:
+    """Append-only on-disk index keyed by (chat_id, message_id), one per account.
+
+    Re-adding an existing key overwrites its row in place, so summaries can be
+    refreshed without growing the files. Writers serialise on a lock file and
+    readers (dashboards) need no lock, so both may share the directory.
+    """
+
+    def __init__(self, path: str = INDEX_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._vec_file = os.path.join(path, 'vectors.f32')
+        self._code_file = os.path.join(path, 'codes.u64')
+        self._id_file = os.path.join(path, 'ids.i64')
+        self._lock_file = os.path.join(path, 'write.lock')
+        self._rows = -1
+        self._vectors = self._codes = self._ids = None
+        self._keys: Optional[Dict[Tuple[int, int], int]] = None
+
+    def __len__(self) -> int:
+        self.refresh()
+        return self._rows
+
+    def refresh(self):
+        """Re-map the files if another process appended rows since the last call."""
+        rows = os.path.getsize(self._id_file) // 16 if os.path.exists(self._id_file) else 0
+        if rows == self._rows:
+            return
+        self._map(rows)
+        self._keys = None
+
+    def _map(self, rows: int):
+        self._rows = rows
+        if rows == 0:
+            self._vectors = np.zeros((0, DIM), dtype=np.float32)
+            self._codes = np.zeros((0, _WORDS), dtype=np.uint64)
+            self._ids = np.zeros((0, 2), dtype=np.int64)
+        else:
+            self._vectors = np.memmap(self._vec_file, dtype=np.float32, mode='r', shape=(rows, DIM))
+            self._codes = np.memmap(self._code_file, dtype=np.uint64, mode='r', shape=(rows, _WORDS))
+            self._ids = np.memmap(self._id_file, dtype=np.int64, mode='r', shape=(rows, 2))
+
+    def _key_map(self) -> Dict[Tuple[int, int], int]:
+        if self._keys is None:
+            self._keys = {(int(c), int(m)): i for i, (c, m) in enumerate(self._ids)}
+        return self._keys
+
+    def add(self, items: Iterable[Tuple[int, int, str]], vectors: Optional[np.ndarray] = None) -> int:
+        """Index (chat_id, message_id, text) triples; returns rows written.
+
+        `vectors` may hold embed() of the texts, row-aligned with `items`,
+        when they were computed elsewhere (e.g. in the analysis pool).
+        """
+        items = list(items)
+        keep = [i for i, (_, _, t) in enumerate(items) if t and t.strip()]
+        if not keep:
+            return 0
+        vectors = vectors[keep] if vectors is not None else embed(items[i][2] for i in keep)
+        items = [(int(items[i][0]), int(items[i][1]), items[i][2]) for i in keep]
+        # Several sync processes may append at once; serialise writers
+        with open(self._lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            return self._add_locked(items, vectors)
+
+    def _trim(self):
+        """Cut every file back to the rows committed in ids.i64.
+
+        A writer that died between its appends leaves vector or code rows (or
+        half an id) beyond the last complete id. They must go before the next
+        append, or every later row would be paired with the wrong id.
+        """
+        for path, row_bytes in ((self._id_file, 16), (self._vec_file, DIM * 4), (self._code_file, _WORDS * 8)):
+            size = self._rows * row_bytes
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _add_locked(self, items: List[Tuple[int, int, str]], vectors: np.ndarray) -> int:
+        self.refresh()
+        self._trim()
+        keys = self._key_map()
+        codes = binary_codes(vectors)
+
+        # {row: item} and {key: item}; a key given twice keeps its last item
+        updates: Dict[int, int] = {}
+        fresh: Dict[Tuple[int, int], int] = {}
+        for i, (chat_id, message_id, _) in enumerate(items):
+            row = keys.get((chat_id, message_id))
+            if row is not None:
+                updates[row] = i
+            else:
+                fresh[(chat_id, message_id)] = i
+
+        if updates:
+            vec_rw = np.memmap(self._vec_file, dtype=np.float32, mode='r+', shape=(self._rows, DIM))
+            code_rw = np.memmap(self._code_file, dtype=np.uint64, mode='r+', shape=(self._rows, _WORDS))
+            for row, i in updates.items():
+                vec_rw[row] = vectors[i]
+                code_rw[row] = codes[i]
+            vec_rw.flush()
+            code_rw.flush()
+            del vec_rw, code_rw
+
+        if fresh:
+            idx = list(fresh.values())
+            ids = np.array(list(fresh), dtype=np.int64)
+            # ids last, as the commit marker: a reader sizes the matrix from
+            # ids.i64, and _trim() drops whatever a crash left beyond it.
+            with open(self._vec_file, 'ab') as f:
+                f.write(vectors[idx].tobytes())
+            with open(self._code_file, 'ab') as f:
+                f.write(codes[idx].tobytes())
+            with open(self._id_file, 'ab') as f:
+                f.write(ids.tobytes())
+            # Our own rows extend the key map; only another writer's rows (seen by refresh()) rebuild it
+            base = self._rows
+            self._map(base + len(idx))
+            keys.update((key, base + j) for j, key in enumerate(fresh))
+        return len(items)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float, int]]:
+        """Return up to k (chat_id, score, best_message_id) tuples, best first."""
+        self.refresh()
+        if self._rows == 0:
+            return []
+        q = embed([query])[0]
+        if not q.any():
+            return []
+        qcode = binary_codes(q[None, :])[0]
+
+        n_cand = min(self._rows, max(MIN_CANDIDATES, k * CANDIDATES_PER_HIT))
+        dist = np.bitwise_count(self._codes ^ qcode).sum(axis=1, dtype=np.uint16)
+        cand = np.argpartition(dist, n_cand - 1)[:n_cand] if n_cand < self._rows else np.arange(self._rows)
+        cand.sort()  # sequential reads from the memmap
+        scores = self._vectors[cand] @ q
+
+        ranked: List[Tuple[int, float, int]] = []
+        seen = set()
+        for j in np.argsort(-scores):
+            if scores[j] <= 0:
+                break
+            chat_id, message_id = (int(x) for x in self._ids[cand[j]])
+            if chat_id in seen:
+                continue
+            seen.add(chat_id)
+            ranked.append((chat_id, float(scores[j]), message_id))
+            if len(ranked) == k:
+                break
+        return ranked
+
+
+class IndexSet:
+    """Read side over every account's index under `root`, searched as one."""
+
+    def __init__(self, root: str = INDEX_DIR):
+        self.root = root
+        self._indexes: Dict[str, VectorIndex] = {}
+
+    def _discover(self) -> List[VectorIndex]:
+        paths = [self.root]
+        if os.path.isdir(self.root):
+            paths += sorted(d.path for d in os.scandir(self.root)
+                            if d.is_dir() and os.path.exists(os.path.join(d.path, 'ids.i64')))
+        for path in paths:
+            if path not in self._indexes:
+                self._indexes[path] = VectorIndex(path)
+        return [self._indexes[p] for p in paths]
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self._discover())
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float, int]]:
+        """VectorIndex.search across accounts; a chat several accounts share keeps its best hit."""
+        hits = sorted((hit for index in self._discover() for hit in index.search(query, k)), key=lambda h: -h[1])
+        ranked: List[Tuple[int, float, int]] = []
+        seen = set()
+        for hit in hits:
+            if hit[0] not in seen:
+                seen.add(hit[0])
+                ranked.append(hit)
+        return ranked[:k]
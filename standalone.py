@@ -3,30 +3,43 @@ Telegram Manager — Standalone
 Just enter your phone number and OTP to get started.
 """
 
+from __future__ import annotations
+
 import asyncio
 import json
 import logging
 import os
 import re
 import sqlite3
-import threading
 import time
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 
 import pandas as pd
 import pytz
 import streamlit as st
-from langdetect import detect
-from openai import AsyncOpenAI
-from telethon import TelegramClient
-from telethon.errors import (
-    FloodWaitError,
-    PhoneCodeInvalidError,
-    SessionPasswordNeededError,
-)
-from telethon.tl.custom.message import Message
-from telethon.tl.types import MessageMediaEmpty
+
+import changelog
+import maintenance
+import rollups
+from analysis import AnalysisPool, message_features, message_row
+from dedup import DuplicateDetector, collapse, only_duplicates
+from dedup import init_tables as init_dup_tables
+from dialog_policy import MODES, TYPES, DialogPolicy, select_dialogs
+from exporter import ExportJob
+from fetch_service import FetchService
+from pipeline import Pipeline
+from search_index import SUMMARY_MESSAGE_ID, VectorIndex
+from store import init_chats_table, init_messages_table, save_chat, save_messages
+from streaming import CompletionStream
+from urgency import current_urgency, with_live_urgency
+
+# telethon, openai and langdetect are only needed once we talk to Telegram,
+# so they are imported on first use rather than on every cold script start.
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from telethon.tl.custom.message import Message
+    from analysis import MessageRow
 
 # ── Constants (from tg3.py) ───────────────────────────────────────────────────
 API_ID       = 29332917
@@ -38,11 +51,11 @@ CONFIG_FILE  = 'config.json'
 MESSAGE_DIR  = './messages'
 DB_FILE      = 'telegram.db'
 MAX_TOKENS   = 500
+FETCH_MODE   = 'recent'  # default for "fetch_mode": 'unread', 'recent' or 'mentions'
 MAX_RETRIES  = 3
 URGENT_KEYWORDS   = {'urgent', 'asap', 'deadline', 'proposal', 'contract', 'deal'}
 FOLLOWUP_KEYWORDS = {'follow up', 'next steps', 'meeting', 'call', 'discuss'}
 
-os.makedirs(MESSAGE_DIR, exist_ok=True)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
 # ── Config ────────────────────────────────────────────────────────────────────
@@ -72,10 +85,7 @@ _defaults = {
     'auth_step': 'phone',     # phone | code | 2fa | fetching | dashboard
     'phone': DEFAULT_PHONE,
     'phone_code_hash': None,
-    'fetch_done': False,
-    'fetch_error': None,
-    'fetch_progress': None,   # (current, total, chat_name)
-    'fetch_thread': None,
+    'fetch_run': None,        # FetchService run this session is waiting on
     'nav_page': '📊 Dashboard',
     'skipped': set(),
     'last_sync': datetime.now(pytz.UTC),
@@ -97,27 +107,32 @@ def _run(coro):
     finally:
         loop.close()
 
+def _client():
+    from telethon import TelegramClient
+    return TelegramClient(SESSION_FILE, API_ID, API_HASH)
+
 async def _send_code(phone: str) -> str:
-    c = TelegramClient(SESSION_FILE, API_ID, API_HASH)
+    c = _client()
     await c.connect()
     r = await c.send_code_request(phone)
     await c.disconnect()
     return r.phone_code_hash
 
 async def _sign_in(phone: str, code: str, hash_: str):
-    c = TelegramClient(SESSION_FILE, API_ID, API_HASH)
+    c = _client()
     await c.connect()
     await c.sign_in(phone, code, phone_code_hash=hash_)
     await c.disconnect()
 
 async def _sign_in_2fa(password: str):
-    c = TelegramClient(SESSION_FILE, API_ID, API_HASH)
+    c = _client()
     await c.connect()
     await c.sign_in(password=password)
     await c.disconnect()
 
 # ── Message utilities ─────────────────────────────────────────────────────────
 def classify_msg(msg: Message) -> str:
+    from telethon.tl.types import MessageMediaEmpty
     if msg.media and not isinstance(msg.media, MessageMediaEmpty): return "media"
     if msg.voice:   return "voice"
     if msg.poll:    return "poll"
@@ -128,42 +143,63 @@ def classify_msg(msg: Message) -> str:
     return "other"
 
 def detect_lang(text: str) -> str:
+    from langdetect import detect
     try:    return detect(text)
     except: return "unknown"
 
-def urgency_score(msg: Message, is_group: bool) -> int:
+def urgency_base(msg: Message, is_group: bool) -> int:
     score = 0
     text  = (msg.text or '').lower()
     if any(k in text for k in URGENT_KEYWORDS): score += 40
-    diff  = (datetime.now(msg.date.tzinfo) - msg.date).total_seconds() / 60
-    score += max(0, 30 - int(diff / 10))
     if is_group: score += 10
-    return min(100, score)
+    return score
+
+def urgency_score(msg: Message, is_group: bool) -> int:
+    return current_urgency(urgency_base(msg, is_group), msg.date)
 
 def needs_followup(text: str) -> bool:
     return any(k in (text or '').lower() for k in FOLLOWUP_KEYWORDS)
 
+def analyze_dialog(rows: List[MessageRow], is_group: bool) -> Dict:
+    """CPU-bound analysis of one dialog's rows (newest first), for the analysis pool."""
+    last = rows[0]
+    return {'lang': detect_lang(last.text or ""), 'urg_base': urgency_base(last, is_group),
+            'followup': needs_followup(last.text), **message_features(rows)}
+
 # ── AI summary ────────────────────────────────────────────────────────────────
-async def ai_summary(messages: List[Message], client_ai: Optional[AsyncOpenAI]) -> str:
-    if not client_ai:
-        return "No OpenAI key set — skipped."
-    texts = []
-    for msg in messages[:50]:
-        try:
-            sender = await msg.get_sender()
-            uname  = getattr(sender, 'username', None) or f"User_{msg.sender_id}"
-        except Exception:
-            uname  = f"User_{msg.sender_id}"
-        texts.append(f"[{msg.date:%Y-%m-%d %H:%M}] {uname}: {msg.text or '[media]'}")
+def summary_messages(texts: List[str]) -> List[Dict]:
     prompt = (
         "Summarize this conversation concisely. "
         "Note key dates, follow-ups, and tag each participant.\n\n"
         + "\n".join(texts)
     )
+    return [{"role": "user", "content": prompt}]
+
+async def sender_names(messages) -> Dict[int, str]:
+    """{sender_id: username or User_<id>} for one Telethon message per sender."""
+    names = {}
+    for msg in messages:
+        try:
+            sender = await msg.get_sender()
+            names[msg.sender_id] = getattr(sender, 'username', None) or f"User_{msg.sender_id}"
+        except Exception:
+            names[msg.sender_id] = f"User_{msg.sender_id}"
+    return names
+
+async def ai_summary(messages: List[MessageRow], client_ai: Optional[AsyncOpenAI],
+                     clusters: Optional[Dict] = None, crossposted: Set[int] = frozenset(),
+                     names: Optional[Dict[int, str]] = None) -> str:
+    if not client_ai:
+        return "No OpenAI key set — skipped."
+    texts = []
+    for msg, copies, elsewhere in collapse(messages, clusters or {}, crossposted)[:50]:
+        uname = (names or {}).get(msg.sender_id) or f"User_{msg.sender_id}"
+        note = (f" [posted {copies}x]" if copies > 1 else "") + (" [crossposted]" if elsewhere else "")
+        texts.append(f"[{msg.date:%Y-%m-%d %H:%M}] {uname}: {msg.text or '[media]'}{note}")
     try:
         r = await client_ai.chat.completions.create(
             model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
+            messages=summary_messages(texts),
             max_tokens=MAX_TOKENS,
         )
         return r.choices[0].message.content.strip()
@@ -171,98 +207,163 @@ async def ai_summary(messages: List[Message], client_ai: Optional[AsyncOpenAI])
         return f"Summary error: {e}"
 
 # ── Fetch (background thread) ─────────────────────────────────────────────────
-async def _fetch_all():
-    client = TelegramClient(SESSION_FILE, API_ID, API_HASH)
+async def _fetch_all(report):
+    from openai import AsyncOpenAI
+    from telethon.errors import FloodWaitError
+    from mentions import fetch_mention_messages, history_limit
+
+    client = _client()
     await client.connect()
     if not await client.is_user_authorized():
         raise RuntimeError("Not authorized — please re-authenticate.")
 
     oai_key   = get_openai_key()
     client_ai = AsyncOpenAI(api_key=oai_key) if oai_key else None
-    dialogs   = await client.get_dialogs()
+    dialogs   = await select_dialogs(client, await client.get_dialogs(),
+                                     DialogPolicy.from_config(CONFIG_FILE))
     total     = len(dialogs)
+    fetch_mode = load_config().get('fetch_mode', FETCH_MODE)
 
     with sqlite3.connect(DB_FILE) as conn:
-        conn.execute('''CREATE TABLE IF NOT EXISTS chats (
-            chat_id INTEGER PRIMARY KEY, name TEXT, is_group BOOLEAN,
-            last_message_date DATETIME, urgency_score INTEGER,
-            needs_followup BOOLEAN, last_reply_date DATETIME)''')
-        conn.commit()
-
-    log = []
-    for i, dialog in enumerate(dialogs):
-        name     = dialog.name or "Unknown"
-        chat_id  = dialog.id
-        unread   = dialog.unread_count or 0
-        is_group = dialog.is_group or dialog.is_channel
-        st.session_state.fetch_progress = (i + 1, total, name)
+        init_chats_table(conn)
+        init_messages_table(conn)
+        rollups.init_tables(conn)
+        changelog.init_tables(conn)
+
+    index    = VectorIndex()
+    # Threads: this script's functions can't be pickled into a process pool
+    pool     = AnalysisPool('thread')
+    dup_conn = sqlite3.connect(DB_FILE)
+    detector = DuplicateDetector(dup_conn)
+    done     = 0
+
+    # One dialog = one `job` dict, passed along the stages (see pipeline.py)
+    async def fetch(dialog):
+        # MessageRows, classified once on arrival; Telethon objects (one per sender)
+        # only live until the sender names are looked up
+        messages, by_sender, retries = [], {}, 0
+
+        def add(msg):
+            messages.append(message_row(msg, classify_msg(msg)))
+            by_sender.setdefault(msg.sender_id, msg)
 
-        messages, retries = [], 0
         while retries < MAX_RETRIES:
+            messages.clear()
+            by_sender.clear()
             try:
-                async for msg in client.iter_messages(chat_id, limit=100):
-                    messages.append(msg)
+                if fetch_mode == 'mentions':
+                    for msg in await fetch_mention_messages(client, dialog):
+                        add(msg)
+                    break
+                async for msg in client.iter_messages(dialog.id, limit=history_limit(fetch_mode, dialog)):
+                    add(msg)
                 break
             except FloodWaitError as e:
                 await asyncio.sleep(min(e.seconds, 30) * (2 ** retries))
                 retries += 1
             except Exception:
                 break
+        names = await sender_names(by_sender.values())
+        sender = ("None", "None", "None")
+        if messages:
+            try:
+                s = await by_sender[messages[0].sender_id].get_sender()
+                sender = (s.id if s else "Unknown", getattr(s, 'username', None) or "None",
+                          getattr(s, 'first_name', 'Unknown'))
+            except Exception:
+                pass
+        return {'name': dialog.name or "Unknown", 'chat_id': dialog.id,
+                'unread': dialog.unread_count or 0,
+                'is_group': dialog.is_group or dialog.is_channel, 'messages': messages,
+                'names': names, 'sender': sender}
+
+    async def analyze(job):
+        chat_id, messages = job['chat_id'], job['messages']
+        last = messages[0] if messages else None
+        job.update(msg_text="No messages", msg_type="None", lang="unknown", urg_base=0, urg=0, followup=False,
+                   vectors=None, clusters={}, crossposted=set(), new_ids=set())
+        if not last:
+            return job
+        # Language detection, MinHash and embeddings run in the pool, so fetch and summarize keep moving
+        analysis = await pool.submit(analyze_dialog, messages, job['is_group'])
+        fresh = rollups.new_messages(dup_conn, chat_id, messages)
+        buckets = await pool.submit(rollups.bucketize, fresh, detect_lang) if fresh else None
+        job.update(msg_text=last.text or f"[{last.type}]", msg_type=last.type, lang=analysis['lang'],
+                   urg_base=analysis['urg_base'], urg=current_urgency(analysis['urg_base'], last.date),
+                   followup=analysis['followup'], vectors=analysis['vectors'])
+        job['new_ids'] = save_messages(dup_conn, chat_id, messages)
+        if fresh:
+            rollups.add(dup_conn, chat_id, buckets, max(r.id for r in fresh), min(r.id for r in fresh))
+        job['clusters'] = detector.check_many(chat_id, messages, analysis['signatures'])
+        job['crossposted'] = detector.crossposted(chat_id, job['clusters'])
+        dup_conn.commit()
+        return job
+
+    async def summarize(job):
+        messages, clusters = job['messages'], job['clusters']
+        if not messages:
+            job['summary'] = "No messages"
+        elif only_duplicates(clusters, job['new_ids']):
+            job['summary'] = "Skipped — only crossposted/duplicate messages."
+        else:
+            job['summary'] = await ai_summary(messages, client_ai, clusters, job['crossposted'], job['names'])
+        return job
 
+    async def persist(job):
+        nonlocal done
+        name, chat_id, messages = job['name'], job['chat_id'], job['messages']
+        clusters, summary = job['clusters'], job['summary']
         last  = messages[0]  if messages else None
         first = messages[-1] if messages else None
 
-        msg_text = (last.text or f"[{classify_msg(last)}]") if last else "No messages"
-        msg_type = classify_msg(last) if last else "None"
-        lang     = detect_lang(last.text or "") if last else "unknown"
-        urg      = urgency_score(last, is_group) if last else 0
-        followup = needs_followup(last.text if last else "")
-        summary  = await ai_summary(messages, client_ai) if messages else "No messages"
+        if messages:
+            keep = [i for i, m in enumerate(messages) if not clusters.get(m.id, (None, False))[1]]
+            index.add([(chat_id, messages[i].id, messages[i].text) for i in keep], job['vectors'][keep])
+        if client_ai and messages and not summary.startswith(("Summary error", "Skipped")):
+            index.add([(chat_id, SUMMARY_MESSAGE_ID, summary)])
+            changelog.record(dup_conn, 'summary', chat_id, {'summary': summary, 'source': 'sync'})
+            dup_conn.commit()
 
-        sender_id, sender_uname, sender_name = "None", "None", "None"
-        if last:
-            try:
-                s = await last.get_sender()
-                sender_id    = s.id if s else "Unknown"
-                sender_uname = getattr(s, 'username', None) or "None"
-                sender_name  = getattr(s, 'first_name', 'Unknown')
-            except Exception:
-                pass
+        sender_id, sender_uname, sender_name = job['sender']
 
         with sqlite3.connect(DB_FILE) as conn:
-            conn.execute(
-                'INSERT OR REPLACE INTO chats VALUES (?,?,?,?,?,?,?)',
-                (chat_id, name, is_group,
-                 last.date.isoformat() if last else None,
-                 urg, followup, None),
-            )
+            save_chat(conn, {'chat_id': chat_id, 'name': name, 'is_group': job['is_group'],
+                             'last_message_date': last.date.isoformat() if last else None,
+                             'urgency_score': job['urg'], 'needs_followup': job['followup'],
+                             'urgency_base': job['urg_base'], 'needs_deep_sync': False})
             conn.commit()
 
-        log.append({
-            "Chat Name": name, "Chat ID": chat_id, "Is Group": is_group,
-            "Unread Count": unread, "Urgency Score": urg, "Needs Followup": followup,
+        done += 1
+        report(done, total, name)
+        return {
+            "Chat Name": name, "Chat ID": chat_id, "Is Group": job['is_group'],
+            "Unread Count": job['unread'], "Urgency Score": job['urg'], "Urgency Base": job['urg_base'],
+            "Needs Followup": job['followup'],
             "First Message Date": first.date if first else None,
             "Last Unread Message Date": last.date if last else None,
             "Last Sender ID": sender_id, "Last Sender Username": sender_uname,
-            "Last Sender Name": sender_name, "Last Message Type": msg_type,
-            "Language": lang, "Last Message Text": msg_text, "Summary": summary,
-        })
+            "Last Sender Name": sender_name, "Last Message Type": job['msg_type'],
+            "Language": job['lang'], "Last Message Text": job['msg_text'], "Summary": summary,
+            "Duplicate Messages": sum(dup for _, dup in clusters.values()),
+        }
+
+    sync = Pipeline.from_config({'fetch': fetch, 'analyze': analyze, 'summarize': summarize,
+                                 'persist': persist}, CONFIG_FILE)
+    log  = await sync.run(dialogs)
+    logging.info(f"Pipeline stats: {sync.stats()}")
+    logging.info(f"Analysis pool: {pool.stats()}")
+    pool.shutdown()
 
+    rollups.downsample(dup_conn)
+    maintenance.run_if_due(dup_conn)
+    dup_conn.close()
     await client.disconnect()
     pd.DataFrame(log).to_csv(CSV_FILE, index=False)
 
-def _fetch_thread():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        loop.run_until_complete(_fetch_all())
-        st.session_state.fetch_done  = True
-        st.session_state.fetch_error = None
-    except Exception as e:
-        st.session_state.fetch_done  = True
-        st.session_state.fetch_error = str(e)
-    finally:
-        loop.close()
+@st.cache_resource
+def get_fetch_service() -> FetchService:
+    # One per server process: every session shares the same in-flight fetch
+    return FetchService(_fetch_all)
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
 def format_ago(ts) -> str:
@@ -273,8 +374,20 @@ def format_ago(ts) -> str:
     if hours < 24: return f"{int(hours)}h ago"
     return f"{int(hours / 24)}d ago"
 
-@st.cache_data
-def load_csv():
+@st.cache_resource
+def get_search_index() -> VectorIndex:
+    return VectorIndex()
+
+def data_version() -> int:
+    """Modification time of the CSV; every cached view below is keyed on it."""
+    return os.stat(CSV_FILE).st_mtime_ns if os.path.exists(CSV_FILE) else 0
+
+def current_minute() -> int:
+    # Urgency decays in 10-minute steps, so minute-resolution views stay exact enough
+    return int(time.time() // 60)
+
+@st.cache_data(max_entries=2)
+def load_csv(version: int):
     try:
         df = pd.read_csv(CSV_FILE)
         for col in ['Last Unread Message Date', 'First Message Date', 'last_reply_date']:
@@ -291,6 +404,65 @@ def load_csv():
         st.error(f"Error loading data: {e}")
         return None
 
+@st.cache_data(max_entries=4)
+def live_csv(version: int, minute: int):
+    df = load_csv(version)
+    return with_live_urgency(df) if df is not None else None
+
+@st.cache_data(max_entries=4)
+def metrics_view(version: int, minute: int) -> Dict:
+    df  = live_csv(version, minute)
+    now = pd.Timestamp.now(tz='UTC')
+    return {
+        'grp_unread': int(df[df['Is Group']]['Unread Count'].sum()),
+        'prv_unread': int(df[~df['Is Group']]['Unread Count'].sum()),
+        'active_grp': len(df[
+            df['Is Group'] &
+            (df['Last Unread Message Date'] > now - pd.Timedelta(days=7))
+        ]),
+        'total_grp':  len(df[df['Is Group']]),
+        'urgent_n':   len(df[df['Urgency Score'] >= 50]),
+        'today_n':    len(df[df['Last Unread Message Date'].dt.date == now.date()]),
+    }
+
+@st.cache_data(max_entries=4)
+def followup_view(version: int):
+    df = load_csv(version)
+    return df[df['Needs Followup']].sort_values('Last Unread Message Date', ascending=False)
+
+@st.cache_data(max_entries=8)
+def activity_view(version: int, days: int) -> Dict:
+    """Rollup queries for the Analytics page; cheap, but re-run only when a sync lands."""
+    since = time.time() - days * rollups.DAY
+    with sqlite3.connect(DB_FILE) as conn:
+        rollups.init_tables(conn)
+        daily = pd.DataFrame(rollups.daily_volume(conn, since), columns=['Day', 'Messages'])
+        hours = pd.DataFrame(rollups.busiest_hours(conn, since), columns=['Hour (UTC)', 'Messages'])
+        chats = pd.DataFrame(rollups.totals_by(conn, 'chat_id', since), columns=['Chat ID', 'Messages'])
+        types = pd.DataFrame(rollups.totals_by(conn, 'msg_type', since), columns=['Type', 'Messages'])
+        langs = pd.DataFrame(rollups.totals_by(conn, 'language', since), columns=['Language', 'Messages'])
+    daily['Day'] = pd.to_datetime(daily['Day'], unit='s')
+    return {'daily': daily, 'hours': hours, 'chats': chats, 'types': types, 'langs': langs}
+
+@st.cache_data(max_entries=32)
+def groups_view(version: int, minute: int, filt: str, sort: str):
+    df     = live_csv(version, minute)
+    groups = df[df['Is Group']]
+    now    = pd.Timestamp.now(tz='UTC')
+    if filt == "Active (24h)":
+        groups = groups[groups['Last Unread Message Date'] > now - pd.Timedelta(days=1)]
+    elif filt == "Active (7d)":
+        groups = groups[groups['Last Unread Message Date'] > now - pd.Timedelta(days=7)]
+    elif filt == "Inactive (>7d)":
+        groups = groups[groups['Last Unread Message Date'] <= now - pd.Timedelta(days=7)]
+
+    sort_map = {
+        "Last Activity": "Last Unread Message Date",
+        "Unread Count":  "Unread Count",
+        "Urgency Score": "Urgency Score",
+    }
+    return groups.sort_values(sort_map[sort], ascending=False)
+
 # ── CSS ───────────────────────────────────────────────────────────────────────
 st.markdown("""
 <style>
@@ -361,6 +533,8 @@ def page_phone():
 
 
 def page_code():
+    from telethon.errors import PhoneCodeInvalidError, SessionPasswordNeededError
+
     st.markdown("<div class='setup-box'>", unsafe_allow_html=True)
     st.markdown("# 💬 Enter your code")
     st.markdown(f"<p>Telegram sent a code to <b>{st.session_state.phone}</b></p>",
@@ -418,38 +592,35 @@ def page_fetching():
     st.title("💬 Fetching your chats…")
     st.caption("This may take a few minutes depending on how many chats you have.")
 
-    # Start thread once
-    if (st.session_state.fetch_thread is None
-            or not st.session_state.fetch_thread.is_alive()):
-        if not st.session_state.fetch_done:
-            t = threading.Thread(target=_fetch_thread, daemon=True)
-            t.start()
-            st.session_state.fetch_thread = t
-
-    if st.session_state.fetch_done:
-        if st.session_state.fetch_error:
-            st.error(f"Fetch failed: {st.session_state.fetch_error}")
+    # Joins the fetch another tab already started instead of starting a second one
+    svc = get_fetch_service()
+    if st.session_state.fetch_run is None:
+        st.session_state.fetch_run = svc.request()
+    run = st.session_state.fetch_run
+
+    if svc.done(run):
+        if svc.error(run):
+            st.error(f"Fetch failed: {svc.error(run)}")
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Retry"):
-                    st.session_state.fetch_done   = False
-                    st.session_state.fetch_error  = None
-                    st.session_state.fetch_thread = None
+                    st.session_state.fetch_run = None
                     st.rerun()
             with col2:
                 if st.button("Sign out"):
                     if os.path.exists(f'{SESSION_FILE}.session'):
                         os.remove(f'{SESSION_FILE}.session')
+                    st.session_state.fetch_run = None
                     st.session_state.auth_step = 'phone'
                     st.rerun()
         else:
             st.success("Done! Loading your dashboard…")
-            st.session_state.auth_step  = 'dashboard'
-            st.session_state.fetch_done = False
-            st.cache_data.clear()
+            st.session_state.auth_step = 'dashboard'
+            st.session_state.fetch_run = None
+            st.session_state.last_sync = datetime.fromtimestamp(svc.finished, pytz.UTC)
             st.rerun()
     else:
-        prog = st.session_state.fetch_progress
+        prog = svc.progress
         if prog:
             current, total, name = prog
             pct = current / total
@@ -461,8 +632,210 @@ def page_fetching():
         st.rerun()
 
 
+# ── Summarize now ─────────────────────────────────────────────────────────────
+def init_summaries(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS summaries (
+        chat_id INTEGER PRIMARY KEY, summary TEXT, created_at REAL)''')
+    conn.commit()
+    changelog.init_tables(conn)
+
+def stored_summaries(since: float) -> Dict[int, str]:
+    """On-demand summaries written after `since` (epoch seconds), i.e. newer than the CSV."""
+    if not os.path.exists(DB_FILE):
+        return {}
+    with sqlite3.connect(DB_FILE) as conn:
+        init_summaries(conn)
+        return dict(conn.execute('SELECT chat_id, summary FROM summaries WHERE created_at > ?',
+                                 (since,)).fetchall())
+
+def stream_summary(chat_id: int) -> CompletionStream:
+    """Summarize the chat's stored messages (duplicates dropped), streaming tokens as they arrive."""
+    with sqlite3.connect(DB_FILE) as conn:
+        init_messages_table(conn)
+        init_dup_tables(conn)
+        rows = conn.execute(
+            'SELECT m.date, m.sender_id, m.text FROM messages m '
+            'LEFT JOIN message_clusters c ON c.chat_id = m.chat_id AND c.message_id = m.message_id '
+            'AND c.account = m.account '
+            'WHERE m.chat_id = ? AND COALESCE(c.is_duplicate, 0) = 0 '
+            'ORDER BY m.message_id DESC LIMIT 50', (chat_id,)).fetchall()
+    texts = [f"[{str(date)[:16]}] User_{sender}: {text or '[media]'}" for date, sender, text in rows]
+    return CompletionStream(summary_messages(texts), MAX_TOKENS, get_openai_key())
+
+def save_summary(chat_id: int, summary: str):
+    with sqlite3.connect(DB_FILE) as conn:
+        init_summaries(conn)
+        conn.execute('INSERT OR REPLACE INTO summaries (chat_id, summary, created_at) VALUES (?, ?, ?)',
+                     (chat_id, summary, time.time()))
+        conn.commit()
+    get_search_index().add([(chat_id, SUMMARY_MESSAGE_ID, summary)])
+
+def request_summary(chat_id: int):
+    st.session_state.summarizing = chat_id
+
+def summary_block(r, stored: Dict[int, str], key: str):
+    """AI summary section of a chat expander, with a streaming "Summarize now" button."""
+    chat_id = r['Chat ID']
+    if st.session_state.get('summarizing') == chat_id:
+        st.markdown("**AI Summary:**")
+        stream = stream_summary(chat_id)
+        st.write_stream(stream)
+        st.session_state.summarizing = None
+        if not stream.error and stream.text.strip():
+            save_summary(chat_id, stream.text.strip())
+        if stream.first_token is not None:
+            st.caption(f"First token after {stream.first_token:.1f}s")
+        return
+    summary = stored.get(chat_id, r.get('Summary', ''))
+    if pd.notna(summary) and summary and summary != r['Last Message Text']:
+        st.markdown("**AI Summary:**")
+        st.markdown(summary)
+    st.button("📝 Summarize now", key=f"summarize_{key}_{chat_id}",
+              on_click=request_summary, args=(chat_id,))
+
+# ── Export ────────────────────────────────────────────────────────────────────
+def start_export(df, fmt: str):
+    # Written from a background thread; export_progress() polls it while it runs
+    job = st.session_state.get('export_job')
+    if job is not None and job.running:
+        st.toast("An export is already running", icon="⏳")
+        return
+    st.session_state.export_job = ExportJob(df, fmt).start()
+    st.toast(f"Exporting {len(df):,} rows to {st.session_state.export_job.path}", icon="📤")
+
+# ── Fragments ─────────────────────────────────────────────────────────────────
+# Widgets inside a fragment rerun only that fragment, not the whole page.
+@st.fragment(run_every=1)
+def export_progress(job):
+    if job.running:
+        st.progress(job.progress, text=f"Exporting {job.rows_done:,} / {job.total:,} rows…")
+    else:
+        st.rerun()  # once, to swap the poller for the result below
+
+def export_status():
+    # Only a running export polls; the download button is rendered once, outside the fragment
+    job = st.session_state.get('export_job')
+    if job is None:
+        return
+    if job.running:
+        export_progress(job)
+    elif job.status == 'failed':
+        st.error(f"Export failed: {job.error}")
+    elif os.path.exists(job.path):
+        with open(job.path, 'rb') as f:
+            st.download_button(f"⬇️ Download {job.path} ({job.elapsed:.1f}s)", f,
+                               file_name=os.path.basename(job.path), mime=job.mime)
+
+@st.fragment
+def metrics_bar(version: int):
+    m = metrics_view(version, current_minute())
+    m1, m2, m3, m4 = st.columns(4)
+    for col, val, label in [
+        (m1, f"{m['grp_unread']:,} / {m['prv_unread']:,}", "Unread (Groups / Private)"),
+        (m2, f"{m['active_grp']} / {m['total_grp']}",       "Active / Total Groups (7d)"),
+        (m3, str(m['urgent_n']),                             "High Urgency Chats"),
+        (m4, str(m['today_n']),                              "Messages Today"),
+    ]:
+        col.markdown(f"""
+            <div class='metric-card'>
+                <div class='metric-value'>{val}</div>
+                <div class='metric-label'>{label}</div>
+            </div>
+        """, unsafe_allow_html=True)
+
+@st.fragment
+def groups_list(version: int):
+    f1, f2 = st.columns(2)
+    with f1:
+        filt = st.selectbox("Filter", [
+            "All Groups", "Active (24h)", "Active (7d)", "Inactive (>7d)"])
+    with f2:
+        sort = st.selectbox("Sort By", [
+            "Last Activity", "Unread Count", "Urgency Score"])
+
+    groups = groups_view(version, current_minute(), filt, sort)
+    stored = stored_summaries(version / 1e9)
+    st.caption(f"{len(groups)} groups")
+
+    for _, r in groups.iterrows():
+        urg_color = "#ff4b4b" if r['Urgency Score'] >= 70 else \
+                    "#ffc107" if r['Urgency Score'] >= 40 else "#8892a4"
+        with st.expander(
+            f"👥 {r['Chat Name']} — 🔔 {r['Unread Count']:,} unread",
+            expanded=st.session_state.get('summarizing') == r['Chat ID'],
+        ):
+            col_a, col_b = st.columns([4, 1])
+            with col_a:
+                st.markdown(
+                    f"**Last message by:** {r.get('Last Sender Name','Unknown')} "
+                    f"(@{r.get('Last Sender Username','?')})")
+                st.markdown(
+                    f"**Type:** {r['Last Message Type']} · "
+                    f"**Language:** {r['Language']} · "
+                    f"**Last activity:** {format_ago(r['Last Unread Message Date'])}")
+                st.markdown(f"**Last message:** {str(r['Last Message Text'])[:400]}")
+                summary_block(r, stored, 'groups')
+            with col_b:
+                st.markdown(
+                    f"<div style='color:{urg_color};font-size:2rem;"
+                    f"text-align:center;font-weight:bold;'>{r['Urgency Score']}"
+                    f"<br><small style='font-size:0.7rem;color:#8892a4;'>urgency</small>"
+                    f"</div>",
+                    unsafe_allow_html=True)
+
+@st.fragment
+def activity_charts(version: int, names: Dict[int, str]):
+    days = st.selectbox("Range", [7, 30, 90, 365], index=1, format_func=lambda d: f"Last {d} days")
+    a = activity_view(version, days)
+    if a['daily'].empty:
+        st.info("No activity recorded yet — it builds up from the next fetch.")
+        return
+    st.subheader("Message Volume")
+    st.line_chart(a['daily'].set_index('Day'))
+    c1, c2 = st.columns(2)
+    with c1:
+        st.subheader("Busiest Hours")
+        st.bar_chart(a['hours'].set_index('Hour (UTC)'))
+    with c2:
+        st.subheader("Most Active Chats")
+        chats = a['chats'].assign(Chat=a['chats']['Chat ID'].map(lambda c: names.get(c, f"Chat {c}")))
+        st.bar_chart(chats.set_index('Chat')['Messages'])
+    c3, c4 = st.columns(2)
+    with c3:
+        st.subheader("Messages by Type")
+        st.bar_chart(a['types'].set_index('Type'))
+    with c4:
+        st.subheader("Messages by Language")
+        st.bar_chart(a['langs'].set_index('Language'))
+
+@st.fragment
+def search_panel(version: int):
+    query = st.text_input("Search messages and summaries",
+                          placeholder="teams asking for a Cairo audit")
+    if query.strip():
+        t0   = time.perf_counter()
+        hits = get_search_index().search(query, k=20)
+        st.caption(f"{len(hits)} chats · {(time.perf_counter() - t0) * 1000:.0f} ms")
+        by_id = live_csv(version, current_minute()).set_index('Chat ID')
+        for chat_id, score, msg_id in hits:
+            r    = by_id.loc[chat_id] if chat_id in by_id.index else None
+            name = r['Chat Name'] if r is not None else f"Chat {chat_id}"
+            where = "summary" if msg_id == SUMMARY_MESSAGE_ID else f"message #{msg_id}"
+            with st.expander(f"🔎 {name} — {score:.2f} · matched {where}"):
+                if r is not None:
+                    st.markdown(f"**Last message:** {str(r['Last Message Text'])[:400]}")
+                    summary = r.get('Summary', '')
+                    if pd.notna(summary) and summary:
+                        st.markdown("**AI Summary:**")
+                        st.markdown(summary)
+        if not hits:
+            st.info("No matching chats.")
+
+
 def page_dashboard():
-    df = load_csv()
+    # Cached per CSV version; the recency decay is re-applied once a minute
+    version = data_version()
+    df      = live_csv(version, current_minute())
 
     # ── Sidebar ──────────────────────────────────────────────────────────────
     with st.sidebar:
@@ -477,11 +850,16 @@ def page_dashboard():
                 </div>
             </div>
         """, unsafe_allow_html=True)
+        svc = get_fetch_service()
+        if svc.running and svc.progress:
+            current, total, _ = svc.progress
+            st.caption(f"🔄 Sync in progress — {current}/{total} chats")
         st.markdown("---")
         st.session_state.nav_page = st.radio("Navigation", [
             "📊 Dashboard",
             "📩 Unreplied Messages",
             "👥 Groups",
+            "🔎 Search",
             "📈 Analytics",
             "⚙️ Settings",
         ])
@@ -497,45 +875,15 @@ def page_dashboard():
         st.caption(f"Last synced {format_ago(st.session_state.last_sync)}")
     with c2:
         if st.button("📤 Export", use_container_width=True):
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            fname = f"telegram_export_{ts}.csv"
-            df.to_csv(fname, index=False)
-            st.toast(f"Exported to {fname}", icon="📤")
+            start_export(df, load_config().get('export_format', 'csv'))
     with c3:
         if st.button("🔄 Re-fetch", use_container_width=True):
-            st.session_state.fetch_done   = False
-            st.session_state.fetch_error  = None
-            st.session_state.fetch_thread = None
-            st.session_state.auth_step    = 'fetching'
-            st.session_state.last_sync    = datetime.now(pytz.UTC)
-            st.cache_data.clear()
+            st.session_state.fetch_run = None
+            st.session_state.auth_step = 'fetching'
             st.rerun()
+    export_status()
 
-    # ── Metrics ───────────────────────────────────────────────────────────────
-    now        = pd.Timestamp.now(tz='UTC')
-    grp_unread = int(df[df['Is Group']]['Unread Count'].sum())
-    prv_unread = int(df[~df['Is Group']]['Unread Count'].sum())
-    active_grp = len(df[
-        df['Is Group'] &
-        (df['Last Unread Message Date'] > now - pd.Timedelta(days=7))
-    ])
-    total_grp  = len(df[df['Is Group']])
-    urgent_n   = len(df[df['Urgency Score'] >= 50])
-    today_n    = len(df[df['Last Unread Message Date'].dt.date == now.date()])
-
-    m1, m2, m3, m4 = st.columns(4)
-    for col, val, label in [
-        (m1, f"{grp_unread:,} / {prv_unread:,}", "Unread (Groups / Private)"),
-        (m2, f"{active_grp} / {total_grp}",       "Active / Total Groups (7d)"),
-        (m3, str(urgent_n),                        "High Urgency Chats"),
-        (m4, str(today_n),                         "Messages Today"),
-    ]:
-        col.markdown(f"""
-            <div class='metric-card'>
-                <div class='metric-value'>{val}</div>
-                <div class='metric-label'>{label}</div>
-            </div>
-        """, unsafe_allow_html=True)
+    metrics_bar(version)
 
     st.markdown("---")
     page = st.session_state.nav_page
@@ -546,8 +894,7 @@ def page_dashboard():
 
         with c1:
             st.subheader("📩 Needs Follow-up")
-            needs_reply = df[df['Needs Followup']].sort_values(
-                'Last Unread Message Date', ascending=False).head(5)
+            needs_reply = followup_view(version).head(5)
             if len(needs_reply) == 0:
                 st.info("No chats need follow-up.")
             for _, r in needs_reply.iterrows():
@@ -574,75 +921,26 @@ def page_dashboard():
 
     # ══ Unreplied Messages ════════════════════════════════════════════════════
     elif page == "📩 Unreplied Messages":
-        unreplied = df[df['Needs Followup']].sort_values(
-            'Last Unread Message Date', ascending=False)
+        unreplied = followup_view(version)
         st.caption(f"{len(unreplied)} chats need follow-up")
         if len(unreplied) == 0:
             st.success("You're all caught up! 🎉")
+        stored = stored_summaries(version / 1e9)
         for _, r in unreplied.iterrows():
             with st.expander(
-                f"💬 {r['Chat Name']} — {r['Unread Count']} unread · {format_ago(r['Last Unread Message Date'])}"
+                f"💬 {r['Chat Name']} — {r['Unread Count']} unread · {format_ago(r['Last Unread Message Date'])}",
+                expanded=st.session_state.get('summarizing') == r['Chat ID'],
             ):
                 st.markdown(f"**Last message:** {r['Last Message Text']}")
-                summary = r.get('Summary', '')
-                if pd.notna(summary) and summary and summary != r['Last Message Text']:
-                    st.markdown("**AI Summary:**")
-                    st.markdown(summary)
+                summary_block(r, stored, 'unreplied')
 
     # ══ Groups ════════════════════════════════════════════════════════════════
     elif page == "👥 Groups":
-        f1, f2 = st.columns(2)
-        with f1:
-            filt = st.selectbox("Filter", [
-                "All Groups", "Active (24h)", "Active (7d)", "Inactive (>7d)"])
-        with f2:
-            sort = st.selectbox("Sort By", [
-                "Last Activity", "Unread Count", "Urgency Score"])
-
-        groups = df[df['Is Group']].copy()
-        now    = pd.Timestamp.now(tz='UTC')
-        if filt == "Active (24h)":
-            groups = groups[groups['Last Unread Message Date'] > now - pd.Timedelta(days=1)]
-        elif filt == "Active (7d)":
-            groups = groups[groups['Last Unread Message Date'] > now - pd.Timedelta(days=7)]
-        elif filt == "Inactive (>7d)":
-            groups = groups[groups['Last Unread Message Date'] <= now - pd.Timedelta(days=7)]
-
-        sort_map = {
-            "Last Activity": "Last Unread Message Date",
-            "Unread Count":  "Unread Count",
-            "Urgency Score": "Urgency Score",
-        }
-        groups = groups.sort_values(sort_map[sort], ascending=False)
-        st.caption(f"{len(groups)} groups")
+        groups_list(version)
 
-        for _, r in groups.iterrows():
-            urg_color = "#ff4b4b" if r['Urgency Score'] >= 70 else \
-                        "#ffc107" if r['Urgency Score'] >= 40 else "#8892a4"
-            with st.expander(
-                f"👥 {r['Chat Name']} — 🔔 {r['Unread Count']:,} unread"
-            ):
-                col_a, col_b = st.columns([4, 1])
-                with col_a:
-                    st.markdown(
-                        f"**Last message by:** {r.get('Last Sender Name','Unknown')} "
-                        f"(@{r.get('Last Sender Username','?')})")
-                    st.markdown(
-                        f"**Type:** {r['Last Message Type']} · "
-                        f"**Language:** {r['Language']} · "
-                        f"**Last activity:** {format_ago(r['Last Unread Message Date'])}")
-                    st.markdown(f"**Last message:** {str(r['Last Message Text'])[:400]}")
-                    summary = r.get('Summary', '')
-                    if pd.notna(summary) and summary and summary != r['Last Message Text']:
-                        st.markdown("**AI Summary:**")
-                        st.markdown(summary)
-                with col_b:
-                    st.markdown(
-                        f"<div style='color:{urg_color};font-size:2rem;"
-                        f"text-align:center;font-weight:bold;'>{r['Urgency Score']}"
-                        f"<br><small style='font-size:0.7rem;color:#8892a4;'>urgency</small>"
-                        f"</div>",
-                        unsafe_allow_html=True)
+    # ══ Search ════════════════════════════════════════════════════════════════
+    elif page == "🔎 Search":
+        search_panel(version)
 
     # ══ Analytics ═════════════════════════════════════════════════════════════
     elif page == "📈 Analytics":
@@ -672,6 +970,10 @@ def page_dashboard():
                 use_container_width=True,
             )
 
+        st.markdown("---")
+        st.subheader("📊 Activity")
+        activity_charts(version, dict(zip(df['Chat ID'], df['Chat Name'])))
+
     # ══ Settings ══════════════════════════════════════════════════════════════
     elif page == "⚙️ Settings":
         st.subheader("🔑 OpenAI API Key")
@@ -691,6 +993,60 @@ def page_dashboard():
             else:
                 st.error("Key must start with 'sk-'")
 
+        st.markdown("---")
+        st.subheader("📥 Fetch Mode")
+        modes = {"unread": "Unread messages per chat",
+                 "recent": "Last 100 messages per chat",
+                 "mentions": "Only @-mentions and replies to me (+ context)"}
+        mode = st.radio("What to fetch from each chat", list(modes),
+                        format_func=modes.get,
+                        index=list(modes).index(cfg.get('fetch_mode', FETCH_MODE)))
+        if mode != cfg.get('fetch_mode', FETCH_MODE):
+            cfg['fetch_mode'] = mode
+            save_config(cfg)
+            st.toast("Fetch mode saved — applies to the next re-fetch", icon="✅")
+
+        st.markdown("---")
+        st.subheader("🗂 Chat Selection")
+        st.caption("Applied to the dialog list before any history is fetched.")
+        pol = DialogPolicy.from_config(CONFIG_FILE)
+        p1, p2, p3 = st.columns(3)
+        with p1:
+            types = st.multiselect("Chat types", TYPES, default=sorted(pol.types))
+            min_unread = st.number_input("Minimum unread", min_value=0, value=pol.min_unread)
+        with p2:
+            archived = st.selectbox("Archived chats", MODES, index=MODES.index(pol.archived))
+            muted = st.selectbox("Muted chats", MODES, index=MODES.index(pol.muted))
+        with p3:
+            allow = st.text_input("Always fetch (chat ids)", ", ".join(map(str, sorted(pol.allow))))
+            deny = st.text_input("Never fetch (chat ids)", ", ".join(map(str, sorted(pol.deny))))
+        folders = st.text_input("Only chats in these folders (comma-separated names)", ", ".join(pol.folders))
+        if st.button("Save chat selection"):
+            try:
+                new_pol = DialogPolicy(
+                    types=types, archived=archived, muted=muted, min_unread=int(min_unread),
+                    folders=[f.strip() for f in folders.split(',') if f.strip()],
+                    allow=[int(c) for c in re.findall(r'-?\d+', allow)],
+                    deny=[int(c) for c in re.findall(r'-?\d+', deny)],
+                    skip_migrated=pol.skip_migrated)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                cfg['dialog_policy'] = new_pol.to_dict()
+                save_config(cfg)
+                st.toast("Chat selection saved — applies to the next re-fetch", icon="✅")
+
+        st.markdown("---")
+        st.subheader("📤 Export Format")
+        formats = {"csv": "CSV", "csv.gz": "CSV (gzip)", "xlsx": "Excel"}
+        fmt = st.radio("Format used by the 📤 Export button", list(formats),
+                       format_func=formats.get, horizontal=True,
+                       index=list(formats).index(cfg.get('export_format', 'csv')))
+        if fmt != cfg.get('export_format', 'csv'):
+            cfg['export_format'] = fmt
+            save_config(cfg)
+            st.toast("Export format saved", icon="✅")
+
         st.markdown("---")
         st.subheader("📂 Data")
         st.caption(f"CSV: `{CSV_FILE}`  ·  Session: `{SESSION_FILE}.session`")
@@ -698,11 +1054,8 @@ def page_dashboard():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🔄 Re-fetch all chats", use_container_width=True):
-                st.session_state.fetch_done   = False
-                st.session_state.fetch_error  = None
-                st.session_state.fetch_thread = None
-                st.session_state.auth_step    = 'fetching'
-                st.cache_data.clear()
+                st.session_state.fetch_run = None
+                st.session_state.auth_step = 'fetching'
                 st.rerun()
         with col2:
             if st.button("🚪 Sign out", use_container_width=True):
@@ -0,0 +1,145 @@
+"""
+Small helpers shared by the fetchers for evolving telegram.db in place.
+
+Rows that come from one Telegram account's view of a chat are keyed by
+`account` as well as by chat (and message) id. Two accounts in the same
+group, or talking to the same person, then keep separate rows. Private
+chat message ids are per account and would otherwise collide. A
+single-account setup stores account '' (NO_ACCOUNT), never NULL, because
+NULLs never conflict in a primary key.
+"""
+
+import sqlite3
+from typing import Dict, Optional, Set
+
+NO_ACCOUNT = ''
+
+# {table: CREATE TABLE template}; extra columns are added with ensure_columns()
+_SCHEMAS = {
+    'chats': '''CREATE TABLE IF NOT EXISTS {name} (
+        chat_id INTEGER,
+        account TEXT NOT NULL DEFAULT '',
+        name TEXT,
+        is_group BOOLEAN,
+        last_message_date DATETIME,
+        urgency_score INTEGER,
+        needs_followup BOOLEAN,
+        last_reply_date DATETIME,
+        PRIMARY KEY (chat_id, account)
+    )''',
+    'messages': '''CREATE TABLE IF NOT EXISTS {name} (
+        chat_id INTEGER,
+        message_id INTEGER,
+        account TEXT NOT NULL DEFAULT '',
+        date DATETIME,
+        sender_id INTEGER,
+        text TEXT,
+        reply_to_msg_id INTEGER,
+        is_mention BOOLEAN,
+        PRIMARY KEY (chat_id, message_id, account)
+    )''',
+    'opportunities': '''CREATE TABLE IF NOT EXISTS {name} (
+        chat_id INTEGER,
+        message_id INTEGER,
+        account TEXT NOT NULL DEFAULT '',
+        service TEXT,
+        timestamp DATETIME,
+        PRIMARY KEY (chat_id, message_id, account)
+    )''',
+}
+
+
+def account_key(account: Optional[str]) -> str:
+    return account or NO_ACCOUNT
+
+def ensure_columns(conn: sqlite3.Connection, table: str, columns: dict):
+    """Add any of `columns` ({name: declaration}) missing from an existing table."""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, decl in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {decl}')
+    conn.commit()
+
+def has_account_key(conn: sqlite3.Connection, table: str) -> bool:
+    """True when `table` exists and `account` is part of its primary key."""
+    return any(row[1] == 'account' and row[5] for row in conn.execute(f'PRAGMA table_info({table})'))
+
+def create_keyed_table(conn: sqlite3.Connection, table: str, create: str):
+    """CREATE `table` from the `create` template ({name} placeholder), whose key includes account.
+
+    A table created before `account` joined its key is rebuilt once. All its
+    rows and columns are kept, and a NULL account becomes ''. Triggers and
+    indexes on the old table go with it; their init functions recreate them.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if not exists:
+        conn.execute(create.format(name=table))
+        conn.commit()
+        return
+    if has_account_key(conn, table):
+        return
+    tmp = f'{table}_rekeyed'
+    old = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info({table})')}
+    with conn:
+        conn.execute(f'DROP TABLE IF EXISTS {tmp}')
+        conn.execute(create.format(name=tmp))
+        new = {row[1] for row in conn.execute(f'PRAGMA table_info({tmp})')}
+        for name, decl in old.items():
+            if name not in new:
+                conn.execute(f'ALTER TABLE {tmp} ADD COLUMN {name} {decl}')
+        cols = list(old)
+        select = ', '.join("COALESCE(account, '')" if c == 'account' else c for c in cols)
+        # OR IGNORE: the old key was narrower, so this only matters for stray duplicates
+        conn.execute(f"INSERT OR IGNORE INTO {tmp} ({', '.join(cols)}) SELECT {select} FROM {table}")
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {tmp} RENAME TO {table}')
+
+def _init_table(conn: sqlite3.Connection, table: str):
+    create_keyed_table(conn, table, _SCHEMAS[table])
+
+def init_chats_table(conn: sqlite3.Connection):
+    _init_table(conn, 'chats')
+    # needs_deep_sync is set by quicksync.py and cleared by every full sync
+    ensure_columns(conn, 'chats', {'urgency_base': 'INTEGER', 'unread_count': 'INTEGER', 'needs_deep_sync': 'BOOLEAN'})
+
+def init_opportunities_table(conn: sqlite3.Connection):
+    _init_table(conn, 'opportunities')
+
+def save_chat(conn: sqlite3.Connection, chat: Dict):
+    """Upsert one chat row ({column: value}, including chat_id and account).
+
+    Only the given columns are written. Columns owned by other tools
+    (reply_status from the outbox, quick-sync counters, last_reply_date)
+    keep their values, which INSERT OR REPLACE would reset to NULL.
+    """
+    chat = {**chat, 'account': account_key(chat.get('account'))}
+    cols = list(chat)
+    updates = ', '.join(f'{c} = excluded.{c}' for c in cols if c not in ('chat_id', 'account'))
+    conn.execute(f"INSERT INTO chats ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                 f"ON CONFLICT (chat_id, account) DO UPDATE SET {updates}", list(chat.values()))
+
+def init_messages_table(conn: sqlite3.Connection):
+    _init_table(conn, 'messages')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_reply ON messages (chat_id, reply_to_msg_id)')
+    conn.commit()
+
+def save_messages(conn: sqlite3.Connection, chat_id: int, messages, account: str = None) -> Set[int]:
+    """Upsert Telethon messages into the messages table, keeping reply linkage.
+
+    Returns the ids of the messages that were not stored before.
+    """
+    account = account_key(account)
+    messages = list(messages)
+    ids = [m.id for m in messages]
+    stored = set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        stored.update(r[0] for r in conn.execute(
+            "SELECT message_id FROM messages WHERE chat_id = ? AND account = ? "
+            f"AND message_id IN ({', '.join('?' * len(chunk))})", [chat_id, account, *chunk]))
+    conn.executemany(
+        'INSERT OR REPLACE INTO messages (chat_id, message_id, date, sender_id, text, reply_to_msg_id, is_mention, account) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [(chat_id, m.id, m.date, m.sender_id, m.text, m.reply_to_msg_id, bool(getattr(m, 'mentioned', False)), account)
+         for m in messages])
+    return set(ids) - stored
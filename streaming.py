@@ -0,0 +1,66 @@
+"""
+Streaming chat completions for the dashboards.
+
+st.write_stream() wants a plain iterable, while the OpenAI client is async.
+CompletionStream runs the request on a private event loop and yields each
+text delta as it arrives, so the dashboard shows the first tokens instead
+of waiting for the whole completion. A failure is yielded as a final
+"Error: ..." chunk and also kept on `.error`, so callers can tell a failed
+stream from a finished one before persisting the text.
+"""
+
+import asyncio
+import time
+from typing import Dict, Iterator, List, Optional
+
+MODEL = "gpt-4o"
+
+
+async def _deltas(messages: List[Dict], max_tokens: int, api_key: str, model: str):
+    from openai import AsyncOpenAI
+
+    async with AsyncOpenAI(api_key=api_key) as client:
+        stream = await client.chat.completions.create(
+            model=model, messages=messages, max_tokens=max_tokens, stream=True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class CompletionStream:
+    """One streamed completion; iterate it (once) to receive text deltas."""
+
+    def __init__(self, messages: List[Dict], max_tokens: int, api_key: str, model: str = MODEL):
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.api_key = api_key
+        self.model = model
+        self.error: Optional[str] = None
+        self.first_token: Optional[float] = None  # seconds until the first delta
+        self.text = ""
+
+    def __iter__(self) -> Iterator[str]:
+        if not self.api_key:
+            self.error = "Error: no OpenAI key set"
+            yield self.error
+            return
+        start = time.monotonic()
+        loop = asyncio.new_event_loop()
+        agen = _deltas(self.messages, self.max_tokens, self.api_key, self.model)
+        try:
+            while True:
+                try:
+                    delta = loop.run_until_complete(agen.__anext__())
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    self.error = f"Error: {e}"
+                    yield self.error
+                    break
+                if self.first_token is None:
+                    self.first_token = time.monotonic() - start
+                self.text += delta
+                yield delta
+        finally:
+            loop.run_until_complete(agen.aclose())
+            loop.close()
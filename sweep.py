@@ -0,0 +1,160 @@
+"""
+Opportunity sweep: find service keywords with Telegram's server-side search.
+
+A normal sync downloads recent history from every chat and matches
+detect_service_opportunities() against the newest message only. The sweep
+asks Telegram for the keywords instead. With scope "global" it makes one
+account-wide search (SearchGlobal) per keyword, so thousands of chats cost
+a handful of requests. With scope "dialogs" it searches each dialog
+selected by the dialog policy. Server search matches on word stems, so
+every hit is confirmed locally with the same detect_service_opportunities()
+rules before it is recorded.
+
+Hits and a small window of context around them (as in mentions.py) are
+stored in the messages table. Each confirmed service is recorded in the
+opportunities table. The global scope honours the dialog policy's deny list
+only; the other rules need a dialog list, which is what it avoids fetching.
+
+Settings live under "sweep" in config.json, e.g.
+    {"sweep": {"scope": "global", "days": 7, "limit": 100, "context": 2,
+               "keywords": ["audit", "smart contract", "starknet"]}}
+
+Usage:
+    python sweep.py [--scope global|dialogs] [--days N] [--keywords K ...] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Sequence
+
+from store import account_key, save_messages
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
+# Every keyword detect_service_opportunities() knows, except the catch-all 'finance'
+SWEEP_KEYWORDS = ('audit', 'security', 'smart contract', 'solidity', 'cairo', 'defi',
+                  'blockchain', 'protocol', 'ethereum', 'starknet')
+DEFAULT_SWEEP = {'scope': 'global', 'keywords': list(SWEEP_KEYWORDS), 'days': 7, 'limit': 100, 'context': 2}
+SCOPES = ('global', 'dialogs')
+
+
+def sweep_config(path: str = CONFIG_FILE) -> Dict:
+    cfg = dict(DEFAULT_SWEEP)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                cfg.update(json.load(f).get('sweep', {}))
+        except Exception as e:
+            logging.error(f"Ignoring unreadable sweep settings in {path}: {e}")
+    return cfg
+
+async def _search(client, entity, keyword: str, since: datetime, limit: int) -> List:
+    """Newest-first hits for `keyword` in `entity` (None: the whole account) since `since`."""
+    from telethon.errors import FloodWaitError
+    try:
+        hits = []
+        async for m in client.iter_messages(entity, search=keyword, limit=limit):
+            if m.date < since:
+                break
+            hits.append(m)
+        return hits
+    except FloodWaitError as e:
+        logging.warning(f"Sweep: flood wait {e.seconds}s on '{keyword}', skipping it this run")
+        return []
+
+async def _with_context(client, hits: Sequence, context: int) -> List:
+    """`hits` (all from one chat) plus `context` messages each side and replied-to messages."""
+    ids = set()
+    for m in hits:
+        ids.update(range(max(1, m.id - context), m.id + context + 1))
+        if m.reply_to_msg_id:
+            ids.add(m.reply_to_msg_id)
+    ids -= {m.id for m in hits}
+    extra = await client.get_messages(await hits[0].get_input_chat(), ids=sorted(ids)) if ids else []
+    messages = {m.id: m for m in hits}
+    messages.update((m.id, m) for m in extra if m is not None)
+    return sorted(messages.values(), key=lambda m: m.id, reverse=True)
+
+async def sweep(client, conn: sqlite3.Connection, classify: Callable, detect_services: Callable[[str], List[str]],
+                dialogs: Optional[Sequence] = None, account: Optional[str] = None, cfg: Optional[Dict] = None,
+                deny: Sequence[int] = ()) -> Dict:
+    """Search every keyword, store hits with context and record their services.
+
+    `dialogs` None searches account-wide; otherwise each dialog is searched
+    on its own. Returns counts for the run.
+    """
+    from analysis import message_row
+
+    cfg = {**sweep_config(), **(cfg or {})}
+    since = datetime.now(timezone.utc) - timedelta(days=cfg['days'])
+    found: Dict[tuple, object] = {}
+    searches = 0
+    for keyword in cfg['keywords']:
+        for entity in ([None] if dialogs is None else [d.id for d in dialogs]):
+            searches += 1
+            for m in await _search(client, entity, keyword, since, cfg['limit']):
+                if m.chat_id not in deny and detect_services(m.text):
+                    found[(m.chat_id, m.id)] = m
+
+    by_chat: Dict[int, List] = {}
+    for (chat_id, _), m in found.items():
+        by_chat.setdefault(chat_id, []).append(m)
+    recorded = 0
+    for chat_id, hits in by_chat.items():
+        try:
+            messages = await _with_context(client, hits, cfg['context'])
+        except Exception as e:
+            logging.error(f"Sweep: no context for chat {chat_id}: {e}")
+            messages = sorted(hits, key=lambda m: m.id, reverse=True)
+        save_messages(conn, chat_id, [message_row(m, classify(m)) for m in messages], account)
+        for m in hits:
+            for service in detect_services(m.text):
+                cur = conn.execute('INSERT OR IGNORE INTO opportunities (chat_id, message_id, service, timestamp, account) '
+                                   'VALUES (?, ?, ?, ?, ?)', (chat_id, m.id, service, m.date, account_key(account)))
+                recorded += cur.rowcount
+        conn.commit()
+    result = {'scope': 'global' if dialogs is None else 'dialogs', 'searches': searches, 'hits': len(found),
+              'chats': len(by_chat), 'opportunities': recorded}
+    logging.info(f"Sweep: {result}")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find service opportunities with server-side search')
+    parser.add_argument('--scope', choices=SCOPES, help='account-wide search, or one search per selected dialog')
+    parser.add_argument('--days', type=int, help='only messages this recent')
+    parser.add_argument('--keywords', nargs='+', help='override the configured keywords')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args()
+
+    import tg
+    from telethon import TelegramClient
+    from dialog_policy import DialogPolicy, select_dialogs
+
+    overrides = {k: v for k, v in (('scope', args.scope), ('days', args.days), ('keywords', args.keywords)) if v}
+    cfg = {**sweep_config(), **overrides}
+
+    async def main():
+        client = TelegramClient(tg.SESSION_NAME, tg.API_ID, tg.API_HASH)
+        await client.start()
+        try:
+            tg.init_db()
+            policy = DialogPolicy.from_config()
+            dialogs = await select_dialogs(client, await client.get_dialogs(), policy) if cfg['scope'] == 'dialogs' else None
+            with sqlite3.connect(tg.DB_FILE, timeout=tg.DB_TIMEOUT) as conn:
+                return await sweep(client, conn, tg.classify_message_type, tg.detect_service_opportunities,
+                                   dialogs, cfg=cfg, deny=policy.deny)
+        finally:
+            await client.disconnect()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    result = asyncio.run(main())
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"{result['searches']} searches, {result['hits']} matching messages in {result['chats']} chats, "
+              f"{result['opportunities']} new opportunities")
@@ -1,22 +1,25 @@
+from __future__ import annotations
+
 import asyncio
 import os
-import pandas as pd
-from telethon import TelegramClient
-from telethon.tl.custom.message import Message
-from telethon.errors import FloodWaitError
 from datetime import datetime, timedelta
-from openai import AsyncOpenAI
-from telethon.tl.types import MessageMediaEmpty
-from langdetect import detect
-from typing import List, Dict, Tuple
-import aiofiles
+from typing import TYPE_CHECKING, Iterable, List, Dict, Set, Tuple
 import re
 import sqlite3
 import logging
 import time
+import changelog
+from store import init_chats_table, init_messages_table, init_opportunities_table, save_chat, save_messages
+from urgency import current_urgency
+
+# pandas, telethon, openai, langdetect and the numpy-backed index are imported
+# where they are used, so importing this module stays cheap.
+if TYPE_CHECKING:
+    from telethon.tl.custom.message import Message
+    from analysis import MessageRow
 
 # === Configuration ===
-API_ID = int(os.getenv('API_ID'))
+API_ID = int(os.getenv('API_ID') or 0)
 API_HASH = os.getenv('API_HASH')    
 PHONE = os.getenv('phone')
 SESSION_NAME = os.getenv('SESSION_NAME', 'session')
@@ -30,43 +33,39 @@ SERVICE_KEYWORDS = {'blockchain', 'security', 'audit', 'smart contract', 'defi',
 FOLLOWUP_KEYWORDS = {'follow up', 'next steps', 'meeting', 'call', 'discuss'}
 KNOWN_CONTACTS = {123456, 789012}  # Example sender IDs
 MAX_RETRIES = 3
+FETCH_MODE = os.getenv('TG_FETCH_MODE', 'recent')  # 'unread', 'recent' or 'mentions'
 BASE_WAIT = 5
 
 # === Setup ===
-os.makedirs(MESSAGE_DIR, exist_ok=True)
-client_ai = AsyncOpenAI(api_key=OPENAI_API_KEY)
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+client_ai = None
+
+def get_ai_client():
+    """Create the OpenAI client on first use."""
+    global client_ai
+    if client_ai is None:
+        from openai import AsyncOpenAI
+        client_ai = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return client_ai
 
 # === Database ===
 def init_db():
     with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS chats (
-            chat_id INTEGER PRIMARY KEY,
-            name TEXT,
-            is_group BOOLEAN,
-            last_message_date DATETIME,
-            urgency_score INTEGER,
-            needs_followup BOOLEAN,
-            last_reply_date DATETIME
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS opportunities (
-            chat_id INTEGER,
-            message_id INTEGER,
-            service TEXT,
-            timestamp DATETIME,
-            PRIMARY KEY (chat_id, message_id)
-        )''')
-        conn.commit()
+        init_chats_table(conn)
+        init_opportunities_table(conn)
+        init_messages_table(conn)
+        changelog.init_tables(conn)
 
 # === Utilities ===
 def detect_language(text: str) -> str:
+    from langdetect import detect
     try:
         return detect(text)
     except:
         return "unknown"
 
 def classify_message_type(msg: Message) -> str:
+    from telethon.tl.types import MessageMediaEmpty
     if msg.media and not isinstance(msg.media, MessageMediaEmpty):
         return "media"
     if msg.voice:
@@ -83,17 +82,19 @@ def classify_message_type(msg: Message) -> str:
         return "text"
     return "other"
 
-def calculate_urgency(message: Message, is_group: bool) -> int:
+def calculate_urgency_base(message: Message, is_group: bool) -> int:
+    """Time-independent part of the urgency score; recency is added at read time."""
     score = 0
     text = message.text.lower() if message.text else ''
     if any(kw in text for kw in URGENT_KEYWORDS):
         score += 40
     if message.sender_id in KNOWN_CONTACTS:
         score += 20
-    time_diff = (datetime.now(message.date.tzinfo) - message.date).total_seconds() / 60
-    score += max(0, 30 - int(time_diff / 10))
     score += 10 if is_group else 0
-    return min(100, score)
+    return score
+
+def calculate_urgency(message: Message, is_group: bool) -> int:
+    return current_urgency(calculate_urgency_base(message, is_group), message.date)
 
 def detect_service_opportunities(text: str) -> List[str]:
     text = text.lower() if text else ''
@@ -116,18 +117,44 @@ def needs_followup(text: str, last_reply_date: datetime) -> bool:
         return True
     return False
 
+def analyze_dialog(rows: List, is_group: bool, last_reply_date: datetime) -> Dict:
+    """CPU-bound analysis of one dialog's MessageRows (newest first); runs in the analysis pool."""
+    from analysis import message_features
+    last = rows[0]
+    return {
+        'language': detect_language(last.text or ""),
+        'urgency_base': calculate_urgency_base(last, is_group),
+        'services': detect_service_opportunities(last.text),
+        'needs_followup': needs_followup(last.text, last_reply_date),
+        **message_features(rows),
+    }
+
 # === AI Summarization ===
-async def generate_ai_summary(messages: List[Message], services: List[str]) -> str:
+async def sender_names(messages: Iterable[Message]) -> Dict[int, str]:
+    """{sender_id: username or User_<id>}, one sender lookup per sender rather than per message."""
+    names = {}
+    for msg in messages:
+        if msg.sender_id not in names:
+            sender = await msg.get_sender()
+            names[msg.sender_id] = getattr(sender, 'username', None) or f"User_{sender.id if sender else 'Unknown'}"
+    return names
+
+async def generate_ai_summary(messages: List[MessageRow], services: List[str],
+                              clusters: Dict[int, Tuple[int, bool]] = None, crossposted: Set[int] = frozenset(),
+                              names: Dict[int, str] = None) -> str:
+    from dedup import collapse
     service_context = f"Nethermind offers: {', '.join(services)}" if services else "Nethermind offers blockchain solutions."
     message_texts = []
-    user_map = {}
-    for msg in messages:
-        sender = await msg.get_sender()
-        sender_id = sender.id if sender else "Unknown"
-        sender_username = getattr(sender, 'username', None) or f"User_{sender_id}"
-        user_map[sender_id] = sender_username
+    names = names or {}
+    # Repeated copies of the same text go into the prompt once
+    for msg, copies, elsewhere in collapse(messages, clusters or {}, crossposted):
+        sender_username = names.get(msg.sender_id) or f"User_{msg.sender_id or 'Unknown'}"
         date_str = msg.date.strftime('%Y-%m-%d %H:%M:%S')
-        text = msg.text or f"[{classify_message_type(msg)} message]"
+        text = msg.text or f"[{msg.type} message]"
+        if copies > 1:
+            text += f" [posted {copies}x]"
+        if elsewhere:
+            text += " [crossposted from another chat]"
         message_texts.append(f"[{date_str}] {sender_username}: {text}")
     
     prompt = (
@@ -137,7 +164,7 @@ async def generate_ai_summary(messages: List[Message], services: List[str]) -> s
     )
     
     try:
-        response = await client_ai.chat.completions.create(
+        response = await get_ai_client().chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are a professional summarizer for Nethermind's Business Development team. Provide a concise summary of the conversation, highlighting key dates, places, reminders, and follow-up items. Tag each participating user by their username."},
@@ -150,24 +177,46 @@ async def generate_ai_summary(messages: List[Message], services: List[str]) -> s
         return f"Error: {e}"
 
 # === File Writer ===
-async def write_messages_to_file(filename: str, messages: List[Message], unread_count: int, urgency_score: int):
+async def write_messages_to_file(filename: str, messages: List[MessageRow], unread_count: int, urgency_score: int,
+                                 clusters: Dict[int, Tuple[int, bool]] = None, crossposted: Set[int] = frozenset()):
+    import aiofiles
+    from dedup import collapse
     async with aiofiles.open(filename, 'w', encoding='utf-8') as f:
         await f.write(f"Unread: {unread_count}, Urgency: {urgency_score}\n\n")
-        for msg in messages:
+        for msg, copies, elsewhere in collapse(messages, clusters or {}, crossposted):
             date_str = msg.date.strftime('%Y-%m-%d %H:%M:%S')
             sender_id = msg.sender_id or "Unknown"
-            text = msg.text or f"[{classify_message_type(msg)} message]"
+            text = msg.text or f"[{msg.type} message]"
+            if copies > 1:
+                text += f" (x{copies})"
+            if elsewhere:
+                text += f" [crossposted, cluster {clusters[msg.id][0]}]"
             await f.write(f"[{date_str}] {sender_id}: {text}\n")
 
 # === Main Fetching Function ===
 async def fetch_data() -> Tuple[int, int, List[Dict]]:
+    from telethon import TelegramClient
+    from telethon.errors import FloodWaitError
+    from analysis import AnalysisPool, message_row
+    from dedup import DuplicateDetector, only_duplicates
+    from dialog_policy import select_dialogs
+    from maintenance import run_if_due as run_maintenance
+    from rollups import add as add_activity, bucketize, downsample, new_messages
+    from rollups import init_tables as init_rollup_tables
+    from mentions import fetch_mention_messages, history_limit
+    from pipeline import Pipeline
+    from search_index import VectorIndex, SUMMARY_MESSAGE_ID
+
+    if not (API_ID and API_HASH):
+        raise RuntimeError("Set API_ID and API_HASH before fetching")
+    os.makedirs(MESSAGE_DIR, exist_ok=True)
     client = TelegramClient('session', API_ID, API_HASH)
     try:
         await client.connect()
         if not await client.is_user_authorized():
             print("Session not authorized. Please run Authentication.py first to set up the session.")
             return 0, 0, []
-        dialogs = await client.get_dialogs()
+        dialogs = await select_dialogs(client, await client.get_dialogs())
     except Exception as e:
         logging.error(f"Failed to start client or fetch dialogs: {e}")
         return 0, 0, []
@@ -176,41 +225,47 @@ async def fetch_data() -> Tuple[int, int, List[Dict]]:
     group_unread = 0
 
     init_db()
+    search_index = VectorIndex()
+    pool = AnalysisPool()
     with sqlite3.connect(DB_FILE) as conn:
         c = conn.cursor()
+        detector = DuplicateDetector(conn)
+        init_rollup_tables(conn)
 
-        async def process_dialog(dialog):
-            nonlocal private_unread, group_unread
+        # Each dialog travels through the stages below as one `job` dict;
+        # see pipeline.py for how they are connected.
+        async def fetch(dialog):
             name = dialog.name or "Unknown"
-            chat_id = dialog.id
-            unread_count = dialog.unread_count or 0
-            is_group = dialog.is_group or dialog.is_channel
-
-            logging.info(f"Processing dialog: {name}, Is Group: {is_group}, Unread: {unread_count}")
+            job = {'name': name, 'chat_id': dialog.id, 'unread_count': dialog.unread_count or 0,
+                   'is_group': dialog.is_group or dialog.is_channel, 'messages': [], 'names': {}, 'sender': None}
+            logging.info(f"Processing dialog: {name}, Is Group: {job['is_group']}, Unread: {job['unread_count']}")
 
-            c.execute('SELECT last_reply_date FROM chats WHERE chat_id = ?', (chat_id,))
-            result = c.fetchone()
-            last_reply_date = None
-            if result and result[0]:
-                try:
-                    last_reply_date = datetime.fromisoformat(result[0])
-                except (ValueError, TypeError):
-                    logging.warning(f"Invalid last_reply_date format for {name}: {result[0]}")
-                    last_reply_date = None
-
-            safe_name = re.sub(r'[^\w]', '_', name)
-            filepath = os.path.join(MESSAGE_DIR, f"{chat_id}_{safe_name}.txt")
-
-            messages = []
+            # Messages become MessageRows (classified once) as they arrive; one Telethon
+            # object per sender is kept until the sender names are looked up
             retries = 0
-            message_limit = 100  # Retrieve past 100 messages
+            message_limit = history_limit(FETCH_MODE, dialog)
             while retries < MAX_RETRIES:
+                messages, by_sender = [], {}
+
+                def add(message):
+                    row = message_row(message, classify_message_type(message))
+                    messages.append(row)
+                    by_sender.setdefault(row.sender_id, message)
+                    logging.info(f"Message in {name}: Type={row.type}, Text={row.text or 'None'}")
+
                 try:
-                    logging.info(f"Fetching {message_limit} messages from {name}")
-                    async for message in client.iter_messages(dialog.id, limit=message_limit):
-                        messages.append(message)
-                        logging.info(f"Message in {name}: Type={classify_message_type(message)}, Text={message.text or 'None'}")
+                    if FETCH_MODE == 'mentions':
+                        for message in await fetch_mention_messages(client, dialog):
+                            add(message)
+                    else:
+                        logging.info(f"Fetching {message_limit} messages from {name}")
+                        async for message in client.iter_messages(dialog.id, limit=message_limit):
+                            add(message)
                     logging.info(f"Fetched {len(messages)} messages from {name}")
+                    if messages:
+                        job['names'] = await sender_names(by_sender.values())
+                        job['sender'] = await by_sender[messages[0].sender_id].get_sender()
+                    job['messages'] = messages
                     break
                 except FloodWaitError as e:
                     wait_time = min(e.seconds, 30) * (2 ** retries)
@@ -220,85 +275,135 @@ async def fetch_data() -> Tuple[int, int, List[Dict]]:
                 except Exception as e:
                     logging.error(f"Error fetching messages for {name}: {e}")
                     break
+            return job
 
+        async def analyze(job):
+            nonlocal private_unread, group_unread
+            name, chat_id, messages, is_group = job['name'], job['chat_id'], job['messages'], job['is_group']
             if is_group:
-                group_unread += unread_count
+                group_unread += job['unread_count']
             else:
-                private_unread += unread_count
-
-            urgency_score = 0
-            services = []
-            needs_followup_flag = False
-            last_message_text = "No messages"
-            last_message_type = "None"
-            language = "unknown"
-            ai_summary = "N/A"
-            first_message_date = None
-            last_unread_date = None
-            sender_id = "None"
-            sender_username = "None"
-            sender_name = "None"
+                private_unread += job['unread_count']
 
+            c.execute("SELECT last_reply_date FROM chats WHERE chat_id = ? AND account = ''", (chat_id,))
+            result = c.fetchone()
+            last_reply_date = None
+            if result and result[0]:
+                try:
+                    last_reply_date = datetime.fromisoformat(result[0])
+                except (ValueError, TypeError):
+                    logging.warning(f"Invalid last_reply_date format for {name}: {result[0]}")
+                    last_reply_date = None
+
+            job.update(urgency_score=0, urgency_base=0, services=[], needs_followup=False,
+                       last_message_type="None", language="unknown", ai_summary="N/A",
+                       first_message_date=None, last_unread_date=None, duplicate_count=0, clusters={},
+                       crossposted=set(), new_ids=set())
+            if not messages:
+                return job
+
+            # Language detection, scoring, MinHash and embeddings run in the pool, so
+            # fetch and summarize keep moving; no await between a write and its commit
+            analysis = await pool.submit(analyze_dialog, messages, is_group, last_reply_date)
+            fresh = new_messages(conn, chat_id, messages)
+            buckets = await pool.submit(bucketize, fresh, detect_language) if fresh else None
+            job['new_ids'] = save_messages(conn, chat_id, messages)
+            if fresh:
+                add_activity(conn, chat_id, buckets, max(r.id for r in fresh), min(r.id for r in fresh))
+            clusters = detector.check_many(chat_id, messages, analysis['signatures'])
+            crossposted = detector.crossposted(chat_id, clusters)
+            conn.commit()
+            last_message = messages[0]
+            urgency_base = analysis['urgency_base']
+            job.update(
+                vectors=analysis['vectors'],
+                clusters=clusters,
+                crossposted=crossposted,
+                duplicate_count=sum(dup for _, dup in clusters.values()),
+                first_message_date=messages[-1].date,
+                last_unread_date=last_message.date,
+                last_message_type=last_message.type,
+                language=analysis['language'],
+                urgency_base=urgency_base,
+                urgency_score=current_urgency(urgency_base, last_message.date),
+                services=analysis['services'],
+                needs_followup=analysis['needs_followup'],
+            )
+            return job
+
+        async def summarize(job):
+            messages, clusters = job['messages'], job['clusters']
+            if not messages:
+                return job
+            if only_duplicates(clusters, job['new_ids']):
+                job['ai_summary'] = "Skipped: only crossposted/duplicate messages"
+            else:
+                job['ai_summary'] = await generate_ai_summary(messages, job['services'], clusters, job['crossposted'],
+                                                              job['names'])
+            return job
+
+        async def persist(job):
+            name, chat_id, messages = job['name'], job['chat_id'], job['messages']
+            sender_id = sender_username = sender_name = "None"
             if messages:
-                first_message = messages[-1]
-                last_message = messages[0]
-                first_message_date = first_message.date
-                last_unread_date = last_message.date
-                last_message_text = last_message.text or f"[{classify_message_type(last_message)} message]"
-                last_message_type = classify_message_type(last_message)
-                language = detect_language(last_message.text or "")
-                urgency_score = calculate_urgency(last_message, is_group)
-                services = detect_service_opportunities(last_message.text)
-                needs_followup_flag = needs_followup(last_message.text, last_reply_date)
-                ai_summary = await generate_ai_summary(messages, services)
-
-                sender = await last_message.get_sender()
+                sender = job.get('sender')
                 sender_id = sender.id if sender else "Unknown"
                 sender_username = getattr(sender, 'username', None) or "None"
                 sender_name = getattr(sender, 'first_name', 'Unknown')
 
-                if services:
-                    for service in services:
-                        c.execute('INSERT OR IGNORE INTO opportunities (chat_id, message_id, service, timestamp) VALUES (?, ?, ?, ?)',
-                                  (chat_id, last_message.id, service, last_unread_date))
-
-                await write_messages_to_file(filepath, messages, unread_count, urgency_score)
+                safe_name = re.sub(r'[^\w]', '_', name)
+                filepath = os.path.join(MESSAGE_DIR, f"{chat_id}_{safe_name}.txt")
+                await write_messages_to_file(filepath, messages, job['unread_count'], job['urgency_score'], job['clusters'],
+                                             job['crossposted'])
+                keep = [i for i, msg in enumerate(messages) if not job['clusters'].get(msg.id, (None, False))[1]]
+                search_index.add([(chat_id, messages[i].id, messages[i].text) for i in keep], job['vectors'][keep])
+                if not job['ai_summary'].startswith(("Error", "Skipped")):
+                    search_index.add([(chat_id, SUMMARY_MESSAGE_ID, job['ai_summary'])])
             else:
-                logging.warning(f"No messages fetched for {name}, unread count: {unread_count}")
+                logging.warning(f"No messages fetched for {name}, unread count: {job['unread_count']}")
 
-            c.execute('INSERT OR REPLACE INTO chats (chat_id, name, is_group, last_message_date, urgency_score, needs_followup) VALUES (?, ?, ?, ?, ?, ?)',
-                      (chat_id, name, is_group, last_unread_date, urgency_score, needs_followup_flag))
-            conn.commit()
+            first_message_date, last_unread_date = job['first_message_date'], job['last_unread_date']
+            # One transaction with no await inside: the other stages commit on the same connection
+            with conn:
+                for service in job['services']:
+                    c.execute('INSERT OR IGNORE INTO opportunities (chat_id, message_id, service, timestamp) VALUES (?, ?, ?, ?)',
+                              (chat_id, messages[0].id, service, last_unread_date))
+                if messages and not job['ai_summary'].startswith(("Error", "Skipped")):
+                    changelog.record(conn, 'summary', chat_id, {'summary': job['ai_summary'], 'source': 'sync'})
+                save_chat(conn, {'chat_id': chat_id, 'name': name, 'is_group': job['is_group'],
+                                 'last_message_date': last_unread_date, 'urgency_score': job['urgency_score'],
+                                 'urgency_base': job['urgency_base'], 'needs_followup': job['needs_followup'],
+                                 'needs_deep_sync': False})
+            logging.info(f"Successfully processed dialog: {name}")
 
             return {
                 "Chat Name": name,
                 "Chat ID": chat_id,
-                "Is Group": is_group,
-                "Unread Count": unread_count,
-                "Urgency Score": urgency_score,
-                "Needs Followup": needs_followup_flag,
-                "Service Opportunities": ", ".join(services) if services else "None",
+                "Is Group": job['is_group'],
+                "Unread Count": job['unread_count'],
+                "Urgency Score": job['urgency_score'],
+                "Urgency Base": job['urgency_base'],
+                "Needs Followup": job['needs_followup'],
+                "Service Opportunities": ", ".join(job['services']) if job['services'] else "None",
                 "First Message Date": first_message_date,
                 "Last Unread Message Date": last_unread_date,
                 "Duration Unread (min)": (last_unread_date - first_message_date).total_seconds() / 60 if messages else 0,
                 "Last Sender ID": sender_id,
                 "Last Sender Username": sender_username,
                 "Last Sender Name": sender_name,
-                "Last Message Type": last_message_type,
-                "Language": language,
-                "Summary": ai_summary
+                "Last Message Type": job['last_message_type'],
+                "Language": job['language'],
+                "Duplicate Messages": job['duplicate_count'],
+                "Summary": job['ai_summary']
             }
 
-        log = []
-        for dialog in dialogs:
-            try:
-                result = await process_dialog(dialog)
-                if result:
-                    log.append(result)
-                    logging.info(f"Successfully processed dialog: {dialog.name}")
-            except Exception as e:
-                logging.error(f"Failed to process dialog {dialog.name}: {e}")
-                continue
+        sync = Pipeline.from_config({'fetch': fetch, 'analyze': analyze, 'summarize': summarize, 'persist': persist})
+        log = await sync.run(dialogs)
+        logging.info(f"Pipeline stats: {sync.stats()}")
+        logging.info(f"Analysis pool: {pool.stats()}")
+        pool.shutdown()
+        downsample(conn)
+        run_maintenance(conn)
 
         try:
             await client.disconnect()
@@ -311,6 +416,7 @@ def export_to_csv(log: List[Dict], filename: str):
     if not log:
         logging.warning("No data to export")
         return
+    import pandas as pd
     df = pd.DataFrame(log)
     df.to_csv(filename, index=False)
     logging.info(f"Exported {len(df)} records to {filename}")
@@ -1,23 +1,27 @@
+from __future__ import annotations
+
 import asyncio
 import os
-import pandas as pd
-from telethon import TelegramClient
-from telethon.tl.custom.message import Message
-from telethon.errors import FloodWaitError
 from datetime import datetime, timedelta
-from openai import AsyncOpenAI
-from telethon.tl.types import MessageMediaEmpty
-from langdetect import detect
-from typing import List, Dict, Tuple
-import aiofiles
+from typing import TYPE_CHECKING, List, Dict, Set, Tuple
 import re
 import sqlite3
 import logging
 import time
 import json
+import changelog
+from store import account_key, init_chats_table, init_messages_table, init_opportunities_table, save_chat, save_messages
+from urgency import current_urgency
+
+# Heavy dependencies (pandas, telethon, openai, langdetect, numpy) are imported
+# inside the functions that need them, so `import tg` stays cheap for tools
+# that only want the helpers or constants.
+if TYPE_CHECKING:
+    from telethon.tl.custom.message import Message
+    from analysis import MessageRow
 
 # === Configuration ===
-API_ID = int(os.getenv('TG_API_ID'))
+API_ID = int(os.getenv('TG_API_ID') or 0)
 API_HASH = os.getenv('TG_API_HASH')
 PHONE = os.getenv('TG_PHONE')
 SESSION_NAME = os.getenv('TG_SESSION_NAME')
@@ -35,53 +39,52 @@ def _load_openai_key() -> str:
             pass
     return os.getenv('OPENAI_API_KEY', '')
 
-OPENAI_API_KEY = _load_openai_key()
 CSV_FILE = 'tg_detailed_5905.csv'
 MESSAGE_DIR = './messages'
 DB_FILE = 'telegram.db'
+DB_TIMEOUT = 30
 MAX_TOKENS = 150
 URGENT_KEYWORDS = {'urgent', 'asap', 'deadline', 'proposal', 'contract', 'deal'}
 SERVICE_KEYWORDS = {'blockchain', 'security', 'audit', 'smart contract', 'defi', 'ethereum', 'starknet', 'protocol'}
 FOLLOWUP_KEYWORDS = {'follow up', 'next steps', 'meeting', 'call', 'discuss'}
 KNOWN_CONTACTS = {123456, 789012}  # Example sender IDs
 MAX_RETRIES = 3
+FETCH_MODE = os.getenv('TG_FETCH_MODE', 'unread')  # 'unread', 'recent' or 'mentions'
 BASE_WAIT = 5
 
 # === Setup ===
-os.makedirs(MESSAGE_DIR, exist_ok=True)
-client_ai = AsyncOpenAI(api_key=OPENAI_API_KEY)
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+client_ai = None
+
+def get_ai_client():
+    """Create the OpenAI client on first use."""
+    global client_ai
+    if client_ai is None:
+        from openai import AsyncOpenAI
+        client_ai = AsyncOpenAI(api_key=_load_openai_key())
+    return client_ai
 
 # === Database ===
 def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS chats (
-            chat_id INTEGER PRIMARY KEY,
-            name TEXT,
-            is_group BOOLEAN,
-            last_message_date DATETIME,
-            urgency_score INTEGER,
-            needs_followup BOOLEAN,
-            last_reply_date DATETIME
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS opportunities (
-            chat_id INTEGER,
-            message_id INTEGER,
-            service TEXT,
-            timestamp DATETIME,
-            PRIMARY KEY (chat_id, message_id)
-        )''')
-        conn.commit()
+    with sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT) as conn:
+        # WAL lets several account workers write to the same file
+        conn.execute('PRAGMA journal_mode=WAL')
+        # chats, opportunities and messages are keyed by account too; see store.py
+        init_chats_table(conn)
+        init_opportunities_table(conn)
+        init_messages_table(conn)
+        changelog.init_tables(conn)
 
 # === Utilities ===
 def detect_language(text: str) -> str:
+    from langdetect import detect
     try:
         return detect(text)
     except:
         return "unknown"
 
 def classify_message_type(msg: Message) -> str:
+    from telethon.tl.types import MessageMediaEmpty
     if msg.media and not isinstance(msg.media, MessageMediaEmpty):
         return "media"
     if msg.voice:
@@ -98,17 +101,19 @@ def classify_message_type(msg: Message) -> str:
         return "text"
     return "other"
 
-def calculate_urgency(message: Message, is_group: bool) -> int:
+def calculate_urgency_base(message: Message, is_group: bool) -> int:
+    """Time-independent part of the urgency score; recency is added at read time."""
     score = 0
     text = message.text.lower() if message.text else ''
     if any(kw in text for kw in URGENT_KEYWORDS):
         score += 40
     if message.sender_id in KNOWN_CONTACTS:
         score += 20
-    time_diff = (datetime.now(message.date.tzinfo) - message.date).total_seconds() / 60
-    score += max(0, 30 - int(time_diff / 10))
     score += 10 if is_group else 0
-    return min(100, score)
+    return score
+
+def calculate_urgency(message: Message, is_group: bool) -> int:
+    return current_urgency(calculate_urgency_base(message, is_group), message.date)
 
 def detect_service_opportunities(text: str) -> List[str]:
     text = text.lower() if text else ''
@@ -131,16 +136,33 @@ def needs_followup(text: str, last_reply_date: datetime) -> bool:
         return True
     return False
 
+def analyze_dialog(rows: List, is_group: bool, last_reply_date: datetime) -> Dict:
+    """CPU-bound analysis of one dialog's MessageRows (newest first); runs in the analysis pool."""
+    from analysis import message_features
+    last = rows[0]
+    return {
+        'last_message_text': last.text or f"[{last.type} message]",
+        'language': detect_language(last.text or ""),
+        'urgency_base': calculate_urgency_base(last, is_group),
+        'services': detect_service_opportunities(last.text),
+        'needs_followup': needs_followup(last.text, last_reply_date),
+        **message_features(rows),
+    }
+
 # === AI Completion ===
-async def generate_ai_reply(prompt: str, services: List[str]) -> str:
+def reply_messages(prompt: str, services: List[str]) -> List[Dict]:
+    """Chat messages for a reply suggestion; shared by the batch and streaming paths."""
     service_context = f"Nethermind offers: {', '.join(services)}" if services else "Nethermind offers blockchain solutions."
+    return [
+        {"role": "system", "content": f"You are a professional Telegram user representing Nethermind's Business Development team. Reply concisely, aligning with Nethermind's expertise in Ethereum, Starknet, security audits, smart contract development, and DeFi. Suggest relevant services: {service_context}. Encourage follow-ups with Cristiano Silva (Head of Security) or Jose L. Zamanaro (Senior BD Consultant) when appropriate."},
+        {"role": "user", "content": prompt}
+    ]
+
+async def generate_ai_reply(prompt: str, services: List[str], client=None) -> str:
     try:
-        response = await client_ai.chat.completions.create(
+        response = await (client or get_ai_client()).chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": f"You are a professional Telegram user representing Nethermind's Business Development team. Reply concisely, aligning with Nethermind's expertise in Ethereum, Starknet, security audits, smart contract development, and DeFi. Suggest relevant services: {service_context}. Encourage follow-ups with Cristiano Silva (Head of Security) or Jose L. Zamanaro (Senior BD Consultant) when appropriate."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=reply_messages(prompt, services),
             max_tokens=MAX_TOKENS
         )
         return response.choices[0].message.content.strip()
@@ -148,21 +170,46 @@ async def generate_ai_reply(prompt: str, services: List[str]) -> str:
         return f"Error: {e}"
 
 # === File Writer ===
-async def write_messages_to_file(filename: str, messages: List[Message], unread_count: int, urgency_score: int):
+async def write_messages_to_file(filename: str, messages: List[MessageRow], unread_count: int, urgency_score: int,
+                                 clusters: Dict[int, Tuple[int, bool]] = None, crossposted: Set[int] = frozenset()):
+    import aiofiles
+    from dedup import collapse
     async with aiofiles.open(filename, 'w', encoding='utf-8') as f:
         await f.write(f"Unread: {unread_count}, Urgency: {urgency_score}\n\n")
-        for msg in messages:
+        for msg, copies, elsewhere in collapse(messages, clusters or {}, crossposted):
             date_str = msg.date.strftime('%Y-%m-%d %H:%M:%S')
             sender_id = msg.sender_id or "Unknown"
-            text = msg.text or f"[{classify_message_type(msg)} message]"
+            text = msg.text or f"[{msg.type} message]"
+            if copies > 1:
+                text += f" (x{copies})"
+            if elsewhere:
+                text += f" [crossposted, cluster {clusters[msg.id][0]}]"
             await f.write(f"[{date_str}] {sender_id}: {text}\n")
 
 # === Main Fetching Function ===
-async def fetch_data() -> Tuple[int, int, List[Dict]]:
-    client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+async def fetch_data(session_name: str = SESSION_NAME, account: str = None,
+                     api_id: int = API_ID, api_hash: str = API_HASH) -> Tuple[int, int, List[Dict]]:
+    from telethon import TelegramClient
+    from telethon.errors import FloodWaitError
+    from analysis import AnalysisPool, message_row
+    from dedup import DuplicateDetector, only_duplicates
+    from dialog_policy import select_dialogs
+    from maintenance import run_if_due as run_maintenance
+    from mentions import fetch_mention_messages, history_limit
+    from pipeline import Pipeline
+    from replies import ReplyPolicy, cached_reply, save_reply
+    from replies import init_tables as init_reply_tables
+    from rollups import add as add_activity, bucketize, downsample, new_messages
+    from rollups import init_tables as init_rollup_tables
+    from search_index import VectorIndex, index_path
+
+    if not (api_id and api_hash and session_name):
+        raise RuntimeError("Set TG_API_ID, TG_API_HASH and TG_SESSION_NAME before fetching")
+    os.makedirs(MESSAGE_DIR, exist_ok=True)
+    client = TelegramClient(session_name, api_id, api_hash)
     try:
         await client.start()
-        dialogs = await client.get_dialogs()
+        dialogs = await select_dialogs(client, await client.get_dialogs())
     except Exception as e:
         logging.error(f"Failed to start client or fetch dialogs: {e}")
         return 0, 0, []
@@ -172,32 +219,47 @@ async def fetch_data() -> Tuple[int, int, List[Dict]]:
     log = []
 
     init_db()
-    with sqlite3.connect(DB_FILE) as conn:
+    account = account_key(account)
+    search_index = VectorIndex(index_path(account))
+    pool = AnalysisPool()
+    with sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT) as conn:
         c = conn.cursor()
-
-        async def process_dialog(dialog):
-            nonlocal private_unread, group_unread
+        detector = DuplicateDetector(conn, account)
+        init_reply_tables(conn)
+        init_rollup_tables(conn)
+        # Replies for everything else are generated when opened in the dashboard
+        reply_policy = ReplyPolicy.from_config()
+
+        # Each dialog travels through the stages below as one `job` dict;
+        # see pipeline.py for how they are connected.
+        async def fetch(dialog):
             name = dialog.name or "Unknown"
-            chat_id = dialog.id
             unread_count = dialog.unread_count or 0
-            is_group = dialog.is_group or dialog.is_channel
-
-            logging.info(f"Processing dialog: {name}, Is Group: {is_group}, Unread: {unread_count}")
-
-            c.execute('SELECT last_reply_date FROM chats WHERE chat_id = ?', (chat_id,))
-            last_reply_date = c.fetchone()
-            last_reply_date = datetime.fromisoformat(last_reply_date[0]) if last_reply_date else None
-
-            safe_name = re.sub(r'[^\w]', '_', name)
-            filepath = os.path.join(MESSAGE_DIR, f"{chat_id}_{safe_name}.txt")
+            job = {'name': name, 'chat_id': dialog.id, 'unread_count': unread_count,
+                   'is_group': dialog.is_group or dialog.is_channel,
+                   'is_broadcast': dialog.is_channel and not dialog.is_group, 'sender': None}
+            logging.info(f"Processing dialog: {name}, Is Group: {job['is_group']}, Unread: {unread_count}")
 
+            # Each message is reduced to a MessageRow as it arrives; only the newest
+            # Telethon object is kept, for the sender lookup below
             messages = []
+            newest = None
             retries = 0
             while retries < MAX_RETRIES:
                 try:
-                    async for message in client.iter_messages(dialog.id, limit=unread_count):
-                        messages.append(message)
-                        logging.debug(f"Message in {name}: Type={classify_message_type(message)}, Text={message.text or 'None'}")
+                    if FETCH_MODE == 'mentions':
+                        fetched = await fetch_mention_messages(client, dialog)
+                        newest = fetched[0] if fetched else None
+                        messages = [message_row(m, classify_message_type(m)) for m in fetched]
+                        del fetched
+                        logging.debug(f"Fetched {len(messages)} mention/context messages from {name}")
+                        break
+                    async for message in client.iter_messages(dialog.id, limit=history_limit(FETCH_MODE, dialog)):
+                        if newest is None:
+                            newest = message
+                        row = message_row(message, classify_message_type(message))
+                        messages.append(row)
+                        logging.debug(f"Message in {name}: Type={row.type}, Text={row.text or 'None'}")
                     break
                 except FloodWaitError as e:
                     wait_time = min(e.seconds, 30) * (2 ** retries)
@@ -208,78 +270,141 @@ async def fetch_data() -> Tuple[int, int, List[Dict]]:
                     logging.error(f"Error fetching messages for {name}: {e}")
                     break
 
+            if messages:
+                job['sender'] = await newest.get_sender()
+            job['messages'] = messages
+            return job
+
+        async def analyze(job):
+            nonlocal private_unread, group_unread
+            chat_id, messages, is_group = job['chat_id'], job['messages'], job['is_group']
             if is_group:
-                group_unread += unread_count
+                group_unread += job['unread_count']
             else:
-                private_unread += unread_count
-
-            urgency_score = 0
-            services = []
-            needs_followup_flag = False
-            last_message_text = "No messages"
-            last_message_type = "None"
-            language = "unknown"
-            ai_reply = "N/A"
-            first_message_date = None
-            last_unread_date = None
-            sender_id = "None"
-            sender_username = "None"
-            sender_name = "None"
+                private_unread += job['unread_count']
+
+            job.update(urgency_score=0, urgency_base=0, services=[], needs_followup=False,
+                       last_message_text="No messages", last_message_type="None", language="unknown",
+                       ai_reply=None, last_message_id=None, first_message_date=None,
+                       last_unread_date=None, duplicate_count=0, clusters={}, crossposted=set(), new_ids=set())
+            if not messages:
+                return job
 
+            c.execute('SELECT last_reply_date FROM chats WHERE chat_id = ? AND account = ?', (chat_id, account))
+            last_reply_date = c.fetchone()
+            last_reply_date = datetime.fromisoformat(last_reply_date[0]) if last_reply_date and last_reply_date[0] else None
+
+            analysis = await pool.submit(analyze_dialog, messages, is_group, last_reply_date)
+            logging.debug(f"Analysis pool after {job['name']}: {pool.stats()}")
+
+            # The stages share `conn`: no await between a write and its commit, or another
+            # stage's commit/rollback would take it along
+            fresh = new_messages(conn, chat_id, messages, account)
+            buckets = await pool.submit(bucketize, fresh, detect_language) if fresh else None
+            job['new_ids'] = save_messages(conn, chat_id, messages, account)
+            if fresh:
+                add_activity(conn, chat_id, buckets, max(r.id for r in fresh), min(r.id for r in fresh), account)
+            clusters = detector.check_many(chat_id, messages, analysis['signatures'])
+            crossposted = detector.crossposted(chat_id, clusters)
+            conn.commit()  # don't hold the write lock across the LLM call
+            last_message = messages[0]
+            job.update(
+                analysis=analysis,
+                clusters=clusters,
+                crossposted=crossposted,
+                duplicate_count=sum(dup for _, dup in clusters.values()),
+                last_message_id=last_message.id,
+                first_message_date=messages[-1].date,
+                last_unread_date=last_message.date,
+                last_message_text=analysis['last_message_text'],
+                last_message_type=last_message.type,
+                language=analysis['language'],
+                urgency_base=analysis['urgency_base'],
+                urgency_score=current_urgency(analysis['urgency_base'], last_message.date),
+                services=analysis['services'],
+                needs_followup=analysis['needs_followup'],
+            )
+            return job
+
+        async def summarize(job):
+            chat_id, last_message_id = job['chat_id'], job['last_message_id']
+            if not job['messages']:
+                return job
+            if only_duplicates(job['clusters'], job['new_ids']):
+                logging.info(f"Skipping reply for {job['name']}: only crossposted/duplicate messages")
+                return job
+            ai_reply = cached_reply(conn, chat_id, last_message_id, account)
+            if ai_reply is None and reply_policy.eager(job['urgency_score'], job['is_group'], job['is_broadcast']):
+                ai_reply = await generate_ai_reply(job['last_message_text'], job['services'])
+                save_reply(conn, chat_id, last_message_id, ai_reply, account)
+                if ai_reply.startswith("Error"):
+                    logging.error(f"AI reply for {job['name']} failed: {ai_reply}")
+                    ai_reply = None
+            # None (not generated, skipped or failed) is never sent: the dashboard drafts one on demand
+            job['ai_reply'] = ai_reply
+            return job
+
+        async def persist(job):
+            name, chat_id, messages, unread_count = job['name'], job['chat_id'], job['messages'], job['unread_count']
+            sender_id = sender_username = sender_name = "None"
             if messages:
-                first_message = messages[-1]
-                last_message = messages[0]
-                first_message_date = first_message.date
-                last_unread_date = last_message.date
-                last_message_text = last_message.text or f"[{classify_message_type(last_message)} message]"
-                last_message_type = classify_message_type(last_message)
-                language = detect_language(last_message.text or "")
-                urgency_score = calculate_urgency(last_message, is_group)
-                services = detect_service_opportunities(last_message.text)
-                needs_followup_flag = needs_followup(last_message.text, last_reply_date)
-                ai_reply = await generate_ai_reply(last_message_text, services)
-
-                sender = await last_message.get_sender()
+                sender = job['sender']
                 sender_id = sender.id if sender else "Unknown"
                 sender_username = getattr(sender, 'username', None) or "None"
                 sender_name = getattr(sender, 'first_name', 'Unknown')
 
-                if services:
-                    for service in services:
-                        c.execute('INSERT OR IGNORE INTO opportunities (chat_id, message_id, service, timestamp) VALUES (?, ?, ?, ?)',
-                                  (chat_id, last_message.id, service, last_unread_date))
-
-                await write_messages_to_file(filepath, messages, unread_count, urgency_score)
+                safe_name = re.sub(r'[^\w]', '_', name)
+                filepath = os.path.join(MESSAGE_DIR, f"{chat_id}_{safe_name}.txt")
+                clusters = job['clusters']
+                await write_messages_to_file(filepath, messages, unread_count, job['urgency_score'], clusters,
+                                             job['crossposted'])
+                keep = [i for i, msg in enumerate(messages) if not clusters.get(msg.id, (None, False))[1]]
+                search_index.add([(chat_id, messages[i].id, messages[i].text) for i in keep],
+                                 job['analysis']['vectors'][keep])
             else:
                 logging.warning(f"No messages fetched for {name}, unread count: {unread_count}")
 
-            c.execute('INSERT OR REPLACE INTO chats (chat_id, name, is_group, last_message_date, urgency_score, needs_followup) VALUES (?, ?, ?, ?, ?, ?)',
-                      (chat_id, name, is_group, last_unread_date, urgency_score, needs_followup_flag))
-            conn.commit()
+            first_message_date, last_unread_date = job['first_message_date'], job['last_unread_date']
+            # One transaction with no await inside: the other stages commit on the same connection
+            with conn:
+                for service in job['services']:
+                    c.execute('INSERT OR IGNORE INTO opportunities (chat_id, message_id, service, timestamp, account) VALUES (?, ?, ?, ?, ?)',
+                              (chat_id, job['last_message_id'], service, last_unread_date, account))
+                save_chat(conn, {'chat_id': chat_id, 'name': name, 'is_group': job['is_group'],
+                                 'last_message_date': last_unread_date, 'urgency_score': job['urgency_score'],
+                                 'urgency_base': job['urgency_base'], 'needs_followup': job['needs_followup'],
+                                 'account': account, 'unread_count': unread_count, 'needs_deep_sync': False})
 
             return {
                 "Chat Name": name,
                 "Chat ID": chat_id,
-                "Is Group": is_group,
+                "Is Group": job['is_group'],
                 "Unread Count": unread_count,
-                "Urgency Score": urgency_score,
-                "Needs Followup": needs_followup_flag,
-                "Service Opportunities": ", ".join(services) if services else "None",
+                "Urgency Score": job['urgency_score'],
+                "Urgency Base": job['urgency_base'],
+                "Needs Followup": job['needs_followup'],
+                "Service Opportunities": ", ".join(job['services']) if job['services'] else "None",
                 "First Message Date": first_message_date,
                 "Last Unread Message Date": last_unread_date,
                 "Duration Unread (min)": (last_unread_date - first_message_date).total_seconds() / 60 if messages else 0,
                 "Last Sender ID": sender_id,
                 "Last Sender Username": sender_username,
                 "Last Sender Name": sender_name,
-                "Last Message Type": last_message_type,
-                "Language": language,
-                "Last Message Text": last_message_text,
-                "AI Reply": ai_reply
+                "Last Message Type": job['last_message_type'],
+                "Language": job['language'],
+                "Duplicate Messages": job['duplicate_count'],
+                "Last Message ID": job['last_message_id'],
+                "Last Message Text": job['last_message_text'],
+                "AI Reply": job['ai_reply']
             }
 
-        tasks = [process_dialog(dialog) for dialog in dialogs]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        log = [r for r in results if r and not isinstance(r, Exception)]
+        sync = Pipeline.from_config({'fetch': fetch, 'analyze': analyze, 'summarize': summarize, 'persist': persist})
+        log = await sync.run(dialogs)
+        logging.info(f"Pipeline stats: {sync.stats()}")
+        logging.info(f"Analysis pool: {pool.stats()}")
+        pool.shutdown()
+        downsample(conn)
+        run_maintenance(conn)
 
     try:
         await client.disconnect()
@@ -289,6 +414,7 @@ async def fetch_data() -> Tuple[int, int, List[Dict]]:
 
 # === CSV Export ===
 def export_to_csv(log: List[Dict], filename: str):
+    import pandas as pd
     df = pd.DataFrame(log)
     df.to_csv(filename, index=False)
 
@@ -0,0 +1,51 @@
+"""
+Urgency scoring split into a static part and a time-decayed part.
+
+The fetchers store only the static components (keyword hits, known contact,
+group bonus) as the urgency base, together with the last message date. The
+recency bonus, which decays by one point every RECENCY_STEP_MINUTES, is added
+at read time so the dashboard never shows a score frozen at fetch time.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:  # numpy/pandas are only needed by the vectorised path
+    import numpy as np
+    import pandas as pd
+
+MAX_SCORE = 100
+RECENCY_MAX_BONUS = 30
+RECENCY_STEP_MINUTES = 10
+
+
+def current_urgency(base: int, message_date: Optional[datetime], now: Optional[datetime] = None) -> int:
+    """Scalar urgency for one message, as of `now` (default: the current time)."""
+    if message_date is None:
+        return min(MAX_SCORE, base)
+    now = now or datetime.now(message_date.tzinfo)
+    minutes = (now - message_date).total_seconds() / 60
+    return min(MAX_SCORE, base + max(0, RECENCY_MAX_BONUS - int(minutes / RECENCY_STEP_MINUTES)))
+
+def live_urgency(base: pd.Series, last_date: pd.Series, now: Optional[pd.Timestamp] = None) -> np.ndarray:
+    """Vectorised current_urgency over whole columns; NaT dates get no bonus."""
+    import numpy as np
+    import pandas as pd
+    now = now if now is not None else pd.Timestamp.now(tz='UTC')
+    minutes = (now - last_date).dt.total_seconds().to_numpy() / 60
+    bonus = np.clip(RECENCY_MAX_BONUS - np.trunc(minutes / RECENCY_STEP_MINUTES), 0, RECENCY_MAX_BONUS)
+    score = base.fillna(0).to_numpy(dtype=float) + np.nan_to_num(bonus)
+    return np.minimum(MAX_SCORE, score).astype(int)
+
+def with_live_urgency(df: pd.DataFrame, now: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Return df with 'Urgency Score' recomputed from 'Urgency Base' as of now.
+
+    Frames exported before the base was stored are returned unchanged.
+    """
+    if df is None or 'Urgency Base' not in df.columns:
+        return df
+    df = df.copy()
+    df['Urgency Score'] = live_urgency(df['Urgency Base'], df['Last Unread Message Date'], now)
+    return df